@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import socket
+import argparse
+import itertools
+import threading
+from typing import List
+
+import numpy as np
+
+import protocol  # local module
+from shm_tensors import create_shared_buffer, read_tensors, write_tensors, encode_specs, decode_specs  # local module
+
+
+class InferenceClient:
+    """Client for server.py. Creates and registers one input and one output shared memory
+    buffer, so each client has at most one request in flight; use one client per thread.
+
+    Parameters
+    ----------
+    socket_path: str
+        Path of the server's Unix domain socket.
+    input_bytes: int
+        Size of the input buffer, must fit all input tensors of one request.
+    output_bytes: int
+        Size of the output buffer, must fit all output tensors of one request.
+    """
+
+    def __init__(self, socket_path: str = protocol.DEFAULT_SOCKET, input_bytes: int = 64 * 2**20,
+                 output_bytes: int = 64 * 2**20):
+        self.input_buffer = create_shared_buffer(input_bytes)
+        self.output_buffer = create_shared_buffer(output_bytes)
+        self.request_ids = itertools.count()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self._request(protocol.REGISTER, protocol.encode_names(self.input_buffer.name, self.output_buffer.name))
+
+    def _recv_exactly(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def _request(self, message_type: int, payload: bytes) -> bytes:
+        request_id = next(self.request_ids)
+        self.socket.sendall(protocol.pack_header(message_type, len(payload), request_id) + payload)
+        _, status, payload_length, response_id = protocol.unpack_header(self._recv_exactly(protocol.HEADER.size))
+        response = self._recv_exactly(payload_length) if payload_length else b""
+        if response_id != request_id:
+            raise ConnectionError("Expected response to request {}, got {}".format(request_id, response_id))
+        if status != protocol.STATUS_OK:
+            raise RuntimeError("Server error: {}".format(response.decode("utf-8")))
+        return response
+
+    def infer(self, host_inputs: List[np.ndarray], copy: bool = True) -> List[np.ndarray]:
+        """Runs one request. With copy=False the outputs are views of the output buffer,
+        which are only valid until the next request."""
+        input_specs = write_tensors(self.input_buffer.buf, host_inputs)
+        output_specs = decode_specs(self._request(protocol.INFER, encode_specs(input_specs)))
+        return read_tensors(self.output_buffer.buf, output_specs, copy=copy)
+
+    def close(self):
+        self.socket.close()
+        for buffer in (self.input_buffer, self.output_buffer):
+            buffer.close()
+            buffer.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def benchmark(socket_path, shape, num_requests, num_clients):
+    """Sends `num_requests` requests from each of `num_clients` threads and returns the latencies in seconds."""
+    host_input = np.random.random(shape).astype(np.float32)
+    buffer_bytes = max(2**20, 2 * host_input.nbytes)
+    latencies = [[] for _ in range(num_clients)]
+
+    def run(client_index):
+        with InferenceClient(socket_path, buffer_bytes, buffer_bytes) as client:
+            for _ in range(num_requests):
+                start = time.perf_counter()
+                client.infer([host_input], copy=False)
+                latencies[client_index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.concatenate([np.array(l) for l in latencies])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks a running server.py with random inputs.")
+    parser.add_argument("--socket", type=str, default=protocol.DEFAULT_SOCKET, help="Path of the server's Unix domain socket.")
+    parser.add_argument("--shape", type=int, nargs="+", default=[1, 3, 224, 224], help="Input shape to send.")
+    parser.add_argument("-n", "--num-requests", type=int, default=1000, help="Requests to send per client.")
+    parser.add_argument("-c", "--clients", type=int, default=1, help="Number of concurrent clients.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    latencies = benchmark(args.socket, args.shape, args.num_requests, args.clients)
+    elapsed = time.perf_counter() - start
+
+    print("Requests: {} from {} clients in {:.2f}s ({:.1f} requests/s)".format(
+        len(latencies), args.clients, elapsed, len(latencies) / elapsed))
+    print("Latency (ms): p50 {:.3f} | p90 {:.3f} | p99 {:.3f} | max {:.3f}".format(
+        *(1000 * np.percentile(latencies, [50, 90, 99, 100]))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import glob
+import json
+import argparse
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+# Golden files store inputs and outputs under these key prefixes
+INPUT_PREFIX = "inputs/"
+OUTPUT_PREFIX = "outputs/"
+
+
+class OutputStats:
+    """Running error statistics between actual and reference values of one output.
+
+    Batches are folded into the statistics as they arrive, so memory use doesn't
+    depend on the number of batches compared.
+    """
+
+    def __init__(self, k: int = 5, atol: float = 1e-3, rtol: float = 1e-3, eps: float = 1e-7):
+        self.k = k
+        self.atol = atol
+        self.rtol = rtol
+        self.eps = eps
+        self.elements = 0
+        self.samples = 0
+        self.max_abs = 0.0
+        self.sum_abs = 0.0
+        self.max_rel = 0.0
+        self.sum_rel = 0.0
+        self.mismatches = 0
+        self.sum_cosine = 0.0
+        self.min_cosine = 1.0
+        self.top1_matches = 0
+        self.topk_overlap = 0.0
+
+    def update(self, actual: np.ndarray, reference: np.ndarray):
+        if actual.shape != reference.shape:
+            raise ValueError("Shape mismatch: actual {} vs reference {}".format(actual.shape, reference.shape))
+
+        actual = np.asarray(actual, dtype=np.float64)
+        reference = np.asarray(reference, dtype=np.float64)
+        abs_error = np.abs(actual - reference)
+        rel_error = abs_error / (np.abs(reference) + self.eps)
+
+        self.elements += abs_error.size
+        self.max_abs = max(self.max_abs, float(abs_error.max(initial=0.0)))
+        self.sum_abs += float(abs_error.sum())
+        self.max_rel = max(self.max_rel, float(rel_error.max(initial=0.0)))
+        self.sum_rel += float(rel_error.sum())
+        self.mismatches += int(np.count_nonzero(abs_error > self.atol + self.rtol * np.abs(reference)))
+
+        # Per-sample metrics treat the first dimension as the batch dimension
+        if actual.ndim == 0:
+            return
+        actual = actual.reshape(actual.shape[0], -1)
+        reference = reference.reshape(reference.shape[0], -1)
+        self.samples += actual.shape[0]
+
+        actual_norms = np.linalg.norm(actual, axis=1)
+        reference_norms = np.linalg.norm(reference, axis=1)
+        norms = actual_norms * reference_norms
+        dots = np.einsum("ij,ij->i", actual, reference)
+        # Two zero rows agree, a zero row against a non-zero one (ex: INT8 underflow) doesn't
+        both_zero = (actual_norms == 0) & (reference_norms == 0)
+        cosine = np.where(norms > 0, dots / np.maximum(norms, self.eps), np.where(both_zero, 1.0, 0.0))
+        self.sum_cosine += float(cosine.sum())
+        self.min_cosine = min(self.min_cosine, float(cosine.min(initial=1.0)))
+
+        k = min(self.k, actual.shape[1])
+        top_actual = np.argpartition(-actual, k-1, axis=1)[:, :k]
+        top_reference = np.argpartition(-reference, k-1, axis=1)[:, :k]
+        self.top1_matches += int(np.count_nonzero(actual.argmax(axis=1) == reference.argmax(axis=1)))
+        overlap = (top_actual[:, :, None] == top_reference[:, None, :]).any(axis=2).sum(axis=1)
+        self.topk_overlap += float(overlap.sum()) / k
+
+    def summary(self) -> Dict[str, float]:
+        summary = {
+            "elements": self.elements,
+            "max_abs_error": self.max_abs,
+            "mean_abs_error": self.sum_abs / max(self.elements, 1),
+            "max_rel_error": self.max_rel,
+            "mean_rel_error": self.sum_rel / max(self.elements, 1),
+            "mismatches": self.mismatches,
+            "passed": self.mismatches == 0,
+        }
+        if self.samples:
+            summary.update({
+                "samples": self.samples,
+                "mean_cosine": self.sum_cosine / self.samples,
+                "min_cosine": self.min_cosine,
+                "top1_agreement": self.top1_matches / self.samples,
+                "top{}_overlap".format(self.k): self.topk_overlap / self.samples,
+            })
+        return summary
+
+
+class OutputComparator:
+    """Compares named outputs batch by batch, see OutputStats."""
+
+    def __init__(self, **stats_kwargs):
+        self.stats_kwargs = stats_kwargs
+        self.stats = {}
+
+    def update(self, actual: Dict[str, np.ndarray], reference: Dict[str, np.ndarray]):
+        for name, reference_output in reference.items():
+            if name not in actual:
+                raise KeyError("Output [{}] missing from actual outputs: {}".format(name, list(actual)))
+            if name not in self.stats:
+                self.stats[name] = OutputStats(**self.stats_kwargs)
+            self.stats[name].update(actual[name], reference_output)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {name: stats.summary() for name, stats in self.stats.items()}
+
+
+def split_golden(data) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    inputs = {k[len(INPUT_PREFIX):]: data[k] for k in data if k.startswith(INPUT_PREFIX)}
+    outputs = {k[len(OUTPUT_PREFIX):]: data[k] for k in data if k.startswith(OUTPUT_PREFIX)}
+    return inputs, outputs
+
+
+def iterate_golden(directory: str) -> Iterator[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]]:
+    """Yields (inputs, outputs) from each golden .npz file in `directory`, one file at a time."""
+    for filename in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+        with np.load(filename) as data:
+            yield split_golden(data)
+
+
+def save_golden(directory: str, index: int, inputs: Dict[str, np.ndarray], outputs: Dict[str, np.ndarray]):
+    arrays = {INPUT_PREFIX + name: value for name, value in inputs.items()}
+    arrays.update({OUTPUT_PREFIX + name: value for name, value in outputs.items()})
+    np.savez(os.path.join(directory, "batch_{:06d}.npz".format(index)), **arrays)
+
+
+class OnnxRuntimeBackend:
+    """Reference backend running the ONNX model with ONNX Runtime on CPU."""
+
+    def __init__(self, onnx_path: str):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self.output_names = [out.name for out in self.session.get_outputs()]
+
+    def __call__(self, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        outputs = self.session.run(self.output_names, inputs)
+        return dict(zip(self.output_names, outputs))
+
+
+class EngineBackend:
+    """TensorRT engine backend, see infer.EngineRunner."""
+
+    def __init__(self, engine_path: str, profile_index: int = 0):
+        import infer  # local module
+        self.infer = infer
+        self.engine = infer.load_engine(engine_path)
+        self.runner = infer.EngineRunner(self.engine, profile_index)
+
+    def random_inputs(self, seed: int) -> Dict[str, np.ndarray]:
+        host_inputs = self.infer.get_random_inputs(self.engine, self.runner.context, self.runner.input_binding_idxs, seed=seed)
+        return dict(zip(self.runner.input_names, host_inputs))
+
+    def __call__(self, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        host_outputs = self.runner.infer([inputs[name] for name in self.runner.input_names])
+        return dict(zip(self.runner.output_names, host_outputs))
+
+
+def print_summary(summary: Dict[str, Dict[str, float]]):
+    for name, stats in summary.items():
+        print("Output [{}]: {}".format(name, "PASSED" if stats["passed"] else "FAILED"))
+        for key, value in stats.items():
+            if key != "passed":
+                print("\t{}: {}".format(key, value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares TensorRT engine outputs against ONNX Runtime (CPU) "
+                                                 "or saved golden outputs.")
+    parser.add_argument("-e", "--engine", type=str, help="Path to TensorRT engine file to check.")
+    parser.add_argument("--actual-golden", type=str,
+                        help="Directory of saved outputs to check instead of running --engine (no GPU required).")
+    parser.add_argument("--onnx", type=str, help="ONNX model to run with ONNX Runtime as the reference.")
+    parser.add_argument("--golden", type=str, help="Directory of golden .npz files (inputs + reference outputs).")
+    parser.add_argument("--inputs", type=str, help="Directory of .npz input files keyed by input name. "
+                                                   "Defaults to random inputs (see infer.get_random_inputs).")
+    parser.add_argument("--save-golden", type=str, help="Save inputs and reference outputs to this directory as golden files.")
+    parser.add_argument("-n", "--num-batches", type=int, default=10, help="Number of random input batches to compare.")
+    parser.add_argument("-s", "--seed", type=int, default=42, help="Random seed of the first random batch.")
+    parser.add_argument("-k", "--top-k", type=int, default=5, help="k for the top-k agreement metric.")
+    parser.add_argument("--atol", type=float, default=1e-3, help="Absolute tolerance for counting mismatches.")
+    parser.add_argument("--rtol", type=float, default=1e-3, help="Relative tolerance for counting mismatches.")
+    parser.add_argument("--profile", type=int, default=0, help="Optimization profile of the engine to use.")
+    parser.add_argument("-o", "--output", type=str, help="Write the summary to this JSON file.")
+    args = parser.parse_args()
+
+    if bool(args.onnx) == bool(args.golden):
+        parser.error("Exactly one of --onnx or --golden is required as the reference")
+    if bool(args.engine) == bool(args.actual_golden):
+        parser.error("Exactly one of --engine or --actual-golden is required")
+
+    engine = EngineBackend(args.engine, args.profile) if args.engine else None
+    reference = OnnxRuntimeBackend(args.onnx) if args.onnx else None
+
+    # Each item is (inputs, reference outputs or None, actual outputs or None)
+    if args.golden:
+        batches = ((inputs, outputs, None) for inputs, outputs in iterate_golden(args.golden))
+    elif args.inputs:
+        batches = ((dict(np.load(f)), None, None) for f in sorted(glob.glob(os.path.join(args.inputs, "*.npz"))))
+    elif engine:
+        batches = ((engine.random_inputs(args.seed + i), None, None) for i in range(args.num_batches))
+    else:
+        batches = ((inputs, None, None) for inputs, _ in iterate_golden(args.actual_golden))
+
+    if args.actual_golden:
+        actual_outputs = (outputs for _, outputs in iterate_golden(args.actual_golden))
+        batches = ((inputs, ref, actual) for (inputs, ref, _), actual in zip(batches, actual_outputs))
+
+    if args.save_golden:
+        os.makedirs(args.save_golden, exist_ok=True)
+
+    comparator = OutputComparator(k=args.top_k, atol=args.atol, rtol=args.rtol)
+    num_batches = 0
+    for i, (inputs, reference_outputs, actual_outputs) in enumerate(batches):
+        if reference_outputs is None:
+            reference_outputs = reference(inputs)
+        if actual_outputs is None:
+            actual_outputs = engine(inputs)
+        comparator.update(actual_outputs, reference_outputs)
+        if args.save_golden:
+            save_golden(args.save_golden, i, inputs, reference_outputs)
+        num_batches += 1
+
+    print("Compared {} batches".format(num_batches))
+    summary = comparator.summary()
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+
+    sys.exit(0 if all(stats["passed"] for stats in summary.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import ctypes
+import argparse
+import collections
+from typing import List, Tuple
+
+import numpy as np
+
+from instrumentation import metrics  # local module
+
+
+def graph_key(profile_index: int, shapes) -> Tuple[int, Tuple[Tuple[int, ...], ...]]:
+    """Graphs bake in buffer addresses and shapes, so one is captured per (profile, input shapes)."""
+    return profile_index, tuple(tuple(int(dim) for dim in shape) for shape in shapes)
+
+
+class GraphCache:
+    """LRU cache of captured graphs, independent of how graphs are captured or launched.
+
+    Parameters
+    ----------
+    backend:
+        Object with `capture(key) -> graph` (raising on failure) and `destroy(graph)`.
+        See CudaGraphBackend, or FakeGraphBackend to exercise the cache without a GPU.
+    max_graphs: int
+        Captured graphs to keep. The least recently used graphs are destroyed before capturing
+        a new one beyond this, ex: 1 when capturing invalidates the previous graph.
+    """
+
+    def __init__(self, backend, max_graphs: int = 8):
+        self.backend = backend
+        self.max_graphs = max_graphs
+        self.graphs = collections.OrderedDict()
+        self.failed = set()
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self.graphs)
+
+    def __contains__(self, key):
+        return key in self.graphs
+
+    def get(self, key):
+        """Returns the graph for `key`, capturing it on a miss, or None if it can't be captured
+        (the caller should fall back to regular execution)."""
+        if key in self.graphs:
+            self.stats["hits"] += 1
+            self.graphs.move_to_end(key)
+            return self.graphs[key]
+
+        self.stats["misses"] += 1
+        if key in self.failed:
+            return None
+        while len(self.graphs) >= self.max_graphs:
+            _, evicted = self.graphs.popitem(last=False)
+            self.backend.destroy(evicted)
+            self.stats["evictions"] += 1
+        try:
+            graph = self.backend.capture(key)
+        except Exception as e:
+            print("WARNING: Failed to capture graph for {}, falling back: {}".format(key, e))
+            self.stats["capture_failures"] += 1
+            self.failed.add(key)
+            return None
+
+        self.stats["captures"] += 1
+        self.graphs[key] = graph
+        return graph
+
+    def invalidate(self, predicate=None):
+        """Destroys the graphs whose key matches `predicate` (all of them by default), ex: after
+        a profile's context changed. Failed captures are forgotten too, so they are retried."""
+        for key in [key for key in self.graphs if predicate is None or predicate(key)]:
+            self.backend.destroy(self.graphs.pop(key))
+            self.stats["invalidations"] += 1
+        self.failed = {key for key in self.failed if predicate is not None and not predicate(key)}
+
+    def clear(self):
+        """Destroys every graph, but keeps remembering failed captures so they aren't retried."""
+        while self.graphs:
+            self.backend.destroy(self.graphs.popitem(last=False)[1])
+
+
+class FakeGraphBackend:
+    """CPU stand-in for CudaGraphBackend: "captures" by recording the key, so GraphCache
+    keying, eviction, invalidation and fallback can be exercised without a GPU."""
+
+    def __init__(self, fail_keys=()):
+        self.fail_keys = set(fail_keys)
+        self.captured = []
+        self.destroyed = []
+
+    def capture(self, key):
+        if key in self.fail_keys:
+            raise RuntimeError("capture failed")
+        self.captured.append(key)
+        return {"key": key}
+
+    def destroy(self, graph):
+        self.destroyed.append(graph["key"])
+
+
+def _check(result):
+    """cuda-python calls return (error, *values)"""
+    from cuda import cudart
+    error, values = result[0], result[1:]
+    if error != cudart.cudaError_t.cudaSuccess:
+        raise RuntimeError("CUDA error: {}".format(error))
+    return values[0] if len(values) == 1 else values
+
+
+def _host_array(pointer: int, shape, dtype) -> np.ndarray:
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return np.ctypeslib.as_array((ctypes.c_byte * nbytes).from_address(pointer)).view(dtype).reshape(shape)
+
+
+class CapturedGraph:
+    """An instantiated graph with the pinned host and device buffers it was captured with."""
+
+    def __init__(self, graph, graph_exec, host_inputs, host_outputs, allocations):
+        self.graph = graph
+        self.graph_exec = graph_exec
+        self.host_inputs = host_inputs
+        self.host_outputs = host_outputs
+        self.allocations = allocations
+
+
+class CudaGraphBackend:
+    """Captures H2D copies + TensorRT enqueue + D2H copies of one execution context into a CUDA
+    graph (with cuda-python's runtime API), using dedicated pinned host and device buffers."""
+
+    def __init__(self, engine, context, stream: int, input_binding_idxs: List[int], output_binding_idxs: List[int]):
+        self.engine = engine
+        self.context = context
+        self.stream = stream
+        self.input_binding_idxs = input_binding_idxs
+        self.output_binding_idxs = output_binding_idxs
+
+    def capture(self, key) -> CapturedGraph:
+        from cuda import cudart
+        import tensorrt as trt
+
+        _, input_shapes = key
+        for binding_index, shape in zip(self.input_binding_idxs, input_shapes):
+            self.context.set_binding_shape(binding_index, shape)
+        if not self.context.all_binding_shapes_specified:
+            raise RuntimeError("Not all binding shapes were specified")
+
+        allocations = []
+
+        def allocate(binding_index, shape):
+            dtype = trt.nptype(self.engine.get_binding_dtype(binding_index))
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            host = _check(cudart.cudaMallocHost(nbytes))
+            allocations.append(("host", host))
+            device = _check(cudart.cudaMalloc(nbytes))
+            allocations.append(("device", device))
+            return _host_array(host, tuple(shape), dtype), host, device, nbytes
+
+        try:
+            inputs = [allocate(idx, shape) for idx, shape in zip(self.input_binding_idxs, input_shapes)]
+            outputs = [allocate(idx, tuple(self.context.get_binding_shape(idx))) for idx in self.output_binding_idxs]
+            bindings = [0] * self.engine.num_bindings
+            for binding_index, (_, _, device, _) in zip(self.input_binding_idxs + self.output_binding_idxs, inputs + outputs):
+                bindings[binding_index] = device
+
+            # TensorRT may do some one-time setup on the first enqueue after a shape change,
+            # which can't happen during capture
+            if not self.context.execute_async_v2(bindings, self.stream):
+                raise RuntimeError("Warm-up enqueue failed")
+            _check(cudart.cudaStreamSynchronize(self.stream))
+
+            _check(cudart.cudaStreamBeginCapture(self.stream, cudart.cudaStreamCaptureMode.cudaStreamCaptureModeThreadLocal))
+            try:
+                for _, host, device, nbytes in inputs:
+                    _check(cudart.cudaMemcpyAsync(device, host, nbytes, cudart.cudaMemcpyKind.cudaMemcpyHostToDevice, self.stream))
+                enqueued = self.context.execute_async_v2(bindings, self.stream)
+                for _, host, device, nbytes in outputs:
+                    _check(cudart.cudaMemcpyAsync(host, device, nbytes, cudart.cudaMemcpyKind.cudaMemcpyDeviceToHost, self.stream))
+            finally:
+                graph = _check(cudart.cudaStreamEndCapture(self.stream))
+            if not enqueued:
+                _check(cudart.cudaGraphDestroy(graph))
+                raise RuntimeError("Enqueue failed during capture")
+            graph_exec = _check(cudart.cudaGraphInstantiate(graph, 0))
+        except Exception:
+            self._free(allocations)
+            raise
+
+        return CapturedGraph(graph, graph_exec, [i[0] for i in inputs], [o[0] for o in outputs], allocations)
+
+    def launch(self, graph: CapturedGraph):
+        from cuda import cudart
+        _check(cudart.cudaGraphLaunch(graph.graph_exec, self.stream))
+        _check(cudart.cudaStreamSynchronize(self.stream))
+
+    def destroy(self, graph: CapturedGraph):
+        from cuda import cudart
+        _check(cudart.cudaGraphExecDestroy(graph.graph_exec))
+        _check(cudart.cudaGraphDestroy(graph.graph))
+        self._free(graph.allocations)
+
+    @staticmethod
+    def _free(allocations):
+        from cuda import cudart
+        for kind, pointer in allocations:
+            _check(cudart.cudaFreeHost(pointer) if kind == "host" else cudart.cudaFree(pointer))
+
+
+class CudaGraphRunner:
+    """Drop-in replacement for infer.EngineRunner that replays a captured CUDA graph of its
+    profile's current input shapes, removing most of the per-call launch overhead for small batches.
+
+    TensorRT 7 only allows one execution context per profile, and changing a context's shapes
+    after capturing makes launching its earlier graphs undefined. So graphs are captured on the
+    fallback infer.EngineRunner's context, and only one is kept: a new shape destroys it before
+    capturing the next one, and so does running the fallback for a shape that can't be captured.
+
+    Engines whose inputs all have fixed shapes are captured once up front. With dynamic shapes,
+    graphs pay off when most requests share a shape (ex: padded batches, see shape_router.py),
+    since each shape change costs a capture.
+
+    NOTE: Like EngineRunner, the returned host outputs are overwritten by the next call with the
+    same shapes, copy them if they need to be kept around.
+    """
+
+    def __init__(self, engine, profile_index: int = 0):
+        from cuda import cudart
+        import infer  # local module
+
+        self.engine = engine
+        self.profile_index = profile_index
+        self.fallback = infer.EngineRunner(engine, profile_index)
+        self.input_binding_idxs = self.fallback.input_binding_idxs
+        self.output_binding_idxs = self.fallback.output_binding_idxs
+        self.input_names = self.fallback.input_names
+        self.output_names = self.fallback.output_names
+
+        self.context = self.fallback.context
+        self.stream = _check(cudart.cudaStreamCreate())
+        self.backend = CudaGraphBackend(engine, self.context, self.stream, self.input_binding_idxs, self.output_binding_idxs)
+        self.graphs = GraphCache(self.backend, max_graphs=1)
+
+        shapes = [engine.get_binding_shape(idx) for idx in self.input_binding_idxs]
+        if all(infer.is_fixed(shape) for shape in shapes):
+            self._get_graph(graph_key(profile_index, shapes))
+
+    def _get_graph(self, key):
+        if key in self.graphs:
+            return self.graphs.get(key)
+        graph = self.graphs.get(key)
+        # Capturing set the context's shapes behind the fallback's back
+        self.fallback.input_shapes = None
+        return graph
+
+    def infer_eager(self, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        """Runs the fallback EngineRunner, destroying the current graph since its context may change."""
+        self.graphs.clear()
+        return self.fallback.infer(host_inputs)
+
+    def infer(self, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        graph = self._get_graph(graph_key(self.profile_index, [h_input.shape for h_input in host_inputs]))
+        if graph is None:
+            metrics.count("cuda_graph_fallbacks")
+            return self.infer_eager(host_inputs)
+
+        for staging, h_input in zip(graph.host_inputs, host_inputs):
+            np.copyto(staging, h_input, casting="same_kind")
+        with metrics.timer("cuda_graph_launch"):
+            self.backend.launch(graph)
+        return graph.host_outputs
+
+    def close(self):
+        from cuda import cudart
+        self.graphs.invalidate()
+        _check(cudart.cudaStreamDestroy(self.stream))
+
+
+def get_runner(engine, profile_index: int = 0, cuda_graphs: bool = False):
+    """Returns a CudaGraphRunner if `cuda_graphs` is set and cuda-python is installed, an infer.EngineRunner otherwise."""
+    import infer  # local module
+    if cuda_graphs:
+        try:
+            return CudaGraphRunner(engine, profile_index)
+        except ImportError:
+            print("WARNING: cuda-python is required for CUDA graphs (pip install cuda-python), using regular execution")
+    return infer.EngineRunner(engine, profile_index)
+
+
+def latency_percentiles(run, iterations: int, warmup: int = 10):
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return 1000 * np.percentile(timings, [50, 90, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares regular execution with CUDA graph replay for an engine's profile.")
+    parser.add_argument("-e", "--engine", required=True, type=str, help="Path to TensorRT engine file.")
+    parser.add_argument("--profile", type=int, default=0, help="Optimization profile to run with.")
+    parser.add_argument("-b", "--batch-size", type=int, default=None, help="(Dynamic shapes only) Batch size. Defaults to kOPT.")
+    parser.add_argument("-n", "--iterations", type=int, default=1000, help="Timed iterations.")
+    args = parser.parse_args()
+
+    import infer  # local module
+    engine = infer.load_engine(args.engine)
+    runner = CudaGraphRunner(engine, args.profile)
+    host_inputs = []
+    for idx in runner.input_binding_idxs:
+        shape = list(engine.get_profile_shape(args.profile, idx)[1])
+        if args.batch_size:
+            shape[0] = args.batch_size
+        host_inputs.append(np.random.random(shape).astype(np.float32))
+
+    expected = [o.copy() for o in runner.infer_eager(host_inputs)]
+    actual = runner.infer(host_inputs)
+    print("Graph outputs match: {}".format(all(np.allclose(e, a, rtol=1e-3, atol=1e-3) for e, a in zip(expected, actual))))
+
+    # Eager first: running it destroys the graph
+    for name, run in (("execute_v2", lambda: runner.infer_eager(host_inputs)), ("cuda graph", lambda: runner.infer(host_inputs))):
+        p50, p90, p99 = latency_percentiles(run, args.iterations)
+        print("{:<12} p50 {:.3f} ms | p90 {:.3f} ms | p99 {:.3f} ms".format(name, p50, p90, p99))
+    print("Graph cache: {}".format(dict(runner.graphs.stats)))
+    runner.close()
+
+
+if __name__ == "__main__":
+    main()
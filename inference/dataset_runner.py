@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import glob
+import time
+import queue
+import argparse
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from postprocessing import LabelTable, TopKCsvWriter, TopKJsonlWriter  # local module
+
+# processing.py (pre-processing functions) lives with the calibration scripts
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "int8", "calibration")
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+
+
+def get_preprocess_func(name: str, draft: bool = False, resize_filter: str = None):
+    """Returns the function called `name` from int8/calibration/processing.py, see processing.get_preprocess_func()"""
+    if CALIBRATION_DIR not in sys.path:
+        sys.path.append(CALIBRATION_DIR)
+    import processing  # local module
+    return processing.get_preprocess_func(name, draft, resize_filter)
+
+
+class ImageFolderSource:
+    """Images found recursively in a directory, decoded with a processing.py function."""
+
+    def __init__(self, directory: str, preprocess_func, sample_shape: Tuple[int]):
+        self.files = sorted(path for path in glob.iglob(os.path.join(directory, "**"), recursive=True)
+                            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+        self.preprocess_func = preprocess_func
+        self.sample_shape = tuple(sample_shape)
+
+    def __len__(self):
+        return len(self.files)
+
+    def key(self, index: int) -> str:
+        return self.files[index]
+
+    def load(self, index: int) -> np.ndarray:
+        from PIL import Image
+        with Image.open(self.files[index]) as image:
+            return self.preprocess_func(image, *self.sample_shape)
+
+
+class ArraySource:
+    """Samples along the first dimension of an array that is only read from disk on access:
+    a .npy file, one array of an .npz file, or a raw tensor file of known dtype/sample shape."""
+
+    def __init__(self, path: str, key: str = None, sample_shape: Tuple[int] = None, dtype: str = "float32"):
+        if path.endswith(".npy"):
+            self.array = np.load(path, mmap_mode="r")
+        elif path.endswith(".npz"):
+            # Arrays inside .npz archives can't be memory mapped, they're loaded on first use
+            archive = np.load(path)
+            self.array = archive[key or archive.files[0]]
+        else:
+            if sample_shape is None:
+                raise ValueError("ERROR: The sample shape is required for raw tensor file: {}".format(path))
+            self.array = np.memmap(path, dtype=dtype, mode="r").reshape(-1, *sample_shape)
+        self.path = path
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def key(self, index: int) -> str:
+        return "{}:{}".format(self.path, index)
+
+    def load(self, index: int) -> np.ndarray:
+        return self.array[index]
+
+
+def decode_parallel(source, num_workers: int = 4, window: int = 64) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yields (index, sample) for every sample in `source`, in order, decoding up to `window`
+    samples ahead on a thread pool. Only `window` futures are ever in flight, so memory use
+    doesn't grow with the dataset size."""
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = collections.deque()
+        for index in range(len(source)):
+            pending.append((index, executor.submit(source.load, index)))
+            if len(pending) >= window:
+                index, future = pending.popleft()
+                yield index, future.result()
+        while pending:
+            index, future = pending.popleft()
+            yield index, future.result()
+
+
+def batch_samples(samples: Iterator[Tuple[int, np.ndarray]], batch_size: int, sample_shape: Tuple[int],
+                  num_buffers: int = 4, dtype=np.float32) -> Iterator[Tuple[List[int], np.ndarray]]:
+    """Groups samples into batches written into a ring of `num_buffers` preallocated buffers.
+
+    Yields (indices, batch) where batch is a view of len(indices) rows. A yielded batch stays
+    valid until `num_buffers` - 1 more batches have been produced.
+    """
+    buffers = [np.empty((batch_size, *sample_shape), dtype=dtype) for _ in range(num_buffers)]
+    current, indices = 0, []
+    for index, sample in samples:
+        buffers[current][len(indices)] = sample
+        indices.append(index)
+        if len(indices) == batch_size:
+            yield indices, buffers[current]
+            current, indices = (current + 1) % num_buffers, []
+    if indices:
+        yield indices, buffers[current][:len(indices)]
+
+
+def prefetch(iterator: Iterator, depth: int = 2) -> Iterator:
+    """Runs `iterator` on a background thread, keeping at most `depth` items ready."""
+    items = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+class NpyWriter:
+    """Writes outputs incrementally into a memory mapped .npy file of known total size."""
+
+    def __init__(self, path: str, num_samples: int, sample_shape: Tuple[int], dtype=np.float32):
+        self.array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(num_samples, *sample_shape))
+
+    def write(self, indices: List[int], keys: List[str], outputs: np.ndarray):
+        # Batches are produced in order, so their indices are contiguous
+        self.array[indices[0]:indices[-1]+1] = outputs
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+
+def get_profile_batch_size(engine, profile_index: int, input_binding_idx: int) -> int:
+    """Returns the fixed batch size of the input, or the kMAX batch size of its profile if dynamic."""
+    shape = engine.get_binding_shape(input_binding_idx)
+    if shape[0] > 0:
+        return shape[0]
+    return engine.get_profile_shape(profile_index, input_binding_idx)[2][0]
+
+
+def run(runner, source, batch_size: int, sample_shape: Tuple[int], writers, fixed_batch: bool,
+        num_workers: int = 4, prefetch_depth: int = 2, log_every: int = 100):
+    """Streams every sample of `source` through `runner` (see infer.EngineRunner) and passes
+    each batch of outputs to `writers`, a list of (output_index, writer) pairs."""
+    samples = decode_parallel(source, num_workers, window=num_workers * 16)
+    batches = prefetch(batch_samples(samples, batch_size, sample_shape, num_buffers=prefetch_depth + 2), prefetch_depth)
+    padded = np.zeros((batch_size, *sample_shape), dtype=np.float32)
+
+    start = time.perf_counter()
+    processed = 0
+    for i, (indices, batch) in enumerate(batches):
+        rows = len(indices)
+        if fixed_batch and rows < batch_size:
+            # Fixed batch engines need a full batch, extra outputs are discarded
+            padded[:rows] = batch
+            batch = padded
+        outputs = runner.infer([batch])
+        keys = [source.key(index) for index in indices]
+        for output_index, writer in writers:
+            writer.write(indices, keys, outputs[output_index][:rows])
+
+        processed += rows
+        if log_every and (i + 1) % log_every == 0:
+            elapsed = time.perf_counter() - start
+            print("Processed {}/{} samples ({:.1f} samples/s)".format(processed, len(source), processed / elapsed))
+
+    elapsed = time.perf_counter() - start
+    print("Processed {} samples in {:.2f}s ({:.1f} samples/s)".format(processed, elapsed, processed / max(elapsed, 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streams a dataset through a TensorRT engine and writes outputs to disk.")
+    parser.add_argument("-e", "--engine", required=True, type=str, help="Path to TensorRT engine file.")
+    parser.add_argument("-d", "--data", required=True, type=str,
+                        help="Image directory, .npy/.npz file, or raw tensor file (see --raw-dtype) of input samples.")
+    parser.add_argument("-p", "--preprocess_func", type=str, default="preprocess_imagenet",
+                        help="(Images only) Function defined in 'int8/calibration/processing.py' to pre-process images with.")
+    parser.add_argument("--draft-decode", action="store_true", help="(Images only) Decode JPEGs at reduced resolution (PIL draft mode).")
+    parser.add_argument("--resize-filter", type=str, default=None, help="(Images only) Resize filter, see processing.RESIZE_FILTERS.")
+    parser.add_argument("--npz-key", type=str, default=None, help="(.npz only) Array in the archive to use. Defaults to the first.")
+    parser.add_argument("--raw-dtype", type=str, default="float32", help="(Raw files only) dtype of the tensor file.")
+    parser.add_argument("--profile", type=int, default=0, help="Optimization profile to run with.")
+    parser.add_argument("-b", "--batch-size", type=int, default=None,
+                        help="Batch size for dynamic shape engines. Defaults to the profile's kMAX batch size.")
+    parser.add_argument("--cuda-graphs", action="store_true",
+                        help="Replay a captured CUDA graph per batch shape instead of calling execute_v2, see cuda_graphs.py.")
+    parser.add_argument("-j", "--num-workers", type=int, default=4, help="Number of decode threads.")
+    parser.add_argument("--prefetch", type=int, default=2, help="Number of batches to prepare ahead of the engine.")
+    parser.add_argument("-o", "--output-prefix", type=str, default="outputs",
+                        help="Outputs are written to <prefix>.<output_name>.npy, <prefix>.topk.csv and/or <prefix>.topk.jsonl")
+    parser.add_argument("--format", nargs="+", choices=("npy", "topk", "jsonl"), default=["npy"],
+                        help="Output file formats. topk (CSV) and jsonl write the top-k classes of the first output.")
+    parser.add_argument("-k", "--top-k", type=int, default=5, help="(topk/jsonl only) Number of classes per sample.")
+    parser.add_argument("--softmax", action="store_true", help="(topk/jsonl only) Apply softmax to the outputs before top-k.")
+    parser.add_argument("--labels", type=str, default=None,
+                        help="(topk/jsonl only) Label file (one per line, ex: int8/calibration/labels/imagenet1k_labels.txt) to add class names.")
+    parser.add_argument("--metrics", type=str, default=None, help="Write H2D/execute/D2H timings to this file in Prometheus text format.")
+    parser.add_argument("--trace", type=str, default=None, help="Write the timed spans to this file as a Chrome trace (chrome://tracing).")
+    args = parser.parse_args()
+
+    import infer  # local module
+    from cuda_graphs import get_runner  # local module
+    from instrumentation import metrics  # local module
+    if args.metrics or args.trace:
+        metrics.enable()
+    engine = infer.load_engine(args.engine)
+    runner = get_runner(engine, args.profile, args.cuda_graphs)
+    if len(runner.input_binding_idxs) != 1:
+        raise Exception("ERROR: Only single input engines are supported, found inputs: {}".format(runner.input_names))
+
+    input_idx = runner.input_binding_idxs[0]
+    sample_shape = tuple(engine.get_profile_shape(args.profile, input_idx)[2][1:])
+    fixed_batch = infer.is_fixed(engine.get_binding_shape(input_idx))
+    batch_size = get_profile_batch_size(engine, args.profile, input_idx)
+    if args.batch_size and not fixed_batch:
+        batch_size = args.batch_size
+
+    if os.path.isdir(args.data):
+        source = ImageFolderSource(args.data, get_preprocess_func(args.preprocess_func, args.draft_decode, args.resize_filter), sample_shape)
+    else:
+        source = ArraySource(args.data, args.npz_key, sample_shape, args.raw_dtype)
+    print("Running {} samples from {} with batch size {}".format(len(source), args.data, batch_size))
+
+    # Output shapes are known after one batch has been set up
+    runner.infer([np.zeros((batch_size, *sample_shape), dtype=np.float32)])
+    writers = []
+    if "npy" in args.format:
+        for i, (name, output) in enumerate(zip(runner.output_names, runner.host_outputs)):
+            path = "{}.{}.npy".format(args.output_prefix, name.replace("/", "_"))
+            writers.append((i, NpyWriter(path, len(source), output.shape[1:])))
+    labels = LabelTable.from_file(args.labels) if args.labels else None
+    if "topk" in args.format:
+        writers.append((0, TopKCsvWriter("{}.topk.csv".format(args.output_prefix), args.top_k, args.softmax, labels)))
+    if "jsonl" in args.format:
+        writers.append((0, TopKJsonlWriter("{}.topk.jsonl".format(args.output_prefix), args.top_k, args.softmax, labels)))
+
+    try:
+        run(runner, source, batch_size, sample_shape, writers, fixed_batch, args.num_workers, args.prefetch)
+    finally:
+        for _, writer in writers:
+            writer.close()
+        metrics.write(args.metrics, args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import glob
+import json
+import argparse
+import collections
+from typing import Dict, List, Sequence
+
+# Written next to each engine by int8/calibration/onnx_to_tensorrt.py, see engine_metadata.py
+SIDECAR_SUFFIX = ".json"
+# TensorRT names the bindings of profiles after 0 "<name> [profile k]"
+PROFILE_SUFFIX = re.compile(r" \[profile \d+\]$")
+
+
+def base_binding_name(name: str) -> str:
+    """"input [profile 2]" -> "input" """
+    return PROFILE_SUFFIX.sub("", name)
+
+
+def profile_shapes(profile: dict) -> dict:
+    """A sidecar profile keyed by base binding names (older sidecars used the suffixed names)."""
+    return {base_binding_name(name): shapes for name, shapes in profile.items()}
+
+
+def shape_in_range(shape: Sequence[int], kmin: Sequence[int], kmax: Sequence[int]) -> bool:
+    return len(shape) == len(kmin) and all(lo <= dim <= hi for dim, lo, hi in zip(shape, kmin, kmax))
+
+
+def supported_profiles(metadata: dict, input_shapes: Dict[str, Sequence[int]]) -> List[int]:
+    """Returns the profile indices of an engine whose min/max shapes cover every shape in `input_shapes`.
+
+    Implicit batch engines have no profiles, they are reported as profile 0 when the shapes
+    (batch first) match their bindings with a batch size up to max_batch_size.
+    """
+    if metadata.get("implicit_batch"):
+        inputs = {binding["name"]: binding["shape"] for binding in metadata["bindings"] if binding["is_input"]}
+        if all(name in inputs and list(shape[1:]) == list(inputs[name]) and 1 <= shape[0] <= metadata["max_batch_size"]
+               for name, shape in input_shapes.items()):
+            return [0]
+        return []
+
+    profiles = []
+    for profile_index, profile in enumerate(metadata.get("profiles", [])):
+        profile = profile_shapes(profile)
+        if all(name in profile and shape_in_range(shape, profile[name]["min"], profile[name]["max"])
+               for name, shape in input_shapes.items()):
+            profiles.append(profile_index)
+    return profiles
+
+
+def profile_indices(metadata: dict) -> List[int]:
+    """Every profile of an engine, implicit batch engines having a single one."""
+    if metadata.get("implicit_batch"):
+        return [0]
+    return list(range(len(metadata.get("profiles", []))))
+
+
+def max_batch_size(metadata: dict) -> int:
+    """Largest batch size any profile accepts (or the implicit batch engine's max batch size)."""
+    if metadata.get("implicit_batch"):
+        return metadata["max_batch_size"]
+    return max((shapes["max"][0] for profile in metadata["profiles"] for shapes in profile.values()), default=0)
+
+
+class EngineIndex:
+    """In-memory index of engine sidecar metadata, so engines can be queried by
+    input name, precision, source model and shape without deserializing them."""
+
+    def __init__(self):
+        self.engines = {}
+        self.by_input = collections.defaultdict(set)
+        self.by_flag = collections.defaultdict(set)
+        self.by_onnx = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self.engines)
+
+    def add(self, engine_path: str, metadata: dict):
+        self.engines[engine_path] = metadata
+        for binding in metadata["bindings"]:
+            if binding["is_input"]:
+                self.by_input[base_binding_name(binding["name"])].add(engine_path)
+        for flag in metadata.get("builder_flags", []):
+            self.by_flag[flag].add(engine_path)
+        if metadata.get("onnx"):
+            self.by_onnx[metadata["onnx"]["sha256"]].add(engine_path)
+
+    def load(self, directories: List[str], pattern: str = "**/*.engine" + SIDECAR_SUFFIX):
+        """Adds every sidecar matching `pattern` under `directories`. Returns the number of engines added."""
+        added = 0
+        for directory in directories:
+            for path in glob.iglob(os.path.join(directory, pattern), recursive=True):
+                with open(path, "r") as f:
+                    metadata = json.load(f)
+                if "sidecar_version" not in metadata:
+                    continue
+                self.add(path[:-len(SIDECAR_SUFFIX)], metadata)
+                added += 1
+        return added
+
+    def find(self, input_name: str = None, flags: Sequence[str] = (), onnx_sha256: str = None,
+             input_shapes: Dict[str, Sequence[int]] = None, min_batch_size: int = None) -> List[str]:
+        """Returns the paths of the engines matching every given criteria.
+
+        Parameters
+        ----------
+        input_name: str
+            Engine has an input binding with this name.
+        flags: List[str]
+            Engine was built with all of these builder flags, ex: ["fp16", "int8"]
+        onnx_sha256: str
+            Engine was built from the ONNX model with this hash.
+        input_shapes: Dict[str, List[int]]
+            At least one profile of the engine accepts these input shapes.
+        min_batch_size: int
+            Engine accepts batches of at least this size.
+        """
+        candidates = set(self.engines)
+        if input_name is not None:
+            candidates &= self.by_input.get(input_name, set())
+        for flag in flags:
+            candidates &= self.by_flag.get(flag, set())
+        if onnx_sha256 is not None:
+            candidates &= self.by_onnx.get(onnx_sha256, set())
+
+        matches = []
+        for path in sorted(candidates):
+            metadata = self.engines[path]
+            if input_shapes and not supported_profiles(metadata, input_shapes):
+                continue
+            if min_batch_size is not None and max_batch_size(metadata) < min_batch_size:
+                continue
+            matches.append(path)
+        return matches
+
+
+def describe(engine_path: str, metadata: dict) -> str:
+    lines = ["{} (TensorRT {}, flags: {})".format(engine_path, metadata["tensorrt_version"],
+                                                  ", ".join(metadata.get("builder_flags", [])) or "none")]
+    for binding in metadata["bindings"]:
+        lines.append("\t{} [{}] {} {} {} (profile {})".format(
+            "Input " if binding["is_input"] else "Output", binding["index"], binding["name"],
+            binding["dtype"], binding["shape"], binding["profile"]))
+    for profile_index, profile in enumerate(metadata.get("profiles", [])):
+        for name, shapes in profile.items():
+            lines.append("\tProfile {} [{}]: kMIN {} | kOPT {} | kMAX {}".format(
+                profile_index, name, shapes["min"], shapes["opt"], shapes["max"]))
+    if metadata.get("onnx"):
+        lines.append("\tONNX: {} ({})".format(metadata["onnx"]["path"], metadata["onnx"]["sha256"][:12]))
+    build = metadata.get("build", {})
+    if build.get("build_time") is not None:
+        lines.append("\tBuild time: {:.1f}s".format(build["build_time"]))
+    return "\n".join(lines)
+
+
+def parse_shape(spec: str):
+    """Parses "name:1x3x224x224" into ("name", [1, 3, 224, 224])"""
+    name, _, dims = spec.rpartition(":")
+    return name, [int(dim) for dim in dims.split("x")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries engine metadata from the sidecar files written by onnx_to_tensorrt.py, "
+                                                 "without a GPU or deserializing any engine.")
+    parser.add_argument("directories", nargs="+", help="Directories to search (recursively) for engine sidecars.")
+    parser.add_argument("--pattern", default="**/*.engine" + SIDECAR_SUFFIX, help="Glob pattern of sidecar files.")
+    parser.add_argument("--input-name", type=str, help="Only engines with this input binding.")
+    parser.add_argument("--flags", nargs="+", default=[], help="Only engines built with all of these flags, ex: fp16 int8")
+    parser.add_argument("--onnx-sha256", type=str, help="Only engines built from this ONNX model hash.")
+    parser.add_argument("--shapes", nargs="+", default=[], help="Only engines with a profile accepting these shapes, ex: input:8x3x224x224")
+    parser.add_argument("--min-batch-size", type=int, help="Only engines accepting at least this batch size.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Describe the bindings and profiles of each match.")
+    parser.add_argument("--json", action="store_true", help="Print the metadata of each match as JSON.")
+    args = parser.parse_args()
+
+    index = EngineIndex()
+    index.load(args.directories, args.pattern)
+    input_shapes = dict(parse_shape(spec) for spec in args.shapes)
+    matches = index.find(args.input_name, args.flags, args.onnx_sha256, input_shapes, args.min_batch_size)
+
+    if args.json:
+        print(json.dumps({path: index.engines[path] for path in matches}, indent=4))
+        return
+
+    for path in matches:
+        metadata = index.engines[path]
+        if args.verbose:
+            print(describe(path, metadata))
+        else:
+            profiles = supported_profiles(metadata, input_shapes) if input_shapes else profile_indices(metadata)
+            print("{}\tflags={}\tprofiles={}".format(path, ",".join(metadata.get("builder_flags", [])), profiles))
+    print("{} of {} engines matched".format(len(matches), len(index)))
+
+
+if __name__ == "__main__":
+    main()
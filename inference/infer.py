@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import sys
 import argparse
 from typing import Tuple, List
 
@@ -22,7 +24,11 @@ import pycuda.driver as cuda
 import pycuda.autoinit
 import tensorrt as trt
 
+from instrumentation import metrics # local module
+
 TRT_LOGGER = trt.Logger(trt.Logger.WARNING)
+# The artifact store lives with the engine building scripts
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "int8", "calibration")
 
 
 def is_fixed(shape: Tuple[int]):
@@ -83,10 +89,20 @@ def get_binding_idxs(engine: trt.ICudaEngine, profile_index: int):
     return input_binding_idxs, output_binding_idxs
 
 
-def load_engine(filename: str):
+def load_engine(filename: str, artifact_store: str = None):
     # Load serialized engine file into memory
-    with open(filename, "rb") as f, trt.Runtime(TRT_LOGGER) as runtime:
-        return runtime.deserialize_cuda_engine(f.read())
+    if artifact_store:
+        # `filename` is the engine's name in the store, see int8/calibration/artifact_store.py
+        if CALIBRATION_DIR not in sys.path:
+            sys.path.append(CALIBRATION_DIR)
+        from artifact_store import ArtifactStore # local module
+        with metrics.timer("artifact_load"):
+            serialized_engine = ArtifactStore(artifact_store).get(filename)
+    else:
+        with open(filename, "rb") as f:
+            serialized_engine = f.read()
+    with trt.Runtime(TRT_LOGGER) as runtime, metrics.timer("deserialize"):
+        return runtime.deserialize_cuda_engine(serialized_engine)
 
 
 def get_random_inputs(
@@ -120,18 +136,53 @@ def get_random_inputs(
     return host_inputs
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-e", "--engine", required=True, type=str,
-                        help="Path to TensorRT engine file.")
-    parser.add_argument("-s", "--seed", type=int, default=42,
-                        help="Random seed for reproducibility.")
-    args = parser.parse_args()
-
-    # Load a serialized engine into memory
-    engine = load_engine(args.engine)
-    print("Loaded engine: {}".format(args.engine))
-
+class EngineRunner:
+    """Runs inference with one execution context of an engine, re-using the
+    device buffers across calls as long as the input shapes don't change.
+
+    NOTE: The returned host outputs are overwritten by the next call to infer(),
+    copy them if they need to be kept around.
+    """
+
+    def __init__(self, engine: trt.ICudaEngine, profile_index: int = 0):
+        self.engine = engine
+        self.context = engine.create_execution_context()
+        self.context.active_optimization_profile = profile_index
+        self.input_binding_idxs, self.output_binding_idxs = get_binding_idxs(engine, profile_index)
+        self.input_names = [engine.get_binding_name(idx) for idx in self.input_binding_idxs]
+        self.output_names = [engine.get_binding_name(idx) for idx in self.output_binding_idxs]
+        self.input_shapes = None
+
+    def infer(self, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        host_inputs = [np.ascontiguousarray(h_input, dtype=np.float32) for h_input in host_inputs]
+        input_shapes = [h_input.shape for h_input in host_inputs]
+        if input_shapes != self.input_shapes:
+            self.device_inputs = [cuda.mem_alloc(h_input.nbytes) for h_input in host_inputs]
+            self.host_outputs, self.device_outputs = setup_binding_shapes(
+                self.engine, self.context, host_inputs, self.input_binding_idxs, self.output_binding_idxs,
+            )
+            # Bindings for every profile must be given, only the active profile's are used
+            self.bindings = [0] * self.engine.num_bindings
+            for binding_index, device_buffer in zip(self.input_binding_idxs + self.output_binding_idxs,
+                                                    self.device_inputs + self.device_outputs):
+                self.bindings[binding_index] = int(device_buffer)
+            self.input_shapes = input_shapes
+
+        with metrics.timer("h2d"):
+            for h_input, d_input in zip(host_inputs, self.device_inputs):
+                cuda.memcpy_htod(d_input, h_input)
+        with metrics.timer("execute"):
+            self.context.execute_v2(self.bindings)
+        with metrics.timer("d2h"):
+            for h_output, d_output in zip(self.host_outputs, self.device_outputs):
+                cuda.memcpy_dtoh(h_output, d_output)
+        metrics.count("inference_rows", input_shapes[0][0] if input_shapes[0] else 1)
+
+        return self.host_outputs
+
+
+def infer_step_by_step(engine: trt.ICudaEngine, seed: int = 42):
+    """Runs one inference on random inputs with profile 0, spelling out each step."""
     # Create context, this can be re-used
     context = engine.create_execution_context()
     # Profile 0 (first profile) is used by default
@@ -146,14 +197,15 @@ def main():
     input_names = [engine.get_binding_name(binding_idx) for binding_idx in input_binding_idxs]
     
     # Generate random inputs based on profile shapes
-    host_inputs = get_random_inputs(engine, context, input_binding_idxs, seed=args.seed)
+    host_inputs = get_random_inputs(engine, context, input_binding_idxs, seed=seed)
 
     # Allocate device memory for inputs. This can be easily re-used if the
     # input shapes don't change
     device_inputs = [cuda.mem_alloc(h_input.nbytes) for h_input in host_inputs]
     # Copy host inputs to device, this needs to be done for each new input
-    for h_input, d_input in zip(host_inputs, device_inputs):
-        cuda.memcpy_htod(d_input, h_input)
+    with metrics.timer("h2d"):
+        for h_input, d_input in zip(host_inputs, device_inputs):
+            cuda.memcpy_htod(d_input, h_input)
 
     print("Input Metadata")
     print("\tNumber of Inputs: {}".format(len(input_binding_idxs)))
@@ -179,17 +231,80 @@ def main():
     bindings = device_inputs + device_outputs
 
     # Inference
-    context.execute_v2(bindings)
+    with metrics.timer("execute"):
+        context.execute_v2(bindings)
 
     # Copy outputs back to host to view results
-    for h_output, d_output in zip(host_outputs, device_outputs):
-        cuda.memcpy_dtoh(h_output, d_output)
+    with metrics.timer("d2h"):
+        for h_output, d_output in zip(host_outputs, device_outputs):
+            cuda.memcpy_dtoh(h_output, d_output)
+
+    return host_outputs, output_names
+
+
+def infer_with_runner(engine: trt.ICudaEngine, seed: int = 42):
+    """Runs one inference on random inputs with profile 0 through cuda_graphs.get_runner(),
+    which replays a captured CUDA graph (or falls back to an EngineRunner)."""
+    from cuda_graphs import get_runner # local module
+    runner = get_runner(engine, 0, cuda_graphs=True)
+    host_inputs = get_random_inputs(engine, runner.context, runner.input_binding_idxs, seed=seed)
+    print("\tInput shapes: {}".format([inp.shape for inp in host_inputs]))
+    # The runner's outputs are overwritten by its next call (and freed by close())
+    host_outputs = [out.copy() for out in runner.infer(host_inputs)]
+    print("\tOutput shapes: {}".format([out.shape for out in host_outputs]))
+    if hasattr(runner, "close"):
+        runner.close()
+    return host_outputs, runner.output_names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--engine", required=True, type=str,
+                        help="Path to TensorRT engine file.")
+    parser.add_argument("--artifact-store", type=str, default=None,
+                        help="Load --engine by name from this artifact store instead of a file.")
+    parser.add_argument("-s", "--seed", type=int, default=42,
+                        help="Random seed for reproducibility.")
+    parser.add_argument("-k", "--top-k", type=int, default=None,
+                        help="Print the top-k classes of each output instead of the raw outputs.")
+    parser.add_argument("--labels", type=str, default=None,
+                        help="(--top-k only) Label file, one label per line, ex: ../int8/calibration/labels/imagenet1k_labels.txt")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Write deserialize/H2D/execute/D2H timings to this file in Prometheus text format.")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Write the timed spans to this file as a Chrome trace (chrome://tracing).")
+    parser.add_argument("--cuda-graphs", action="store_true",
+                        help="Replay a captured CUDA graph instead of calling execute_v2, see cuda_graphs.py.")
+    args = parser.parse_args()
+    if args.metrics or args.trace:
+        metrics.enable()
+
+    # Load a serialized engine into memory
+    engine = load_engine(args.engine, args.artifact_store)
+    print("Loaded engine: {}".format(args.engine))
+
+    if args.cuda_graphs:
+        host_outputs, output_names = infer_with_runner(engine, args.seed)
+    else:
+        host_outputs, output_names = infer_step_by_step(engine, args.seed)
 
     # View outputs
-    print("Inference Outputs:", host_outputs)
+    if args.top_k:
+        from postprocessing import LabelTable, Postprocessor # local module
+        postprocess = Postprocessor(args.top_k, softmax=True,
+                                    labels=LabelTable.from_file(args.labels) if args.labels else None)
+        for name, h_output in zip(output_names, host_outputs):
+            result = postprocess(h_output)
+            print("Top-{} of {}:".format(args.top_k, name))
+            for row in range(len(result.indices)):
+                classes = result.labels[row] if result.labels is not None else result.indices[row]
+                print("\t[{}] {}".format(row, ", ".join("{} ({:.4f})".format(c, p) for c, p in zip(classes, result.scores[row]))))
+    else:
+        print("Inference Outputs:", host_outputs)
+
+    metrics.write(args.metrics, args.trace)
 
     # Cleanup (Can also use context managers instead)
-    del context
     del engine
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Seconds, from 100us to 10min
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# Set to 1 to enable the global `metrics` without changing any code
+ENV_VAR = "TRT_UTILS_METRICS"
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NullTimer:
+    """Returned by Metrics.timer() when disabled, so timing code costs one attribute lookup."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record_span(self.name, self.start, time.perf_counter(), self.labels)
+        return False
+
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    if not labels:
+        return name, ()
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra=()) -> str:
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+
+class Metrics:
+    """Timers, counters and histograms, exported as Prometheus text or a Chrome trace.
+
+    Everything is a no-op while disabled: timer() returns a shared do-nothing context
+    manager and count()/observe() return after checking `enabled`.
+
+    Example:
+        with metrics.timer("build"):
+            engine = builder.build_engine(network, config)
+        metrics.count("calibration_batches")
+
+    Parameters
+    ----------
+    namespace: str
+        Prefix of the exported Prometheus metric names.
+    enabled: bool
+    trace: bool
+        Also record every timed span as a Chrome trace event.
+    max_trace_events: int
+        Spans beyond this many are only aggregated, to bound memory in long running processes.
+    """
+
+    def __init__(self, namespace: str = "trt", enabled: bool = False, trace: bool = True, max_trace_events: int = 100000):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self.trace_events = []
+        self.origin = time.perf_counter()
+
+    def enable(self, trace: bool = True):
+        self.enabled = True
+        self.trace = trace
+
+    def disable(self):
+        self.enabled = False
+
+    def timer(self, name: str, **labels):
+        """Context manager timing its body into the `<name>_seconds` histogram."""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def record_span(self, name: str, start: float, end: float, labels: Dict[str, str]):
+        """Records a timed span, with `start` and `end` from time.perf_counter()."""
+        self.observe(name + "_seconds", end - start, **labels)
+        if self.trace and len(self.trace_events) < self.max_trace_events:
+            event = {"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                     "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+            if labels:
+                event["args"] = {k: str(v) for k, v in labels.items()}
+            with self.lock:
+                self.trace_events.append(event)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = "{}_{}_total".format(self.namespace, name)
+            if metric not in typed:
+                lines.append("# TYPE {} counter".format(metric))
+                typed.add(metric)
+            lines.append("{}{} {}".format(metric, _format_labels(labels), value))
+
+        for (name, labels), histogram in histograms:
+            metric = "{}_{}".format(self.namespace, name)
+            if metric not in typed:
+                lines.append("# TYPE {} histogram".format(metric))
+                typed.add(metric)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_bucket{} {}".format(metric, _format_labels(labels, [("le", le)]), cumulative))
+            lines.append("{}_sum{} {}".format(metric, _format_labels(labels), histogram.sum))
+            lines.append("{}_count{} {}".format(metric, _format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def to_chrome_trace(self) -> dict:
+        """Trace viewable in chrome://tracing or https://ui.perfetto.dev"""
+        with self.lock:
+            return {"traceEvents": list(self.trace_events), "displayTimeUnit": "ms"}
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """{name: {"count", "total", "mean"}} of every histogram, for logging."""
+        with self.lock:
+            histograms = list(self.histograms.items())
+        return {name + _format_labels(labels): {"count": h.count, "total": h.sum, "mean": h.sum / max(h.count, 1)}
+                for (name, labels), h in histograms}
+
+    def write(self, prometheus_path: str = None, trace_path: str = None):
+        if prometheus_path:
+            with open(prometheus_path, "w") as f:
+                f.write(self.to_prometheus())
+        if trace_path:
+            with open(trace_path, "w") as f:
+                json.dump(self.to_chrome_trace(), f)
+
+
+# Shared by every module of the project, disabled unless enabled from the command line or ENV_VAR
+metrics = Metrics(enabled=os.environ.get(ENV_VAR, "0") not in ("", "0"))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import csv
+import json
+import time
+import argparse
+import collections
+from typing import List, Sequence
+
+import numpy as np
+
+DEFAULT_LABELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                              "int8", "calibration", "labels", "imagenet1k_labels.txt")
+
+# Top-k classes of a batch: indices and scores of shape (batch, k), best first, and
+# their labels (or None without a label table)
+TopK = collections.namedtuple("TopK", ["indices", "scores", "labels"])
+
+
+def softmax_(logits: np.ndarray) -> np.ndarray:
+    """Softmax over the last axis of a float array, computed in place. Returns `logits`."""
+    logits -= logits.max(axis=-1, keepdims=True)
+    np.exp(logits, out=logits)
+    logits /= logits.sum(axis=-1, keepdims=True)
+    return logits
+
+
+def topk(scores: np.ndarray, k: int = 5):
+    """Returns the (indices, scores) of the `k` largest scores of each row, best first.
+
+    Only the k candidates found by argpartition are sorted, instead of every class.
+    """
+    scores = scores.reshape(scores.shape[0], -1)
+    k = min(k, scores.shape[1])
+    candidates = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+    values = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-values, axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+class LabelTable:
+    """Class index -> label lookup for whole arrays of indices."""
+
+    def __init__(self, labels: Sequence[str]):
+        self.labels = np.array(labels, dtype=object)
+
+    @classmethod
+    def from_file(cls, filename: str = DEFAULT_LABELS):
+        """One label per line, where the line number is the class index (ex: imagenet1k_labels.txt)"""
+        with open(filename, "r") as f:
+            return cls([line.strip() for line in f if line.strip()])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def lookup(self, indices: np.ndarray) -> np.ndarray:
+        return self.labels[indices]
+
+
+class Postprocessor:
+    """Softmax (optional), top-k and label lookup over whole output batches.
+
+    Scores are computed in a scratch buffer re-used across batches, so the outputs
+    (ex: infer.EngineRunner.host_outputs) are left untouched and nothing is allocated
+    per batch beyond the (batch, k) results.
+    """
+
+    def __init__(self, k: int = 5, softmax: bool = False, labels: LabelTable = None):
+        self.k = k
+        self.softmax = softmax
+        self.labels = labels
+        self.scratch = None
+
+    def __call__(self, outputs: np.ndarray) -> TopK:
+        scores = outputs.reshape(outputs.shape[0], -1)
+        if self.softmax:
+            if self.scratch is None or self.scratch.shape[0] < scores.shape[0] or self.scratch.shape[1:] != scores.shape[1:]:
+                self.scratch = np.empty(scores.shape, dtype=np.float32)
+            scratch = self.scratch[:scores.shape[0]]
+            np.copyto(scratch, scores)
+            scores = softmax_(scratch)
+        indices, values = topk(scores, self.k)
+        return TopK(indices, values, self.labels.lookup(indices) if self.labels is not None else None)
+
+
+class TopKCsvWriter:
+    """Writes the top-k class indices, scores (and labels) of each sample to a CSV file."""
+
+    def __init__(self, path: str, k: int = 5, softmax: bool = False, labels: LabelTable = None):
+        self.postprocess = Postprocessor(k, softmax, labels)
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        columns = ("class", "score", "label") if labels is not None else ("class", "score")
+        self.writer.writerow(["key"] + ["{}{}".format(col, i) for i in range(k) for col in columns])
+
+    def write(self, indices: List[int], keys: List[str], outputs: np.ndarray):
+        result = self.postprocess(outputs)
+        if result.labels is None:
+            columns = [result.indices.tolist(), result.scores.tolist()]
+        else:
+            columns = [result.indices.tolist(), result.scores.tolist(), result.labels.tolist()]
+        self.writer.writerows([key] + [v for values in zip(*row) for v in values] for key, *row in zip(keys, *columns))
+
+    def close(self):
+        self.file.close()
+
+
+class TopKJsonlWriter:
+    """Writes one JSON object per sample: {"key", "classes", "scores"[, "labels"]}"""
+
+    def __init__(self, path: str, k: int = 5, softmax: bool = False, labels: LabelTable = None):
+        self.postprocess = Postprocessor(k, softmax, labels)
+        self.file = open(path, "w")
+
+    def write(self, indices: List[int], keys: List[str], outputs: np.ndarray):
+        result = self.postprocess(outputs)
+        labels = result.labels.tolist() if result.labels is not None else [None] * len(keys)
+        lines = []
+        for key, classes, scores, names in zip(keys, result.indices.tolist(), result.scores.tolist(), labels):
+            record = {"key": key, "classes": classes, "scores": scores}
+            if names is not None:
+                record["labels"] = names
+            lines.append(json.dumps(record))
+        self.file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def naive_postprocess(outputs: np.ndarray, k: int, labels: List[str]):
+    """Per-sample softmax + argsort, as a baseline for the benchmark."""
+    results = []
+    for row in outputs.reshape(outputs.shape[0], -1):
+        exp = np.exp(row - row.max())
+        probs = exp / exp.sum()
+        top = np.argsort(probs)[::-1][:k]
+        results.append([(int(i), float(probs[i]), labels[i]) for i in top])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks batched softmax + top-k + label lookup against a per-sample argsort loop.")
+    parser.add_argument("-b", "--batch-size", type=int, default=256, help="Rows per output batch.")
+    parser.add_argument("-c", "--num-classes", type=int, default=1000, help="Number of classes.")
+    parser.add_argument("-k", "--top-k", type=int, default=5, help="Number of classes per sample.")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="Batches to time.")
+    parser.add_argument("--labels", type=str, default=DEFAULT_LABELS, help="Label file, one label per line.")
+    args = parser.parse_args()
+
+    table = LabelTable.from_file(args.labels)
+    if len(table) < args.num_classes:
+        table = LabelTable(["class_{}".format(i) for i in range(args.num_classes)])
+    labels = table.labels.tolist()
+    outputs = np.random.RandomState(0).randn(args.batch_size, args.num_classes).astype(np.float32) * 4
+    postprocess = Postprocessor(args.top_k, softmax=True, labels=table)
+
+    # Same classes and (close) probabilities, ignoring ties
+    result = postprocess(outputs)
+    naive = naive_postprocess(outputs, args.top_k, labels)
+    assert np.array_equal(result.indices, [[i for i, _, _ in row] for row in naive])
+    assert np.allclose(result.scores, [[p for _, p, _ in row] for row in naive], atol=1e-6)
+
+    timings = {}
+    for name, func in (("naive", lambda: naive_postprocess(outputs, args.top_k, labels)), ("batched", lambda: postprocess(outputs))):
+        func()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            func()
+        timings[name] = (time.perf_counter() - start) / args.iterations
+        print("{:<8} {:8.3f} ms/batch ({:.0f} samples/s)".format(name, 1000 * timings[name], args.batch_size / timings[name]))
+    print("Speedup: {:.1f}x".format(timings["naive"] / timings["batched"]))
+
+
+if __name__ == "__main__":
+    main()
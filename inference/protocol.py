@@ -0,0 +1,63 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Wire format shared by server.py and client.py.
+#
+# Every message is a fixed size header followed by `payload_length` bytes of payload:
+#
+#     magic (4s) | version (u8) | message type (u8) | status (u16) | payload length (u32) | request id (u64)
+#
+# Tensor data never goes over the socket, only the tensor specs (see shm_tensors.encode_specs)
+# describing where the tensors are in the client's shared memory buffers.
+
+import struct
+
+MAGIC = b"TRTS"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHIQ")
+
+# Message types
+REGISTER = 1  # payload: input buffer name, output buffer name (see encode_names)
+INFER = 2     # payload: input tensor specs
+RESPONSE = 3  # payload: output tensor specs, or an error message if status != STATUS_OK
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+DEFAULT_SOCKET = "/tmp/trt_server.sock"
+
+
+def pack_header(message_type, payload_length, request_id=0, status=STATUS_OK):
+    return HEADER.pack(MAGIC, VERSION, message_type, status, payload_length, request_id)
+
+
+def unpack_header(data):
+    """Returns (message_type, status, payload_length, request_id)"""
+    magic, version, message_type, status, payload_length, request_id = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unexpected message header: magic={} version={}".format(magic, version))
+    return message_type, status, payload_length, request_id
+
+
+def encode_names(*names):
+    return b"".join(struct.pack("<H", len(name)) + name.encode("utf-8") for name in names)
+
+
+def decode_names(data):
+    names, position = [], 0
+    while position < len(data):
+        (length,) = struct.unpack_from("<H", data, position)
+        names.append(data[position+2:position+2+length].decode("utf-8"))
+        position += 2 + length
+    return names
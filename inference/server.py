@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import asyncio
+import logging
+import argparse
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol  # local module
+from shm_tensors import attach_shared_buffer, read_tensors, write_tensors, encode_specs, decode_specs  # local module
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+
+class InferenceServer:
+    """Serves an inference function to local clients over a Unix domain socket.
+
+    Each client registers one input and one output shared memory buffer when it connects.
+    Requests then only carry tensor specs: inputs are read in place from the client's input
+    buffer, and outputs are written directly into its output buffer.
+
+    Inference runs on dedicated threads, each calling `backend_factory` once and then only its own
+    inference function, since backends like TensorRT's are tied to the thread their CUDA context
+    is current on.
+
+    Parameters
+    ----------
+    backend_factory: Callable[[int], Callable[[List[numpy.ndarray]], List[numpy.ndarray]]]
+        Called on each inference thread with `device_id`, returning the inference function,
+        ex: worker_pool.TensorRTBackend(engine_path)
+    device_id: int
+        Device id passed to `backend_factory`.
+    num_threads: int
+        Number of inference threads, each with its own backend.
+    """
+
+    def __init__(self, backend_factory, device_id=0, num_threads=1):
+        self.backend_factory = backend_factory
+        self.device_id = device_id
+        self.thread_state = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=num_threads, initializer=self._init_thread)
+        self.num_requests = 0
+
+    def _init_thread(self):
+        self.thread_state.infer = self.backend_factory(self.device_id)
+
+    async def handle_connection(self, reader, writer):
+        buffers = None
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(protocol.HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                message_type, _, payload_length, request_id = protocol.unpack_header(header)
+                payload = await reader.readexactly(payload_length) if payload_length else b""
+
+                if message_type == protocol.REGISTER:
+                    try:
+                        registered = self.attach_buffers(payload)
+                    except Exception as e:
+                        # The previous registration, if any, stays in use
+                        logger.warning("REGISTER failed: {!r}".format(e))
+                        response = self.error_response("REGISTER failed: {!r}".format(e), request_id)
+                    else:
+                        if buffers:
+                            for buffer in buffers:
+                                buffer.close()
+                        buffers = registered
+                        logger.debug("Registered client buffers: {}".format([b.name for b in buffers]))
+                        response = protocol.pack_header(protocol.RESPONSE, 0, request_id)
+                elif message_type == protocol.INFER:
+                    response = await self.run_request(buffers, payload, request_id)
+                else:
+                    response = self.error_response("Unknown message type: {}".format(message_type), request_id)
+
+                writer.write(response)
+                await writer.drain()
+        finally:
+            if buffers:
+                for buffer in buffers:
+                    buffer.close()
+            writer.close()
+
+    @staticmethod
+    def attach_buffers(payload):
+        """Returns the client's [input buffer, output buffer] named in a REGISTER payload."""
+        names = protocol.decode_names(payload)
+        if len(names) != 2:
+            raise ValueError("Expected 2 buffer names (input, output), got {}".format(len(names)))
+        buffers = []
+        try:
+            for name in names:
+                buffers.append(attach_shared_buffer(name, untrack=True))
+        except Exception:
+            for buffer in buffers:
+                buffer.close()
+            raise
+        return buffers
+
+    async def run_request(self, buffers, payload, request_id):
+        if not buffers or len(buffers) != 2:
+            return self.error_response("INFER before a successful REGISTER", request_id)
+
+        input_buffer, output_buffer = buffers
+
+        def run():
+            host_inputs = read_tensors(input_buffer.buf, decode_specs(payload))
+            host_outputs = self.thread_state.infer(host_inputs)
+            return encode_specs(write_tensors(output_buffer.buf, host_outputs))
+
+        try:
+            output_specs = await asyncio.get_running_loop().run_in_executor(self.executor, run)
+        except Exception as e:
+            logger.exception("Request {} failed".format(request_id))
+            return self.error_response(repr(e), request_id)
+
+        self.num_requests += 1
+        return protocol.pack_header(protocol.RESPONSE, len(output_specs), request_id) + output_specs
+
+    @staticmethod
+    def error_response(message, request_id):
+        payload = message.encode("utf-8")
+        return protocol.pack_header(protocol.RESPONSE, len(payload), request_id, protocol.STATUS_ERROR) + payload
+
+    async def serve(self, socket_path):
+        # Loads the backend of the first inference thread, so it fails before accepting clients
+        await asyncio.get_running_loop().run_in_executor(self.executor, lambda: None)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+        logger.info("Listening on {}".format(socket_path))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+def load_backend(args):
+    """Returns the backend factory selected by the command line arguments."""
+    from worker_pool import TensorRTBackend, EchoBackend  # local module
+    if args.backend == "trt":
+        if not args.engine:
+            raise ValueError("ERROR: --engine is required for the trt backend")
+        return TensorRTBackend(args.engine, args.profile, args.cuda_graphs)
+    if args.backend == "fake":
+        return EchoBackend(args.fake_latency)
+
+    # "module:factory", where factory(device_id) returns the inference function
+    module_name, _, factory_name = args.backend.partition(":")
+    return getattr(importlib.import_module(module_name), factory_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local inference server using a Unix domain socket and shared memory.")
+    parser.add_argument("--socket", type=str, default=protocol.DEFAULT_SOCKET, help="Path of the Unix domain socket to listen on.")
+    parser.add_argument("--backend", type=str, default="trt",
+                        help="'trt' (TensorRT engine), 'fake' (CPU echo backend) or 'module:factory' for a custom backend.")
+    parser.add_argument("-e", "--engine", type=str, help="(trt ONLY) Path to TensorRT engine file.")
+    parser.add_argument("--profile", type=int, default=0, help="(trt ONLY) Optimization profile to run with.")
+    parser.add_argument("--cuda-graphs", action="store_true",
+                        help="(trt ONLY) Replay a captured CUDA graph per input shape, see cuda_graphs.py.")
+    parser.add_argument("--device", type=int, default=0, help="Device id passed to the backend. The trt backend runs on it "
+                                                              "by setting CUDA_VISIBLE_DEVICES.")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="(fake ONLY) Seconds to sleep per request.")
+    parser.add_argument("--threads", type=int, default=1, help="Inference threads, each loading its own backend (ex: engine and context).")
+    args = parser.parse_args()
+
+    server = InferenceServer(load_backend(args), args.device, args.threads)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        logger.info("Served {} requests".format(server.num_requests))
+
+
+if __name__ == "__main__":
+    main()
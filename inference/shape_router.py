@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+import argparse
+import collections
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# One execution of a plan: run `rows` real samples on profile `profile` at batch size `batch`
+# (batch - rows rows are padding)
+Chunk = collections.namedtuple("Chunk", ["profile", "batch", "rows"])
+
+
+class LatencyTable:
+    """Measured latencies of each optimization profile at some batch sizes.
+
+    Parameters
+    ----------
+    profiles: List[Tuple[int, int]]
+        (min batch, max batch) accepted by each profile, by profile index.
+    latencies: List[Dict[int, float]]
+        Measured latency (ms) by batch size, for each profile. Latencies of unmeasured batch
+        sizes within a profile's range are linearly interpolated.
+    """
+
+    def __init__(self, profiles: List[Tuple[int, int]], latencies: List[Dict[int, float]]):
+        if len(profiles) != len(latencies):
+            raise ValueError("Got {} profiles but {} latency tables".format(len(profiles), len(latencies)))
+        self.profiles = [(int(lo), int(hi)) for lo, hi in profiles]
+        self.latencies = [{int(bs): float(ms) for bs, ms in table.items()} for table in latencies]
+
+    def candidates(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns (profile indices, batch sizes, latencies) of every (profile, batch size) that can be executed."""
+        profiles, batches, costs = [], [], []
+        for index, ((lo, hi), table) in enumerate(zip(self.profiles, self.latencies)):
+            if not table:
+                continue
+            measured = np.array(sorted(table))
+            batch_sizes = np.arange(lo, hi + 1)
+            profiles.append(np.full(len(batch_sizes), index))
+            batches.append(batch_sizes)
+            costs.append(np.interp(batch_sizes, measured, [table[bs] for bs in measured]))
+        return np.concatenate(profiles), np.concatenate(batches), np.concatenate(costs)
+
+    def to_json(self) -> dict:
+        return {"profiles": [{"min_batch": lo, "max_batch": hi, "latency_ms": {str(bs): ms for bs, ms in table.items()}}
+                             for (lo, hi), table in zip(self.profiles, self.latencies)]}
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls([(p["min_batch"], p["max_batch"]) for p in data["profiles"]],
+                   [p["latency_ms"] for p in data["profiles"]])
+
+
+class ShapeRouter:
+    """Picks the cheapest way to run a request of any batch size on the available profiles:
+    a single profile with padding, or several executions (splitting the batch), by minimizing
+    the total predicted latency. Plans are cached by batch size.
+    """
+
+    def __init__(self, table: LatencyTable, max_cached_plans: int = 1024):
+        self.table = table
+        self.profiles, self.batches, self.costs = table.candidates()
+        self.max_cached_plans = max_cached_plans
+        self.plans = collections.OrderedDict()
+
+    def plan(self, num_rows: int) -> List[Chunk]:
+        if num_rows in self.plans:
+            self.plans.move_to_end(num_rows)
+            return self.plans[num_rows]
+
+        # best[r] = lowest latency to run r rows, choice[r] = candidate used for the last execution
+        best = np.zeros(num_rows + 1)
+        choice = np.zeros(num_rows + 1, dtype=np.int64)
+        for rows in range(1, num_rows + 1):
+            totals = self.costs + best[np.maximum(rows - self.batches, 0)]
+            choice[rows] = np.argmin(totals)
+            best[rows] = totals[choice[rows]]
+
+        chunks, remaining = [], num_rows
+        while remaining > 0:
+            candidate = choice[remaining]
+            batch = int(self.batches[candidate])
+            chunks.append(Chunk(int(self.profiles[candidate]), batch, min(batch, remaining)))
+            remaining -= batch
+
+        self.plans[num_rows] = chunks
+        if len(self.plans) > self.max_cached_plans:
+            self.plans.popitem(last=False)
+        return chunks
+
+    def predicted_latency(self, num_rows: int) -> float:
+        lookup = {(p, b): c for p, b, c in zip(self.profiles.tolist(), self.batches.tolist(), self.costs.tolist())}
+        return sum(lookup[(chunk.profile, chunk.batch)] for chunk in self.plan(num_rows))
+
+
+class PaddedExecutor:
+    """Runs requests of any batch size according to a ShapeRouter's plans.
+
+    Padded inputs are assembled in preallocated buffers (one per profile, batch size and input shapes),
+    and outputs are gathered into preallocated result buffers, so a request only allocates
+    when it sees a new (profile, batch size, input shapes) or a larger batch than before.
+
+    Parameters
+    ----------
+    router: ShapeRouter
+    execute: Callable[[int, List[numpy.ndarray]], List[numpy.ndarray]]
+        Runs a full batch on the given profile index, ex: an infer.EngineRunner per profile.
+    """
+
+    def __init__(self, router: ShapeRouter, execute):
+        self.router = router
+        self.execute = execute
+        self.input_buffers = {}
+        self.output_buffers = None
+        # Trailing shapes and dtypes of the inputs the output buffers were last sized for
+        self.output_buffers_inputs = None
+
+    def _input_buffers(self, chunk: Chunk, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        key = (chunk.profile, chunk.batch, tuple((h.shape[1:], h.dtype.str) for h in host_inputs))
+        if key not in self.input_buffers:
+            self.input_buffers[key] = [np.zeros((chunk.batch, *h.shape[1:]), dtype=h.dtype) for h in host_inputs]
+        return self.input_buffers[key]
+
+    def _output_buffers(self, num_rows: int, outputs: List[np.ndarray]) -> List[np.ndarray]:
+        if self.output_buffers is None or self.output_buffers[0].shape[0] < num_rows \
+                or [b.shape[1:] for b in self.output_buffers] != [o.shape[1:] for o in outputs]:
+            self.output_buffers = [np.empty((num_rows, *o.shape[1:]), dtype=o.dtype) for o in outputs]
+        return self.output_buffers
+
+    def run(self, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        """Returns views of the result buffers, which are overwritten by the next call."""
+        num_rows = host_inputs[0].shape[0]
+        inputs_key = [(h.shape[1:], h.dtype) for h in host_inputs]
+        if num_rows == 0:
+            if self.output_buffers_inputs != inputs_key:
+                # Output shapes are only known from running a batch, run the smallest plan on padding
+                chunk = self.router.plan(1)[0]
+                self._output_buffers(0, self.execute(chunk.profile, self._input_buffers(chunk, host_inputs)))
+                self.output_buffers_inputs = inputs_key
+            return [buffer[:0] for buffer in self.output_buffers]
+
+        start = 0
+        results = None
+        for chunk in self.router.plan(num_rows):
+            buffers = self._input_buffers(chunk, host_inputs)
+            for buffer, host_input in zip(buffers, host_inputs):
+                buffer[:chunk.rows] = host_input[start:start + chunk.rows]
+                # Padding rows keep whatever they held before, their outputs are discarded
+
+            outputs = self.execute(chunk.profile, buffers)
+            if results is None:
+                results = self._output_buffers(num_rows, outputs)
+                self.output_buffers_inputs = inputs_key
+            for result, output in zip(results, outputs):
+                result[start:start + chunk.rows] = output[:chunk.rows]
+            start += chunk.rows
+
+        return [result[:num_rows] for result in results]
+
+
+def engine_executor(engine, cuda_graphs: bool = False):
+    """Returns an `execute` function for PaddedExecutor running on `engine`, with one
+    execution context (infer.EngineRunner) per profile, created on first use.
+
+    With `cuda_graphs`, each profile replays a graph of its last batch shape (see
+    cuda_graphs.CudaGraphRunner), which suits profiles covering a single batch size.
+    """
+    from cuda_graphs import get_runner  # local module
+    runners = {}
+
+    def execute(profile_index: int, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        if profile_index not in runners:
+            runners[profile_index] = get_runner(engine, profile_index, cuda_graphs)
+        return runners[profile_index].infer(host_inputs)
+
+    return execute
+
+
+def profile_batch_ranges(metadata: dict, input_name: str = None) -> List[Tuple[int, int]]:
+    """(min batch, max batch) of each profile from an engine sidecar (see engine_inspector.py)."""
+    from engine_inspector import profile_shapes  # local module
+    if metadata.get("implicit_batch"):
+        return [(1, metadata["max_batch_size"])]
+    ranges = []
+    for profile in metadata["profiles"]:
+        profile = profile_shapes(profile)
+        shapes = profile[input_name] if input_name else next(iter(profile.values()))
+        ranges.append((shapes["min"][0], shapes["max"][0]))
+    return ranges
+
+
+def measure_latency_table(engine_path: str, batch_sizes: List[int], iterations: int = 50, warmup: int = 5) -> LatencyTable:
+    """Measures each profile of an engine at every batch size of `batch_sizes` within its range."""
+    import infer  # local module
+    engine = infer.load_engine(engine_path)
+    profiles, latencies = [], []
+    for profile_index in range(engine.num_optimization_profiles):
+        runner = infer.EngineRunner(engine, profile_index)
+        input_idx = runner.input_binding_idxs[0]
+        kmin, _, kmax = engine.get_profile_shape(profile_index, input_idx)
+        profiles.append((kmin[0], kmax[0]))
+
+        table = {}
+        for batch_size in sorted(set(batch_sizes) | {kmin[0], kmax[0]}):
+            if not kmin[0] <= batch_size <= kmax[0]:
+                continue
+            host_inputs = [np.random.random((batch_size, *engine.get_profile_shape(profile_index, idx)[2][1:])).astype(np.float32)
+                           for idx in runner.input_binding_idxs]
+            timings = []
+            for _ in range(warmup + iterations):
+                start = time.perf_counter()
+                runner.infer(host_inputs)
+                timings.append(time.perf_counter() - start)
+            table[batch_size] = 1000 * float(np.median(timings[warmup:]))
+            print("Profile {} batch {}: {:.3f} ms".format(profile_index, batch_size, table[batch_size]))
+        latencies.append(table)
+
+    return LatencyTable(profiles, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures per-profile latency tables and shows the routing plan for batch sizes.")
+    subparsers = parser.add_subparsers(dest="command")
+    measure = subparsers.add_parser("measure", help="Measure the latency table of an engine's profiles.")
+    measure.add_argument("-e", "--engine", required=True, type=str, help="Path to TensorRT engine file.")
+    measure.add_argument("-b", "--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64],
+                         help="Batch sizes to measure (within each profile's range).")
+    measure.add_argument("-o", "--output", default="latency_table.json", help="Path to write the latency table to.")
+    plan = subparsers.add_parser("plan", help="Show the routing plan for batch sizes.")
+    plan.add_argument("-t", "--table", required=True, help="Latency table written by 'measure'.")
+    plan.add_argument("batch_sizes", type=int, nargs="+", help="Request batch sizes to plan for.")
+    args = parser.parse_args()
+
+    if args.command == "measure":
+        table = measure_latency_table(args.engine, args.batch_sizes)
+        with open(args.output, "w") as f:
+            json.dump(table.to_json(), f, indent=4)
+    elif args.command == "plan":
+        with open(args.table, "r") as f:
+            router = ShapeRouter(LatencyTable.from_json(json.load(f)))
+        for batch_size in args.batch_sizes:
+            chunks = ", ".join("profile {} x{} ({} padded)".format(c.profile, c.batch, c.batch - c.rows)
+                               for c in router.plan(batch_size))
+            print("Batch {}: {} -> {:.3f} ms".format(batch_size, chunks, router.predicted_latency(batch_size)))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+from typing import List
+
+import numpy as np
+
+# Offsets of tensors within a buffer are aligned so that views are aligned for any dtype
+ALIGNMENT = 64
+
+# Describes where one tensor lives inside a shared buffer
+TensorSpec = namedtuple("TensorSpec", ["dtype", "shape", "offset"])
+
+
+def align(size: int, alignment: int = ALIGNMENT) -> int:
+    return (size + alignment - 1) // alignment * alignment
+
+
+def write_tensors(buffer, arrays: List[np.ndarray]) -> List[TensorSpec]:
+    """Copies `arrays` back to back into `buffer` and returns the specs needed to read them back."""
+    specs = []
+    offset = 0
+    for array in arrays:
+        array = np.asarray(array)
+        if offset + array.nbytes > len(buffer):
+            raise ValueError("Tensors need at least {} bytes, but the buffer only has {}".format(
+                offset + array.nbytes, len(buffer)))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=buffer, offset=offset)
+        view[...] = array
+        specs.append(TensorSpec(array.dtype.str, tuple(array.shape), offset))
+        offset = align(offset + array.nbytes)
+    return specs
+
+
+def read_tensors(buffer, specs: List[TensorSpec], copy: bool = False) -> List[np.ndarray]:
+    """Returns the tensors described by `specs` as views of `buffer`, or copies if `copy` is set.
+    Views are only valid until the buffer is written to again or closed."""
+    arrays = [np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=buffer, offset=spec.offset) for spec in specs]
+    if copy:
+        arrays = [array.copy() for array in arrays]
+    return arrays
+
+
+def create_shared_buffer(size: int) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(create=True, size=size)
+
+
+def attach_shared_buffer(name: str, untrack: bool = False) -> shared_memory.SharedMemory:
+    """Attaches to a buffer created by another process.
+
+    The creating process is responsible for unlinking the buffer. Child processes share their
+    parent's resource tracker, but an unrelated process (ex: a server attaching to a client's
+    buffer) should set `untrack`, otherwise its own resource tracker unlinks the buffer when it exits.
+    """
+    buffer = shared_memory.SharedMemory(name=name)
+    if untrack:
+        resource_tracker.unregister(buffer._name, "shared_memory")
+    return buffer
+
+
+def encode_specs(specs: List[TensorSpec]) -> bytes:
+    """Packs tensor specs into a compact binary form:
+    count (u16), then per tensor: dtype length (u8), dtype, ndim (u8), dims (i64 each), offset (u64)."""
+    parts = [struct.pack("<H", len(specs))]
+    for spec in specs:
+        dtype = spec.dtype.encode("ascii")
+        parts.append(struct.pack("<B", len(dtype)) + dtype)
+        parts.append(struct.pack("<B{}q".format(len(spec.shape)), len(spec.shape), *spec.shape))
+        parts.append(struct.pack("<Q", spec.offset))
+    return b"".join(parts)
+
+
+def decode_specs(data: bytes) -> List[TensorSpec]:
+    (count,), position = struct.unpack_from("<H", data), 2
+    specs = []
+    for _ in range(count):
+        (dtype_length,), position = struct.unpack_from("<B", data, position), position + 1
+        dtype, position = data[position:position+dtype_length].decode("ascii"), position + dtype_length
+        (ndim,), position = struct.unpack_from("<B", data, position), position + 1
+        shape, position = struct.unpack_from("<{}q".format(ndim), data, position), position + 8 * ndim
+        (offset,), position = struct.unpack_from("<Q", data, position), position + 8
+        specs.append(TensorSpec(dtype, tuple(shape), offset))
+    return specs
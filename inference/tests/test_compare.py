@@ -0,0 +1,34 @@
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from compare import OutputStats
+
+
+def test_zero_output_against_nonzero_reference_disagrees():
+    stats = OutputStats()
+    reference = np.vstack([np.linspace(-1, 1, 10), np.zeros(10)]).astype(np.float32)
+    stats.update(np.zeros_like(reference), reference)
+    # Row 0: all-zero output (ex: INT8 underflow) vs. non-zero reference, row 1: both zero
+    assert stats.min_cosine == 0.0
+    assert stats.sum_cosine == 1.0
+
+
+def test_identical_outputs_agree():
+    stats = OutputStats()
+    reference = np.random.RandomState(0).randn(4, 10).astype(np.float32)
+    stats.update(reference.copy(), reference)
+    assert np.isclose(stats.min_cosine, 1.0)
@@ -0,0 +1,115 @@
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from cuda_graphs import GraphCache, FakeGraphBackend, graph_key
+
+
+def key(batch, profile=0):
+    return graph_key(profile, [(batch, 3, 224, 224)])
+
+
+def test_graph_key_normalizes_shapes():
+    assert graph_key(0, [[8, 3, 224, 224]]) == graph_key(0, [np.zeros((8, 3, 224, 224)).shape])
+    assert graph_key(0, [(8, 3, 224, 224)]) == (0, ((8, 3, 224, 224),))
+    assert graph_key(np.int64(1), [(np.int64(8), 3)]) == (1, ((8, 3),))
+    assert key(8, profile=0) != key(8, profile=1)
+    assert key(8) != key(16)
+
+
+def test_hit_returns_captured_graph():
+    backend = FakeGraphBackend()
+    cache = GraphCache(backend, max_graphs=2)
+    graph = cache.get(key(1))
+    assert cache.get(key(1)) is graph
+    assert backend.captured == [key(1)]
+    assert cache.stats["captures"] == 1 and cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_lru_eviction():
+    backend = FakeGraphBackend()
+    cache = GraphCache(backend, max_graphs=2)
+    cache.get(key(1))
+    cache.get(key(2))
+    cache.get(key(1))  # key(2) is now the least recently used
+    cache.get(key(4))
+    assert backend.destroyed == [key(2)]
+    assert key(1) in cache and key(4) in cache and key(2) not in cache
+    assert len(cache) == 2
+    assert cache.stats["evictions"] == 1
+
+
+def test_eviction_happens_before_capture():
+    # With max_graphs=1 the previous graph must be gone before its context is re-captured
+    events = []
+
+    class RecordingBackend(FakeGraphBackend):
+        def capture(self, key):
+            events.append(("capture", key))
+            return super().capture(key)
+
+        def destroy(self, graph):
+            events.append(("destroy", graph["key"]))
+            super().destroy(graph)
+
+    cache = GraphCache(RecordingBackend(), max_graphs=1)
+    cache.get(key(1))
+    cache.get(key(2))
+    assert events == [("capture", key(1)), ("destroy", key(1)), ("capture", key(2))]
+
+
+def test_failed_capture_is_not_retried(capsys):
+    backend = FakeGraphBackend(fail_keys=[key(3)])
+    cache = GraphCache(backend, max_graphs=4)
+    assert cache.get(key(3)) is None
+    assert cache.get(key(3)) is None
+    assert key(3) in cache.failed and key(3) not in cache
+    assert backend.captured == []
+    assert cache.stats["capture_failures"] == 1 and cache.stats["misses"] == 2
+    # The fallback is reported once, as a warning
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 and lines[0].startswith("WARNING: Failed to capture graph")
+
+
+def test_invalidate_by_predicate():
+    backend = FakeGraphBackend(fail_keys=[key(3, profile=1)])
+    cache = GraphCache(backend, max_graphs=4)
+    cache.get(key(1, profile=0))
+    cache.get(key(1, profile=1))
+    cache.get(key(3, profile=1))
+    cache.invalidate(lambda k: k[0] == 1)
+    assert backend.destroyed == [key(1, profile=1)]
+    assert key(1, profile=0) in cache and len(cache) == 1
+    # Failed captures of invalidated keys are retried
+    assert cache.failed == set()
+    backend.fail_keys.clear()
+    assert cache.get(key(3, profile=1)) is not None
+    assert cache.stats["invalidations"] == 1
+
+
+def test_invalidate_all_and_clear():
+    backend = FakeGraphBackend(fail_keys=[key(3)])
+    cache = GraphCache(backend, max_graphs=4)
+    cache.get(key(1))
+    cache.get(key(3))
+    cache.clear()
+    assert len(cache) == 0 and backend.destroyed == [key(1)]
+    # clear() keeps failures, invalidate() forgets them
+    assert key(3) in cache.failed
+    cache.get(key(2))
+    cache.invalidate()
+    assert len(cache) == 0 and cache.failed == set()
+    assert backend.destroyed == [key(1), key(2)]
@@ -0,0 +1,151 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from dataset_runner import ArraySource, NpyWriter, batch_samples, decode_parallel, prefetch, run
+
+SAMPLE_SHAPE = (2, 3)
+
+
+class CountingSource:
+    """Sample i is filled with i. Tracks how many loads were started ahead of the consumer."""
+
+    def __init__(self, num_samples, delay=0.0):
+        self.num_samples = num_samples
+        self.delay = delay
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.num_samples
+
+    def key(self, index):
+        return "sample_{}".format(index)
+
+    def load(self, index):
+        with self.lock:
+            self.started += 1
+        time.sleep(self.delay)
+        return np.full(SAMPLE_SHAPE, index, dtype=np.float32)
+
+
+class SumRunner:
+    """Stands in for infer.EngineRunner: one output, the sum of each sample."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def infer(self, host_inputs):
+        batch = host_inputs[0]
+        self.batch_sizes.append(len(batch))
+        return [batch.reshape(len(batch), -1).sum(axis=1, keepdims=True)]
+
+
+def test_decode_parallel_is_ordered_and_bounded():
+    source = CountingSource(100, delay=0.001)
+    window = 8
+    seen = []
+    for index, sample in decode_parallel(source, num_workers=4, window=window):
+        # Never more than `window` samples submitted beyond those consumed
+        assert source.started <= len(seen) + window + 1
+        assert (sample == index).all()
+        seen.append(index)
+    assert seen == list(range(100))
+
+
+def test_batch_samples_reuses_ring_buffers():
+    samples = ((i, np.full(SAMPLE_SHAPE, i, dtype=np.float32)) for i in range(10))
+    batches = list(batch_samples(samples, batch_size=3, sample_shape=SAMPLE_SHAPE, num_buffers=2))
+    assert [indices for indices, _ in batches] == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    # Buffer 0 serves batches 0 and 2, buffer 1 batches 1 and 3
+    assert batches[0][1] is batches[2][1]
+    assert np.shares_memory(batches[1][1], batches[3][1])
+    assert batches[3][1].shape == (1, *SAMPLE_SHAPE)
+    assert (batches[3][1] == 9).all()
+
+
+def test_batches_stay_valid_while_prefetching():
+    # The consumer is slower than the producer, so the prefetch queue is always full: the batch
+    # being consumed must not be overwritten while the next ones are produced
+    depth = 2
+    samples = ((i, np.full(SAMPLE_SHAPE, i, dtype=np.float32)) for i in range(64))
+    batches = prefetch(batch_samples(samples, 4, SAMPLE_SHAPE, num_buffers=depth + 2), depth)
+    for number, (indices, batch) in enumerate(batches):
+        time.sleep(0.005)
+        assert indices == list(range(4 * number, 4 * number + 4))
+        assert (batch == np.array(indices, dtype=np.float32)[:, None, None]).all()
+
+
+def test_prefetch_is_bounded():
+    produced = []
+
+    def produce():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    items = prefetch(produce(), depth=3)
+    assert next(items) == 0
+    time.sleep(0.05)
+    # 1 consumed, 3 queued, and 1 waiting to be queued
+    assert len(produced) <= 5
+    assert list(items) == list(range(1, 20))
+
+
+def test_prefetch_raises_producer_errors():
+    def produce():
+        yield 1
+        raise ValueError("decode failed")
+
+    items = prefetch(produce())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="decode failed"):
+        next(items)
+
+
+@pytest.mark.parametrize("fixed_batch", [False, True])
+def test_run_writes_every_sample_in_order(tmp_path, fixed_batch):
+    source = CountingSource(10)
+    runner = SumRunner()
+    path = str(tmp_path / "outputs.npy")
+    writer = NpyWriter(path, len(source), (1,))
+    run(runner, source, 4, SAMPLE_SHAPE, [(0, writer)], fixed_batch, num_workers=2, prefetch_depth=2)
+    writer.close()
+
+    expected = np.arange(10, dtype=np.float32)[:, None] * np.prod(SAMPLE_SHAPE)
+    np.testing.assert_array_equal(np.load(path), expected)
+    # Fixed batch engines get a padded last batch, dynamic ones a smaller one
+    assert runner.batch_sizes == ([4, 4, 4] if fixed_batch else [4, 4, 2])
+
+
+def test_array_sources(tmp_path):
+    array = np.arange(24, dtype=np.float32).reshape(4, *SAMPLE_SHAPE)
+    np.save(str(tmp_path / "data.npy"), array)
+    np.savez(str(tmp_path / "data.npz"), other=np.zeros(1), inputs=array)
+    array.tofile(str(tmp_path / "data.bin"))
+
+    sources = [ArraySource(str(tmp_path / "data.npy")),
+               ArraySource(str(tmp_path / "data.npz"), key="inputs"),
+               ArraySource(str(tmp_path / "data.bin"), sample_shape=SAMPLE_SHAPE)]
+    for source in sources:
+        assert len(source) == 4
+        np.testing.assert_array_equal(source.load(2), array[2])
+    assert sources[0].key(3).endswith("data.npy:3")
+    with pytest.raises(ValueError):
+        ArraySource(str(tmp_path / "data.bin"))
@@ -0,0 +1,76 @@
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from engine_inspector import EngineIndex, supported_profiles, profile_indices
+from shape_router import profile_batch_ranges
+
+
+def binding(index, name, is_input, shape, profile):
+    return {"index": index, "name": name, "is_input": is_input, "shape": shape, "dtype": "float32", "profile": profile}
+
+
+def multi_profile_sidecar(profile_names=("input", "input [profile 1]", "input [profile 2]")):
+    """Sidecar of a --batch-sizes 1 8 16 build, profiles keyed by `profile_names`."""
+    batches = [(1, 1), (2, 8), (9, 16)]
+    bindings = []
+    for profile, name in enumerate(profile_names):
+        suffix = " [profile {}]".format(profile) if profile else ""
+        bindings.append(binding(2 * profile, "input" + suffix, True, [-1, 3, 224, 224], profile))
+        bindings.append(binding(2 * profile + 1, "output" + suffix, False, [-1, 1000], profile))
+    profiles = [{name: {"min": [lo, 3, 224, 224], "opt": [hi, 3, 224, 224], "max": [hi, 3, 224, 224]}}
+                for name, (lo, hi) in zip(profile_names, batches)]
+    return {"sidecar_version": 1, "implicit_batch": False, "max_batch_size": 1, "num_profiles": 3,
+            "bindings": bindings, "profiles": profiles, "builder_flags": ["fp16"]}
+
+
+def implicit_batch_sidecar(max_batch_size=16):
+    return {"sidecar_version": 1, "implicit_batch": True, "max_batch_size": max_batch_size, "num_profiles": 1,
+            "bindings": [binding(0, "input", True, [3, 224, 224], 0), binding(1, "output", False, [1000], 0)],
+            "profiles": [], "builder_flags": []}
+
+
+def test_batch_resolves_to_its_own_profile():
+    metadata = multi_profile_sidecar(("input", "input", "input"))
+    assert supported_profiles(metadata, {"input": [8, 3, 224, 224]}) == [1]
+    assert supported_profiles(metadata, {"input": [16, 3, 224, 224]}) == [2]
+    assert supported_profiles(metadata, {"input": [1, 3, 224, 224]}) == [0]
+    assert supported_profiles(metadata, {"input": [17, 3, 224, 224]}) == []
+
+
+def test_suffixed_profile_names_are_normalized():
+    # Sidecars written before profiles were keyed by base binding name
+    metadata = multi_profile_sidecar()
+    assert supported_profiles(metadata, {"input": [8, 3, 224, 224]}) == [1]
+    assert profile_batch_ranges(metadata, "input") == [(1, 1), (2, 8), (9, 16)]
+
+
+def test_index_by_input_uses_base_names():
+    index = EngineIndex()
+    index.add("resnet50.engine", multi_profile_sidecar())
+    assert set(index.by_input) == {"input"}
+    assert index.find(input_name="input", input_shapes={"input": [8, 3, 224, 224]}) == ["resnet50.engine"]
+
+
+def test_implicit_batch_supports_any_batch_up_to_max():
+    metadata = implicit_batch_sidecar(16)
+    assert supported_profiles(metadata, {"input": [8, 3, 224, 224]}) == [0]
+    assert supported_profiles(metadata, {"input": [32, 3, 224, 224]}) == []
+    assert supported_profiles(metadata, {"input": [8, 3, 112, 112]}) == []
+    assert profile_indices(metadata) == [0]
+    assert profile_batch_ranges(metadata) == [(1, 16)]
+
+    index = EngineIndex()
+    index.add("implicit.engine", metadata)
+    assert index.find(input_shapes={"input": [8, 3, 224, 224]}) == ["implicit.engine"]
@@ -0,0 +1,129 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+
+import pytest
+
+from instrumentation import NULL_TIMER, Metrics
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    assert metrics.timer("execute") is NULL_TIMER
+    with metrics.timer("execute"):
+        pass
+    metrics.count("inference_rows", 8)
+    metrics.observe("latency", 0.1)
+    assert metrics.counters == {} and metrics.histograms == {} and metrics.trace_events == []
+    assert metrics.to_prometheus() == "\n"
+
+
+def test_prometheus_counters_and_histograms():
+    metrics = Metrics(namespace="test", enabled=True)
+    metrics.count("batches")
+    metrics.count("batches", 2)
+    metrics.count("rows", 8, profile=1)
+    metrics.count("rows", 4, profile=0)
+    for value in (0.001, 0.003, 0.003, 100.0):
+        metrics.observe("execute_seconds", value, buckets=(0.001, 0.005, 1.0))
+
+    lines = metrics.to_prometheus().splitlines()
+    assert lines == [
+        "# TYPE test_batches_total counter",
+        "test_batches_total 3",
+        "# TYPE test_rows_total counter",
+        'test_rows_total{profile="0"} 4',
+        'test_rows_total{profile="1"} 8',
+        "# TYPE test_execute_seconds histogram",
+        # Buckets are cumulative, and a value equal to a bound falls in that bucket
+        'test_execute_seconds_bucket{le="0.001"} 1',
+        'test_execute_seconds_bucket{le="0.005"} 3',
+        'test_execute_seconds_bucket{le="1.0"} 3',
+        'test_execute_seconds_bucket{le="+Inf"} 4',
+        "test_execute_seconds_sum 100.007",
+        "test_execute_seconds_count 4",
+    ]
+
+
+def test_prometheus_label_values_are_escaped():
+    metrics = Metrics(enabled=True)
+    metrics.count("loads", engine='C:\\engines\\"resnet50"')
+    assert 'trt_loads_total{engine="C:\\\\engines\\\\\\"resnet50\\""} 1' in metrics.to_prometheus()
+
+
+def test_timer_records_histogram_and_trace_event():
+    metrics = Metrics(enabled=True)
+    with metrics.timer("deserialize", engine="resnet50"):
+        pass
+    (key, histogram), = metrics.histograms.items()
+    assert key == ("deserialize_seconds", (("engine", "resnet50"),))
+    assert histogram.count == 1 and histogram.sum >= 0
+
+    trace = metrics.to_chrome_trace()
+    assert trace["displayTimeUnit"] == "ms"
+    event, = trace["traceEvents"]
+    assert event["name"] == "deserialize" and event["ph"] == "X"
+    assert event["args"] == {"engine": "resnet50"}
+    assert event["ts"] >= 0 and event["dur"] == pytest.approx(histogram.sum * 1e6)
+    assert event["tid"] == threading.get_ident()
+
+
+def test_trace_events_are_bounded_but_still_aggregated():
+    metrics = Metrics(enabled=True, max_trace_events=3)
+    for _ in range(10):
+        with metrics.timer("h2d"):
+            pass
+    assert len(metrics.to_chrome_trace()["traceEvents"]) == 3
+    assert metrics.summary()["h2d_seconds"]["count"] == 10
+
+    metrics.enable(trace=False)
+    with metrics.timer("d2h"):
+        pass
+    assert len(metrics.trace_events) == 3
+
+
+def test_concurrent_updates():
+    metrics = Metrics(enabled=True)
+
+    def work():
+        for _ in range(1000):
+            metrics.count("requests")
+            with metrics.timer("infer"):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.counters[("requests", ())] == 8000
+    assert metrics.histograms[("infer_seconds", ())].count == 8000
+    assert len(metrics.trace_events) == 8000
+
+
+def test_write_and_reset(tmp_path):
+    metrics = Metrics(enabled=True)
+    with metrics.timer("build"):
+        pass
+    prometheus_path, trace_path = str(tmp_path / "metrics.prom"), str(tmp_path / "trace.json")
+    metrics.write(prometheus_path, trace_path)
+    with open(prometheus_path) as f:
+        assert "trt_build_seconds_count 1" in f.read()
+    with open(trace_path) as f:
+        assert [event["name"] for event in json.load(f)["traceEvents"]] == ["build"]
+
+    metrics.reset()
+    assert metrics.summary() == {} and metrics.to_chrome_trace()["traceEvents"] == []
@@ -0,0 +1,127 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from postprocessing import (LabelTable, Postprocessor, TopKCsvWriter, TopKJsonlWriter, naive_postprocess, softmax_,
+                            topk)
+
+LABELS = LabelTable(["cat", "dog", "fish", "bird"])
+OUTPUTS = np.array([[1.0, 3.0, 2.0, 0.0],
+                    [0.5, -1.0, 0.25, 4.0]], dtype=np.float32)
+
+
+def test_softmax_is_in_place_and_stable():
+    logits = np.array([[1000.0, 1000.0, -1000.0], [0.0, np.log(3.0), -np.inf]], dtype=np.float32)
+    result = softmax_(logits)
+    assert result is logits
+    np.testing.assert_allclose(logits, [[0.5, 0.5, 0.0], [0.25, 0.75, 0.0]], atol=1e-6)
+
+
+def test_topk_matches_argsort():
+    scores = np.random.RandomState(0).randn(64, 1000).astype(np.float32)
+    indices, values = topk(scores, 5)
+    expected = np.argsort(-scores, axis=1)[:, :5]
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_array_equal(values, np.take_along_axis(scores, expected, axis=1))
+
+
+def test_topk_flattens_and_caps_k():
+    indices, values = topk(OUTPUTS.reshape(2, 4, 1, 1), 10)
+    assert indices.tolist() == [[1, 2, 0, 3], [3, 0, 2, 1]]
+    assert values[0].tolist() == [3.0, 2.0, 1.0, 0.0]
+
+
+def test_postprocessor_leaves_outputs_untouched():
+    outputs = OUTPUTS.copy()
+    postprocess = Postprocessor(k=2, softmax=True, labels=LABELS)
+    result = postprocess(outputs)
+    np.testing.assert_array_equal(outputs, OUTPUTS)
+
+    assert result.indices.tolist() == [[1, 2], [3, 0]]
+    assert result.labels.tolist() == [["dog", "fish"], ["bird", "cat"]]
+    expected = np.exp(OUTPUTS) / np.exp(OUTPUTS).sum(axis=1, keepdims=True)
+    np.testing.assert_allclose(result.scores, np.take_along_axis(expected, result.indices, axis=1), rtol=1e-6)
+
+
+def test_postprocessor_reuses_scratch_for_smaller_batches():
+    postprocess = Postprocessor(k=1, softmax=True)
+    postprocess(np.zeros((8, 4), dtype=np.float32))
+    scratch = postprocess.scratch
+    result = postprocess(OUTPUTS)
+    assert postprocess.scratch is scratch
+    assert result.indices.tolist() == [[1], [3]] and result.labels is None
+    # A different number of classes needs a new buffer
+    postprocess(np.zeros((2, 5), dtype=np.float32))
+    assert postprocess.scratch is not scratch
+
+
+def test_matches_naive_postprocess():
+    outputs = np.random.RandomState(1).randn(16, 100).astype(np.float32) * 4
+    labels = LabelTable(["class_{}".format(i) for i in range(100)])
+    result = Postprocessor(5, softmax=True, labels=labels)(outputs)
+    naive = naive_postprocess(outputs, 5, labels.labels.tolist())
+    assert result.indices.tolist() == [[i for i, _, _ in row] for row in naive]
+    assert result.labels.tolist() == [[label for _, _, label in row] for row in naive]
+    np.testing.assert_allclose(result.scores, [[p for _, p, _ in row] for row in naive], atol=1e-6)
+
+
+def test_label_table_from_file(tmp_path):
+    path = tmp_path / "labels.txt"
+    path.write_text("cat\n\ndog\n")
+    table = LabelTable.from_file(str(path))
+    assert len(table) == 2
+    assert table.lookup(np.array([[1, 0]])).tolist() == [["dog", "cat"]]
+
+
+@pytest.mark.parametrize("labels", [None, LABELS])
+def test_csv_writer(tmp_path, labels):
+    path = str(tmp_path / "outputs.topk.csv")
+    writer = TopKCsvWriter(path, k=2, labels=labels)
+    writer.write([0, 1], ["a.jpg", "b.jpg"], OUTPUTS)
+    writer.write([2], ["c.jpg"], OUTPUTS[1:])
+    writer.close()
+
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    if labels is None:
+        assert rows[0] == ["key", "class0", "score0", "class1", "score1"]
+        assert rows[1] == ["a.jpg", "1", "3.0", "2", "2.0"]
+    else:
+        assert rows[0] == ["key", "class0", "score0", "label0", "class1", "score1", "label1"]
+        assert rows[1] == ["a.jpg", "1", "3.0", "dog", "2", "2.0", "fish"]
+    assert [row[0] for row in rows[1:]] == ["a.jpg", "b.jpg", "c.jpg"]
+    assert rows[2][1:] == rows[3][1:]
+
+
+@pytest.mark.parametrize("labels", [None, LABELS])
+def test_jsonl_writer(tmp_path, labels):
+    path = str(tmp_path / "outputs.topk.jsonl")
+    writer = TopKJsonlWriter(path, k=2, softmax=True, labels=labels)
+    writer.write([0, 1], ["a.jpg", "b.jpg"], OUTPUTS)
+    writer.close()
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["key"] for record in records] == ["a.jpg", "b.jpg"]
+    assert records[1]["classes"] == [3, 0]
+    assert all(0 < score <= 1 for record in records for score in record["scores"])
+    if labels is None:
+        assert "labels" not in records[0]
+    else:
+        assert records[0]["labels"] == ["dog", "fish"]
@@ -0,0 +1,148 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+import server
+import protocol
+from client import InferenceClient
+from server import InferenceServer
+from shm_tensors import attach_shared_buffer, create_shared_buffer
+from worker_pool import EchoBackend
+
+
+@pytest.fixture(autouse=True)
+def track_server_buffers(monkeypatch):
+    # Client and server share this process' resource tracker, so the server must not untrack
+    # the client's buffers, or the client's unlink() makes the tracker complain
+    monkeypatch.setattr(server, "attach_shared_buffer", lambda name, untrack=False: attach_shared_buffer(name))
+
+
+class ThreadAffineBackend:
+    """Backend only usable on the thread that created it, like one holding a CUDA context."""
+
+    def __init__(self):
+        self.created = []
+
+    def __call__(self, device_id):
+        owner = threading.get_ident()
+        self.created.append((owner, device_id))
+
+        def infer(host_inputs):
+            if threading.get_ident() != owner:
+                raise RuntimeError("Backend created on thread {} called on thread {}".format(owner, threading.get_ident()))
+            return host_inputs
+        return infer
+
+
+class FailingBackend:
+    def __call__(self, device_id):
+        def infer(host_inputs):
+            raise ValueError("bad input shape {}".format(host_inputs[0].shape))
+        return infer
+
+
+def run_with_server(socket_path, client, backend_factory=EchoBackend(), **kwargs):
+    """Runs the blocking `client(socket_path)` against a server and returns its result."""
+    async def run():
+        inference_server = InferenceServer(backend_factory, **kwargs)
+        unix_server = await asyncio.start_unix_server(inference_server.handle_connection, path=socket_path)
+        async with unix_server:
+            return await asyncio.get_running_loop().run_in_executor(None, client, socket_path)
+    return asyncio.run(run())
+
+
+def infer_client(batches):
+    """Client sending each of `batches` on one connection, returning their outputs."""
+    def client(socket_path):
+        with InferenceClient(socket_path, 2**16, 2**16) as client:
+            return [client.infer(host_inputs) for host_inputs in batches]
+    return client
+
+
+def register(payload):
+    """Client sending one REGISTER message, returning (status, response payload)."""
+    def client(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(protocol.pack_header(protocol.REGISTER, len(payload), 7) + payload)
+            header = sock.recv(protocol.HEADER.size, socket.MSG_WAITALL)
+            _, status, payload_length, request_id = protocol.unpack_header(header)
+            response = sock.recv(payload_length, socket.MSG_WAITALL) if payload_length else b""
+            assert request_id == 7
+            return status, response
+    return client
+
+
+def test_round_trip(tmp_path):
+    batches = [
+        [np.arange(6, dtype=np.float32).reshape(2, 3)],
+        [np.random.rand(4, 3, 8, 8).astype(np.float16), np.array([[1, 2]], dtype=np.int64)],
+    ]
+    outputs = run_with_server(str(tmp_path / "server.sock"), infer_client(batches))
+    for host_inputs, host_outputs in zip(batches, outputs):
+        assert len(host_outputs) == len(host_inputs)
+        for host_output, host_input in zip(host_outputs, host_inputs):
+            assert host_output.dtype == host_input.dtype
+            np.testing.assert_array_equal(host_output, host_input)
+
+
+def test_backend_is_created_and_called_on_its_inference_thread(tmp_path):
+    backend = ThreadAffineBackend()
+    batches = [[np.full((2, 3), i, dtype=np.float32)] for i in range(5)]
+    outputs = run_with_server(str(tmp_path / "server.sock"), infer_client(batches), backend, device_id=3)
+    assert [o[0][0, 0] for o in outputs] == list(range(5))
+    assert len(backend.created) == 1
+    assert backend.created[0][0] != threading.get_ident()
+    assert backend.created[0][1] == 3
+
+
+def test_inference_error_gets_an_error_response(tmp_path):
+    def client(socket_path):
+        with InferenceClient(socket_path, 2**16, 2**16) as client:
+            with pytest.raises(RuntimeError, match="bad input shape"):
+                client.infer([np.zeros((2, 3), dtype=np.float32)])
+            # The connection stays usable
+            with pytest.raises(RuntimeError, match="bad input shape"):
+                client.infer([np.zeros((5, 3), dtype=np.float32)])
+    run_with_server(str(tmp_path / "server.sock"), client, FailingBackend())
+
+
+@pytest.mark.parametrize("payload", [
+    protocol.encode_names("trt_server_test_missing_a", "trt_server_test_missing_b"),
+    protocol.encode_names("only_one"),
+    b"\xff",
+])
+def test_bad_register_gets_an_error_response(tmp_path, payload):
+    status, response = run_with_server(str(tmp_path / "server.sock"), register(payload))
+    assert status == protocol.STATUS_ERROR
+    assert response.startswith(b"REGISTER failed")
+
+
+def test_wrong_number_of_buffers(tmp_path):
+    buffers = [create_shared_buffer(2**12) for _ in range(3)]
+    try:
+        payload = protocol.encode_names(*[buffer.name for buffer in buffers])
+        status, response = run_with_server(str(tmp_path / "server.sock"), register(payload))
+        assert status == protocol.STATUS_ERROR
+        assert b"Expected 2 buffer names" in response
+    finally:
+        for buffer in buffers:
+            buffer.close()
+            buffer.unlink()
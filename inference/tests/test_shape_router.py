@@ -0,0 +1,53 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from shape_router import LatencyTable, ShapeRouter, PaddedExecutor
+
+
+def make_executor():
+    """Two profiles (batch 1-4 and 5-16) of a fake model returning (sum of each row, doubled input)."""
+    table = LatencyTable([(1, 4), (5, 16)], [{1: 1.0, 4: 2.0}, {5: 2.5, 16: 4.0}])
+    calls = []
+
+    def execute(profile_index, host_inputs):
+        calls.append((profile_index, host_inputs[0].shape[0]))
+        x = host_inputs[0]
+        return [x.reshape(x.shape[0], -1).sum(axis=1, keepdims=True), (x * 2).astype(np.float16)]
+
+    return PaddedExecutor(ShapeRouter(table), execute), calls
+
+
+def test_run_matches_unpadded():
+    executor, _ = make_executor()
+    for num_rows in (1, 3, 7, 21):
+        x = np.random.rand(num_rows, 2, 3).astype(np.float32)
+        sums, doubled = executor.run([x])
+        np.testing.assert_allclose(sums, x.reshape(num_rows, -1).sum(axis=1, keepdims=True), rtol=1e-6)
+        np.testing.assert_array_equal(doubled, (x * 2).astype(np.float16))
+
+
+def test_zero_rows_returns_empty_outputs():
+    executor, calls = make_executor()
+    sums, doubled = executor.run([np.zeros((0, 2, 3), dtype=np.float32)])
+    assert sums.shape == (0, 1) and sums.dtype == np.float32
+    assert doubled.shape == (0, 2, 3) and doubled.dtype == np.float16
+    assert len(calls) == 1
+
+    # Output shapes of the same input shapes are known from then on
+    executor.run([np.zeros((0, 2, 3), dtype=np.float32)])
+    assert len(calls) == 1
+    executor.run([np.ones((2, 2, 3), dtype=np.float32)])
+    assert executor.run([np.zeros((0, 5), dtype=np.float32)])[1].shape == (0, 5)
@@ -0,0 +1,115 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from shm_tensors import write_tensors, read_tensors, create_shared_buffer, encode_specs, decode_specs, ALIGNMENT
+from worker_pool import LeastOutstandingRouter, WorkerPool, EchoBackend, WorkerDiedError
+
+
+@pytest.fixture
+def shared_buffer():
+    buffer = create_shared_buffer(2**16)
+    yield buffer
+    buffer.close()
+    buffer.unlink()
+
+
+def test_router_picks_least_outstanding_round_robin():
+    router = LeastOutstandingRouter(3)
+    # Ties go round-robin
+    assert [router.acquire() for _ in range(3)] == [0, 1, 2]
+    router.release(1)
+    assert router.acquire() == 1
+    router.release(2)
+    router.release(0)
+    # 0 and 2 are tied, and the search starts after the last pick (1)
+    assert router.acquire() == 2
+    assert router.acquire() == 0
+    assert router.outstanding == [1, 1, 1]
+
+    router.disable(1)
+    assert [router.acquire() for _ in range(4)] == [2, 0, 2, 0]
+
+
+def test_tensor_round_trip_preserves_dtype_and_shape(shared_buffer):
+    arrays = [
+        np.random.rand(2, 3, 5).astype(np.float32),
+        np.random.rand(7).astype(np.float16),
+        np.arange(-5, 5, dtype=np.int8).reshape(2, 5),
+        np.array([True, False, True]),
+        np.array(3.5, dtype=np.float64),
+        np.zeros((0, 4), dtype=np.int64),
+        # Non-contiguous input
+        np.arange(24, dtype=np.int32).reshape(4, 6)[:, ::2],
+    ]
+    specs = write_tensors(shared_buffer.buf, arrays)
+    assert all(spec.offset % ALIGNMENT == 0 for spec in specs)
+    assert decode_specs(encode_specs(specs)) == specs
+
+    for output, array in zip(read_tensors(shared_buffer.buf, decode_specs(encode_specs(specs))), arrays):
+        assert output.dtype == array.dtype
+        assert output.shape == array.shape
+        np.testing.assert_array_equal(output, array)
+
+
+def test_slot_reuse_overwrites_views_but_not_copies(shared_buffer):
+    first = [np.ones((4, 4), dtype=np.float32)]
+    specs = write_tensors(shared_buffer.buf, first)
+    view = read_tensors(shared_buffer.buf, specs)[0]
+    copy = read_tensors(shared_buffer.buf, specs, copy=True)[0]
+
+    second = [np.full((2, 2), 7, dtype=np.int16), np.full(3, 2.0, dtype=np.float32)]
+    for output, array in zip(read_tensors(shared_buffer.buf, write_tensors(shared_buffer.buf, second)), second):
+        np.testing.assert_array_equal(output, array)
+    np.testing.assert_array_equal(copy, first[0])
+    assert not np.array_equal(view, first[0])
+
+
+def test_write_larger_than_buffer_raises(shared_buffer):
+    with pytest.raises(ValueError):
+        write_tensors(shared_buffer.buf, [np.zeros(2**16 + 1, dtype=np.uint8)])
+
+
+def test_pool_reuses_slots_across_requests():
+    # 2 workers with 1 slot each, so every request after the first two reuses a slot
+    with WorkerPool(EchoBackend(delay=0.001), workers_per_device=2, slots_per_worker=1, slot_bytes=2**16) as pool:
+        batches = [[np.full((i % 3 + 1, 4), i, dtype=dtype)] for i, dtype in
+                   enumerate([np.float32, np.float16, np.int32, np.uint8] * 5)]
+        futures = [pool.submit(batch) for batch in batches]
+        for future, batch in zip(futures, batches):
+            output = future.result(timeout=30)[0]
+            assert output.dtype == batch[0].dtype
+            np.testing.assert_array_equal(output, batch[0])
+        assert pool.router.outstanding == [0, 0]
+
+
+def test_dead_worker_fails_its_requests_and_restarts():
+    with WorkerPool(EchoBackend(crash_value=-1.0), slot_bytes=2**16, max_restarts=1) as pool:
+        inputs = [np.arange(8, dtype=np.float32)]
+        np.testing.assert_array_equal(pool.infer(inputs)[0], inputs[0])
+
+        with pytest.raises(WorkerDiedError):
+            pool.submit([np.full(8, -1.0, dtype=np.float32)]).result(timeout=30)
+        # Served by the restarted worker
+        np.testing.assert_array_equal(pool.submit(inputs).result(timeout=30)[0], inputs[0])
+
+
+def test_pool_broken_once_every_worker_is_dead():
+    with WorkerPool(EchoBackend(crash_value=-1.0), slot_bytes=2**16, max_restarts=0) as pool:
+        with pytest.raises(WorkerDiedError):
+            pool.submit([np.full(8, -1.0, dtype=np.float32)]).result(timeout=30)
+        with pytest.raises(WorkerDiedError):
+            pool.submit([np.zeros(8, dtype=np.float32)])
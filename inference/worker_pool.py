@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import List
+
+import numpy as np
+
+from shm_tensors import write_tensors, read_tensors, create_shared_buffer, attach_shared_buffer  # local module
+
+
+class LeastOutstandingRouter:
+    """Routes each request to the worker with the fewest requests in flight.
+    Ties are broken round-robin so idle workers share the load evenly."""
+
+    def __init__(self, num_workers: int):
+        self.outstanding = [0] * num_workers
+        self.next_worker = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> int:
+        with self.lock:
+            num_workers = len(self.outstanding)
+            order = [(self.next_worker + i) % num_workers for i in range(num_workers)]
+            worker = min(order, key=lambda w: self.outstanding[w])
+            self.outstanding[worker] += 1
+            self.next_worker = (worker + 1) % num_workers
+            return worker
+
+    def release(self, worker: int):
+        with self.lock:
+            self.outstanding[worker] -= 1
+
+    def disable(self, worker: int):
+        """Stops routing to a worker, ex: one that died too many times."""
+        with self.lock:
+            self.outstanding[worker] = float("inf")
+
+
+class WorkerDiedError(RuntimeError):
+    """Set on the futures of requests in flight on a worker process that exited (ex: segfault, OOM kill)."""
+
+
+def select_device(device_id: int):
+    """Makes `device_id` the only visible device, so pycuda.autoinit (imported by infer.py)
+    creates its context on it. Must be called before pycuda.autoinit is first imported."""
+    if "pycuda.autoinit" in sys.modules:
+        if os.environ.get("CUDA_VISIBLE_DEVICES") != str(device_id):
+            raise RuntimeError("pycuda.autoinit already created a context, can't switch to device {}".format(device_id))
+        return
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(device_id)
+
+
+class TensorRTBackend:
+    """Picklable backend factory, called once inside each worker to load the engine on its device.
+
+    The device is selected with CUDA_VISIBLE_DEVICES before infer.py's pycuda.autoinit context
+    is created, so one process can only load engines on one device. The returned function
+    must be called on the thread that called this, or another thread the context is current on.
+    """
+
+    def __init__(self, engine_path: str, profile_index: int = 0, cuda_graphs: bool = False):
+        self.engine_path = engine_path
+        self.profile_index = profile_index
+        self.cuda_graphs = cuda_graphs
+
+    def __call__(self, device_id: int):
+        select_device(device_id)
+        import pycuda.driver as cuda
+        import pycuda.autoinit
+        import infer  # local module
+        from cuda_graphs import get_runner  # local module
+        if cuda.Context.get_current() is None:
+            # pycuda.autoinit's context is only current on the thread that first imported it
+            pycuda.autoinit.context.push()
+        runner = get_runner(infer.load_engine(self.engine_path), self.profile_index, self.cuda_graphs)
+        return runner.infer
+
+
+class EchoBackend:
+    """CPU stand-in backend returning its inputs after an optional delay, for testing the pool without a GPU.
+    Exits the worker process, like a segfault would, on inputs whose first value is `crash_value`."""
+
+    def __init__(self, delay: float = 0.0, crash_value: float = None):
+        self.delay = delay
+        self.crash_value = crash_value
+
+    def __call__(self, device_id: int):
+        def infer(host_inputs):
+            if self.crash_value is not None and host_inputs[0].flat[0] == self.crash_value:
+                os._exit(1)
+            if self.delay:
+                time.sleep(self.delay)
+            return host_inputs
+        return infer
+
+
+def _worker_main(worker_id, device_id, backend_factory, input_names, output_names, requests, responses, pin_device):
+    if pin_device:
+        # Must happen before CUDA is initialized in this process
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device_id)
+
+    input_buffers = [attach_shared_buffer(name) for name in input_names]
+    output_buffers = [attach_shared_buffer(name) for name in output_names]
+    try:
+        infer = backend_factory(device_id)
+    except Exception as e:
+        responses.send(("failed", worker_id, None, None, repr(e)))
+        return
+    responses.send(("ready", worker_id, None, None, None))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+
+        request_id, slot, input_specs = message
+        try:
+            host_inputs = read_tensors(input_buffers[slot].buf, input_specs)
+            host_outputs = infer(host_inputs)
+            output_specs = write_tensors(output_buffers[slot].buf, host_outputs)
+            responses.send((request_id, worker_id, slot, output_specs, None))
+        except Exception as e:
+            responses.send((request_id, worker_id, slot, None, repr(e)))
+
+    for buffer in input_buffers + output_buffers:
+        buffer.close()
+
+
+class WorkerPool:
+    """Runs inference across worker processes, one per device, or several per device for
+    multiple contexts per device.
+
+    Each worker owns `slots_per_worker` pairs of input/output shared memory buffers.
+    Tensors are copied into a free slot and only their (dtype, shape, offset) specs are sent
+    through the worker's queue, so large tensors are never pickled. Responses come back on a pipe
+    per worker rather than one shared queue, whose lock a worker killed mid-write would never release.
+
+    Parameters
+    ----------
+    backend_factory: Callable[[int], Callable[[List[numpy.ndarray]], List[numpy.ndarray]]]
+        Picklable callable, called in each worker with its device id, returning the inference function.
+    devices: List[int]
+        Device ids to start workers on.
+    workers_per_device: int
+        Number of worker processes (contexts) per device.
+    slots_per_worker: int
+        Number of requests that can be in flight per worker.
+    slot_bytes: int
+        Size of each input and output shared memory buffer.
+    pin_devices: bool
+        Set CUDA_VISIBLE_DEVICES in each worker to its device id.
+    max_restarts: int
+        Times a worker that exits is restarted. Its requests in flight fail with WorkerDiedError
+        either way. Past this, it's no longer used, and the pool is broken once every worker is.
+    """
+
+    def __init__(self, backend_factory, devices: List[int] = (0,), workers_per_device: int = 1,
+                 slots_per_worker: int = 2, slot_bytes: int = 64 * 2**20, pin_devices: bool = True,
+                 max_restarts: int = 3):
+        self.context = multiprocessing.get_context("spawn")
+        self.backend_factory = backend_factory
+        self.pin_devices = pin_devices
+        self.max_restarts = max_restarts
+        self.router = None
+        # request id -> (future, worker id, slot), guarded by `lock` along with worker restarts
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.broken = None
+        self.closing = False
+        self.stopped = False
+        self.request_ids = itertools.count()
+        self.workers = []
+        self.buffers = []
+
+        device_ids = [device for device in devices for _ in range(workers_per_device)]
+        for worker_id, device_id in enumerate(device_ids):
+            inputs = [create_shared_buffer(slot_bytes) for _ in range(slots_per_worker)]
+            outputs = [create_shared_buffer(slot_bytes) for _ in range(slots_per_worker)]
+            self.buffers.extend(inputs + outputs)
+            free_slots = queue.Queue()
+            for slot in range(slots_per_worker):
+                free_slots.put(slot)
+
+            self.workers.append({"inputs": inputs, "outputs": outputs, "free_slots": free_slots, "device": device_id,
+                                 "restarts": 0, "dead": False})
+            self._start_worker(worker_id)
+
+        self._wait_ready()
+        self.router = LeastOutstandingRouter(len(self.workers))
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def _start_worker(self, worker_id: int):
+        worker = self.workers[worker_id]
+        # Fresh queue and pipe, so requests sent to a dead process are not replayed
+        worker["requests"] = self.context.Queue()
+        worker["responses"], writer = self.context.Pipe(duplex=False)
+        worker["process"] = self.context.Process(
+            target=_worker_main,
+            args=(worker_id, worker["device"], self.backend_factory, [b.name for b in worker["inputs"]],
+                  [b.name for b in worker["outputs"]], worker["requests"], writer, self.pin_devices),
+            daemon=True,
+        )
+        worker["process"].start()
+        # Only the worker holds the write end, so its exit shows up as EOF
+        writer.close()
+
+    def _drain(self, worker_id: int):
+        """Handles the responses a worker sent, stopping at EOF or a message cut short by its exit."""
+        responses = self.workers[worker_id]["responses"]
+        try:
+            while responses.poll():
+                self._respond(worker_id, responses.recv())
+        except (EOFError, OSError):
+            pass
+
+    def _check_workers(self):
+        """Fails the requests in flight on workers that exited, and restarts them."""
+        for worker_id, worker in enumerate(self.workers):
+            if self.closing or worker["dead"] or worker["process"].is_alive():
+                continue
+            # Requests it finished before exiting still succeed
+            self._drain(worker_id)
+            worker["responses"].close()
+            with self.lock:
+                error = WorkerDiedError("Worker {} (device {}) exited with code {}".format(
+                    worker_id, worker["device"], worker["process"].exitcode))
+                if worker["restarts"] < self.max_restarts:
+                    worker["restarts"] += 1
+                    print("WARNING: {}, restarting it ({}/{})".format(error, worker["restarts"], self.max_restarts))
+                    self._start_worker(worker_id)
+                else:
+                    print("WARNING: {}, giving up on it after {} restarts".format(error, self.max_restarts))
+                    worker["dead"] = True
+                    self.router.disable(worker_id)
+                    if all(w["dead"] for w in self.workers):
+                        self.broken = "Every worker died, last error: {}".format(error)
+
+                # After the pool's state is updated, callers woken up by these see it
+                for request_id, (future, request_worker, slot) in list(self.futures.items()):
+                    if request_worker == worker_id:
+                        del self.futures[request_id]
+                        future.set_exception(error)
+                        worker["free_slots"].put(slot)
+                        self.router.release(worker_id)
+
+    def _wait_ready(self):
+        pending = {self.workers[worker_id]["responses"]: worker_id for worker_id in range(len(self.workers))}
+        while pending:
+            for responses in wait(list(pending)):
+                worker_id = pending.pop(responses)
+                try:
+                    status, _, _, _, error = responses.recv()
+                except EOFError:
+                    # A worker that crashed (ex: failed import) never reports back
+                    self.close()
+                    raise RuntimeError("Worker {} exited before starting".format(worker_id))
+                if status == "failed":
+                    self.close()
+                    raise RuntimeError("Worker {} failed to start: {}".format(worker_id, error))
+
+    def _collect(self):
+        while not self.stopped:
+            # A worker's exit wakes this up through its process sentinel, not only its responses
+            waiting = {}
+            for worker_id, worker in enumerate(self.workers):
+                if not worker["dead"]:
+                    waiting[worker["responses"]] = worker_id
+                    waiting[worker["process"].sentinel] = worker_id
+            for ready in wait(list(waiting), timeout=0.5):
+                worker_id = waiting[ready]
+                if ready is self.workers[worker_id]["responses"]:
+                    self._drain(worker_id)
+            self._check_workers()
+        for worker_id, worker in enumerate(self.workers):
+            if not worker["dead"]:
+                self._drain(worker_id)
+
+    def _respond(self, worker_id: int, message):
+        request_id, _, slot, output_specs, error = message
+        if request_id in ("ready", "failed"):
+            # From a restarted worker, one that failed to start is caught by _check_workers()
+            return
+        worker = self.workers[worker_id]
+        with self.lock:
+            entry = self.futures.pop(request_id, None)
+        if entry is None:
+            # Already failed by _check_workers()
+            return
+        future = entry[0]
+        if error is None:
+            future.set_result(read_tensors(worker["outputs"][slot].buf, output_specs, copy=True))
+        else:
+            future.set_exception(RuntimeError("Worker {}: {}".format(worker_id, error)))
+        worker["free_slots"].put(slot)
+        self.router.release(worker_id)
+
+    def submit(self, host_inputs: List[np.ndarray]) -> Future:
+        """Queues a request on the least busy worker and returns a Future of its outputs."""
+        while True:
+            if self.broken:
+                raise WorkerDiedError(self.broken)
+            worker_id = self.router.acquire()
+            worker = self.workers[worker_id]
+            # Blocks if every slot of this worker is in flight
+            slot = worker["free_slots"].get()
+            if not worker["dead"]:
+                break
+            worker["free_slots"].put(slot)
+            self.router.release(worker_id)
+
+        request_id = next(self.request_ids)
+        future = Future()
+        try:
+            input_specs = write_tensors(worker["inputs"][slot].buf, host_inputs)
+        except Exception:
+            worker["free_slots"].put(slot)
+            self.router.release(worker_id)
+            raise
+        with self.lock:
+            if worker["dead"]:
+                worker["free_slots"].put(slot)
+                self.router.release(worker_id)
+                future.set_exception(WorkerDiedError("Worker {} died".format(worker_id)))
+                return future
+            self.futures[request_id] = (future, worker_id, slot)
+            worker["requests"].put((request_id, slot, input_specs))
+        return future
+
+    def infer(self, host_inputs: List[np.ndarray]) -> List[np.ndarray]:
+        return self.submit(host_inputs).result()
+
+    def close(self):
+        self.closing = True
+        for worker in self.workers:
+            worker["requests"].put(None)
+        for worker in self.workers:
+            worker["process"].join(timeout=10)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        if self.router is not None:
+            self.stopped = True
+            self.collector.join()
+        for worker in self.workers:
+            worker["responses"].close()
+        for buffer in self.buffers:
+            buffer.close()
+            buffer.unlink()
+        self.workers, self.buffers = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs random inputs through a pool of inference workers and reports throughput.")
+    parser.add_argument("-e", "--engine", type=str, help="Path to TensorRT engine file. Uses a CPU echo backend if not set.")
+    parser.add_argument("--cuda-graphs", action="store_true", help="Replay a captured CUDA graph per input shape, see cuda_graphs.py.")
+    parser.add_argument("-d", "--devices", type=int, nargs="+", default=[0], help="Device ids to start workers on.")
+    parser.add_argument("-w", "--workers-per-device", type=int, default=1, help="Worker processes (contexts) per device.")
+    parser.add_argument("--slots", type=int, default=2, help="Requests in flight per worker.")
+    parser.add_argument("--shape", type=int, nargs="+", default=[8, 3, 224, 224], help="Input shape to send.")
+    parser.add_argument("-n", "--num-requests", type=int, default=1000, help="Number of requests to send.")
+    args = parser.parse_args()
+
+    backend = TensorRTBackend(args.engine, cuda_graphs=args.cuda_graphs) if args.engine else EchoBackend()
+    host_input = np.random.random(args.shape).astype(np.float32)
+    slot_bytes = max(64 * 2**20, 2 * host_input.nbytes)
+    with WorkerPool(backend, args.devices, args.workers_per_device, args.slots, slot_bytes,
+                    pin_devices=args.engine is not None) as pool:
+        start = time.perf_counter()
+        futures = [pool.submit([host_input]) for _ in range(args.num_requests)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+
+    print("{} requests on {} workers in {:.2f}s ({:.1f} requests/s)".format(
+        args.num_requests, len(args.devices) * args.workers_per_device, elapsed, args.num_requests / elapsed))
+
+
+if __name__ == "__main__":
+    main()
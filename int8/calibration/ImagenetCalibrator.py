@@ -18,18 +18,18 @@ import glob
 import random
 import logging
 
-import numpy as np
-from PIL import Image
 import tensorrt as trt
-import pycuda.driver as cuda
-import pycuda.autoinit
+
+from calibrators import CalibratorBase, ImageDataSource, create_calibrator # local module
 
 logging.basicConfig(level=logging.DEBUG,
                     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
                     datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger(__name__)
 
-def get_int8_calibrator(calib_cache, calib_data, max_calib_size, preprocess_func_name, calib_batch_size):
+def get_int8_calibrator(calib_cache, calib_data, max_calib_size, preprocess_func_name, calib_batch_size,
+                        selection="random", selection_cache_dir=None, algorithm="entropy2", inputs=None,
+                        decode_options=None, quantile=0.9999, regression_cutoff=1.0):
     # Use calibration cache if it exists
     if os.path.exists(calib_cache):
         logger.info("Skipping calibration files, using calibration cache: {:}".format(calib_cache))
@@ -39,23 +39,28 @@ def get_int8_calibrator(calib_cache, calib_data, max_calib_size, preprocess_func
         if not calib_data:
             raise ValueError("ERROR: Int8 mode requested, but no calibration data provided. Please provide --calibration-data /path/to/calibration/files")
 
-        calib_files = get_calibration_files(calib_data, max_calib_size)
+        calib_files = get_calibration_files(calib_data, max_calib_size, selection=selection,
+                                            selection_cache_dir=selection_cache_dir)
 
     # Choose pre-processing function for INT8 calibration
     import processing
-    if preprocess_func_name is not None:
-        preprocess_func = getattr(processing, preprocess_func_name)
-    else:
-        preprocess_func = processing.preprocess_imagenet
+    preprocess_func = processing.get_preprocess_func(preprocess_func_name or "preprocess_imagenet", **(decode_options or {}))
 
-    int8_calibrator = ImagenetCalibrator(calibration_files=calib_files,
-                                         batch_size=calib_batch_size,
-                                         cache_file=calib_cache,
-                                         preprocess_func=preprocess_func)
-    return int8_calibrator
+    if algorithm == "entropy2":
+        return ImagenetCalibrator(calibration_files=calib_files,
+                                  batch_size=calib_batch_size,
+                                  cache_file=calib_cache,
+                                  preprocess_func=preprocess_func,
+                                  inputs=inputs,
+                                  decode_options=decode_options)
 
+    # See calibrators.CALIBRATION_ALGORITHMS
+    data_source = ImageDataSource(calib_files, calib_batch_size, (3, 224, 224), preprocess_func, inputs, decode_options)
+    return create_calibrator(algorithm, data_source, calib_cache, quantile=quantile, regression_cutoff=regression_cutoff)
 
-def get_calibration_files(calibration_data, max_calibration_size=None, allowed_extensions=(".jpeg", ".jpg", ".png")):
+
+def get_calibration_files(calibration_data, max_calibration_size=None, allowed_extensions=(".jpeg", ".jpg", ".png"),
+                          selection="random", selection_cache_dir=None):
     """Returns a list of all filenames ending with `allowed_extensions` found in the `calibration_data` directory.
 
     Parameters
@@ -64,7 +69,13 @@ def get_calibration_files(calibration_data, max_calibration_size=None, allowed_e
         Path to directory containing desired files.
     max_calibration_size: int
         Max number of files to use for calibration. If calibration_data contains more than this number,
-        a random sample of size max_calibration_size will be returned instead. If None, all samples will be used.
+        a sample of size max_calibration_size will be returned instead. If None, all samples will be used.
+    selection: str
+        How to sample max_calibration_size files: "random", or "kcenter"/"stratified" to pick a
+        representative subset based on image statistics. See calibration_selection.py.
+    selection_cache_dir: str
+        Directory to cache image statistics and selections in. Defaults to
+        calibration_selection.DEFAULT_CACHE_DIR.
 
     Returns
     -------
@@ -83,14 +94,19 @@ def get_calibration_files(calibration_data, max_calibration_size=None, allowed_e
     if max_calibration_size:
         if len(calibration_files) > max_calibration_size:
             logger.warning("Capping number of calibration images to max_calibration_size: {:}".format(max_calibration_size))
-            random.seed(42)  # Set seed for reproducibility
-            calibration_files = random.sample(calibration_files, max_calibration_size)
+            if selection == "random":
+                random.seed(42)  # Set seed for reproducibility
+                calibration_files = random.sample(calibration_files, max_calibration_size)
+            else:
+                from calibration_selection import select_calibration_files, DEFAULT_CACHE_DIR # local module
+                calibration_files = select_calibration_files(calibration_files, max_calibration_size, method=selection,
+                                                             cache_dir=selection_cache_dir or DEFAULT_CACHE_DIR)
 
     return calibration_files
 
 
 # https://docs.nvidia.com/deeplearning/sdk/tensorrt-api/python_api/infer/Int8/EntropyCalibrator2.html
-class ImagenetCalibrator(trt.IInt8EntropyCalibrator2):
+class ImagenetCalibrator(CalibratorBase, trt.IInt8EntropyCalibrator2):
     """INT8 Calibrator Class for Imagenet-based Image Classification Models.
 
     Parameters
@@ -107,63 +123,18 @@ class ImagenetCalibrator(trt.IInt8EntropyCalibrator2):
         Pre-processing function to run on calibration data. This should match the pre-processing
         done at inference time. In general, this function should return a numpy array of
         shape `input_shape`.
+    inputs: List[batch_assembler.InputSpec]
+        Names, shapes, layouts and pre-processing functions of each input, for multiple input
+        or NHWC models. Overrides `input_shape` and `preprocess_func`.
+    decode_options: dict
+        Options for the pre-processing functions of `inputs`, see processing.get_preprocess_func().
     """
 
     def __init__(self, calibration_files=[], batch_size=32, input_shape=(3, 224, 224),
-                 cache_file="calibration.cache", preprocess_func=None):
-        super().__init__()
-        self.input_shape = input_shape
-        self.cache_file = cache_file
-        self.batch_size = batch_size
-        self.batch = np.zeros((self.batch_size, *self.input_shape), dtype=np.float32)
-        self.device_input = cuda.mem_alloc(self.batch.nbytes)
-
-        self.files = calibration_files
-        # Pad the list so it is a multiple of batch_size
-        if len(self.files) % self.batch_size != 0:
-            logger.info("Padding # calibration files to be a multiple of batch_size {:}".format(self.batch_size))
-            self.files += calibration_files[(len(calibration_files) % self.batch_size):self.batch_size]
-
-        self.batches = self.load_batches()
-
-        if preprocess_func is None:
+                 cache_file="calibration.cache", preprocess_func=None, inputs=None, decode_options=None):
+        if preprocess_func is None and inputs is None:
             logger.error("No preprocess_func defined! Please provide one to the constructor.")
             sys.exit(1)
-        else:
-            self.preprocess_func = preprocess_func
-
-    def load_batches(self):
-        # Populates a persistent self.batch buffer with images.
-        for index in range(0, len(self.files), self.batch_size):
-            for offset in range(self.batch_size):
-                image = Image.open(self.files[index + offset])
-                self.batch[offset] = self.preprocess_func(image, *self.input_shape)
-            logger.info("Calibration images pre-processed: {:}/{:}".format(index+self.batch_size, len(self.files)))
-            yield self.batch
-
-    def get_batch_size(self):
-        return self.batch_size
-
-    def get_batch(self, names):
-        try:
-            # Assume self.batches is a generator that provides batch data.
-            batch = next(self.batches)
-            # Assume that self.device_input is a device buffer allocated by the constructor.
-            cuda.memcpy_htod(self.device_input, batch)
-            return [int(self.device_input)]
-        except StopIteration:
-            # When we're out of batches, we return either [] or None.
-            # This signals to TensorRT that there is no calibration data remaining.
-            return None
-
-    def read_calibration_cache(self):
-        # If there is a cache, use it instead of calibrating again. Otherwise, implicitly return None.
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, "rb") as f:
-                logger.info("Using calibration cache to save time: {:}".format(self.cache_file))
-                return f.read()
-
-    def write_calibration_cache(self, cache):
-        with open(self.cache_file, "wb") as f:
-            logger.info("Caching calibration data for future use: {:}".format(self.cache_file))
-            f.write(cache)
+
+        data_source = ImageDataSource(calibration_files, batch_size, input_shape, preprocess_func, inputs, decode_options)
+        super().__init__(data_source, cache_file)
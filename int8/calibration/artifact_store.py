@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# Content-defined chunking: a cut is made after byte i when the high bits of the gear hash of
+# the WINDOW bytes ending at i are zero, so identical regions of two engines (ex: the same
+# weights in FP16 engines with different profiles) produce identical chunks even when they are
+# preceded by data of different lengths.
+WINDOW = 32
+GEAR = np.random.RandomState(0x6765).randint(0, 2**32, size=256, dtype=np.uint64).astype(np.uint32)
+DEFAULT_CHUNKING = {"min_size": 64 * 1024, "avg_size": 256 * 1024, "max_size": 1024 * 1024}
+
+# First byte of every chunk file
+CODEC_IDS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+# Chunks compressing by less than this are stored raw: FP16/INT8 weights barely compress, and
+# decompressing them would slow every load down for a few % of storage
+MIN_SAVINGS = 0.1
+
+
+def gear_hashes(data: np.ndarray) -> np.ndarray:
+    """Gear hash of the WINDOW bytes ending at each position of a uint8 array.
+
+    hash[i] = sum(GEAR[data[i - j]] << j for j < WINDOW), computed in log2(WINDOW) vectorized
+    passes by doubling the window: h_2k[i] = h_k[i] + (h_k[i - k] << k).
+    """
+    hashes = GEAR[data]
+    width = 1
+    while width < WINDOW:
+        shifted = np.zeros_like(hashes)
+        shifted[width:] = hashes[:-width] << np.uint32(width)
+        hashes += shifted
+        width *= 2
+    return hashes
+
+
+def chunk_boundaries(data, min_size: int = DEFAULT_CHUNKING["min_size"], avg_size: int = DEFAULT_CHUNKING["avg_size"],
+                     max_size: int = DEFAULT_CHUNKING["max_size"], block_size: int = 2**16):
+    """Returns the end offset of each content-defined chunk of `data` (bytes-like).
+
+    Hashes are computed in blocks of `block_size` bytes (overlapping by WINDOW - 1) small enough
+    to stay in cache, about 2x faster than hashing 16MB blocks. Only the resulting candidate cuts
+    are walked in Python to apply min/max sizes.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    size = len(buffer)
+    bits = max(int(np.log2(max(avg_size - min_size, 1))), 1)
+    mask = np.uint32(((1 << bits) - 1) << (32 - bits))
+
+    candidates = []
+    for start in range(0, size, block_size):
+        low = max(start - WINDOW + 1, 0)
+        hashes = gear_hashes(buffer[low:start + block_size])[start - low:]
+        candidates.append(np.flatnonzero((hashes & mask) == 0) + start + 1)
+    candidates = np.concatenate(candidates) if candidates else np.empty(0, dtype=np.int64)
+
+    cuts, last = [], 0
+    while last < size:
+        # First candidate far enough from the last cut, if any before max_size. The tail is cut
+        # the same way, so regions shared near the end of two artifacts are deduplicated too
+        index = np.searchsorted(candidates, last + min_size)
+        if index < len(candidates) and candidates[index] <= last + max_size:
+            last = int(candidates[index])
+        else:
+            last = min(last + max_size, size)
+        cuts.append(last)
+    return cuts
+
+
+def available_codecs():
+    codecs = ["none", "zlib"]
+    for name, module in (("zstd", "zstandard"), ("lz4", "lz4.frame")):
+        try:
+            __import__(module)
+            codecs.append(name)
+        except ImportError:
+            pass
+    return codecs
+
+
+def default_codec():
+    """Best available: zstd, then lz4, then zlib."""
+    codecs = available_codecs()
+    return next(codec for codec in ("zstd", "lz4", "zlib") if codec in codecs)
+
+
+def compress(codec: str, data) -> bytes:
+    if codec == "none":
+        return bytes(data)
+    if codec == "zlib":
+        import zlib
+        return zlib.compress(data, 1)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.compress(data)
+    raise ValueError("ERROR: Unknown codec [{:}], expected one of {:}".format(codec, list(CODEC_IDS)))
+
+
+def decompress_into(codec: str, data: memoryview, out: memoryview):
+    """Decompresses a chunk into its slice of the output buffer."""
+    if codec == "none":
+        out[:] = data
+        return
+    if codec == "zlib":
+        import zlib
+        out[:] = zlib.decompress(data)
+    elif codec == "zstd":
+        import zstandard
+        out[:] = zstandard.ZstdDecompressor().decompress(data, max_output_size=len(out))
+    elif codec == "lz4":
+        import lz4.frame
+        out[:] = lz4.frame.decompress(data)
+    else:
+        raise ValueError("ERROR: Unknown codec [{:}]".format(codec))
+
+
+class ArtifactStore:
+    """Engines stored as content-addressed, optionally compressed chunks shared across engines.
+
+    Layout:
+        <root>/chunks/<sha256[:2]>/<sha256>   codec id byte + (compressed) chunk, named after the raw chunk's sha256
+        <root>/manifests/<name>.json          size, sha256 and chunk list of an engine, plus metadata
+
+    Writers and loaders take a shared lock and the garbage collector an exclusive one, so a
+    collection never removes chunks of an engine being written or loaded. Manifests are only
+    written once all of their chunks exist, so a reader never sees a partial engine.
+    """
+
+    def __init__(self, root: str, chunking: dict = None):
+        self.root = root
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.manifests_dir = os.path.join(root, "manifests")
+        self.chunking = dict(DEFAULT_CHUNKING, **(chunking or {}))
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def lock(self, exclusive=False):
+        with open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def manifest_path(self, name: str) -> str:
+        if not NAME_PATTERN.match(name):
+            raise ValueError("ERROR: Invalid artifact name [{:}], use letters, digits, '.', '_' and '-'".format(name))
+        return os.path.join(self.manifests_dir, name + ".json")
+
+    def _write_atomic(self, path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, name: str, data, codec: str = None, metadata: dict = None) -> dict:
+        """Stores `data` (bytes-like, ex: memoryview(engine.serialize())) as `name`, replacing any
+        previous artifact of that name. Returns its manifest, with the number of new chunks and
+        bytes written under "written"."""
+        codec = codec or default_codec()
+        data = memoryview(data).cast("B")
+        manifest_path = self.manifest_path(name)
+        chunks, new_chunks, new_bytes = [], 0, 0
+        with self.lock():
+            start = 0
+            for end in chunk_boundaries(data, **self.chunking):
+                chunk = data[start:end]
+                digest = hashlib.sha256(chunk).hexdigest()
+                chunks.append([digest, end - start])
+                path = self.chunk_path(digest)
+                if not os.path.exists(path):
+                    compressed = compress(codec, chunk)
+                    if len(compressed) > (1 - MIN_SAVINGS) * len(chunk):
+                        codec_id, compressed = CODEC_IDS["none"], bytes(chunk)
+                    else:
+                        codec_id = CODEC_IDS[codec]
+                    self._write_atomic(path, bytes([codec_id]) + compressed)
+                    new_chunks += 1
+                    new_bytes += len(compressed) + 1
+                start = end
+
+            manifest = {
+                "manifest_version": MANIFEST_VERSION,
+                "name": name,
+                "size": len(data),
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "codec": codec,
+                "chunking": self.chunking,
+                "chunks": chunks,
+                "created": time.time(),
+                "metadata": metadata or {},
+            }
+            self._write_atomic(manifest_path, json.dumps(manifest, indent=4, sort_keys=True).encode())
+        logger.debug("Stored [{:}]: {:} chunks, {:} new ({:} bytes written)".format(name, len(chunks), new_chunks, new_bytes))
+        return dict(manifest, written={"chunks": new_chunks, "bytes": new_bytes})
+
+    def put_file(self, name: str, path: str, codec: str = None, metadata: dict = None) -> dict:
+        with open(path, "rb") as f:
+            return self.put(name, f.read(), codec, metadata)
+
+    def manifest(self, name: str) -> dict:
+        with open(self.manifest_path(name), "r") as f:
+            manifest = json.load(f)
+        if manifest.get("manifest_version") != MANIFEST_VERSION:
+            raise ValueError("ERROR: Unsupported manifest version: {:}".format(manifest.get("manifest_version")))
+        return manifest
+
+    def names(self):
+        return sorted(filename[:-len(".json")] for filename in os.listdir(self.manifests_dir) if filename.endswith(".json"))
+
+    def get(self, name: str, verify: bool = True, num_threads: int = 4) -> bytearray:
+        """Returns the artifact as a bytearray, decompressing each chunk straight into its slice,
+        ready to pass to trt.Runtime.deserialize_cuda_engine() without a temporary file.
+
+        Parameters
+        ----------
+        verify: bool
+            Check the sha256 of every chunk (and so of the whole artifact).
+        num_threads: int
+            Chunks decompressed in parallel, the codecs release the GIL.
+        """
+        with self.lock():
+            manifest = self.manifest(name)
+            out = bytearray(manifest["size"])
+            view = memoryview(out)
+            offsets = np.cumsum([0] + [size for _, size in manifest["chunks"]]).tolist()
+
+            def load_chunk(index):
+                digest, size = manifest["chunks"][index]
+                with open(self.chunk_path(digest), "rb") as f:
+                    stored = f.read()
+                target = view[offsets[index]:offsets[index] + size]
+                decompress_into(CODEC_NAMES[stored[0]], memoryview(stored)[1:], target)
+                if verify and hashlib.sha256(target).hexdigest() != digest:
+                    raise IOError("ERROR: Chunk {:} of [{:}] is corrupted".format(digest, name))
+
+            if num_threads > 1 and len(manifest["chunks"]) > 1:
+                with ThreadPoolExecutor(num_threads) as executor:
+                    list(executor.map(load_chunk, range(len(manifest["chunks"]))))
+            else:
+                for index in range(len(manifest["chunks"])):
+                    load_chunk(index)
+            # Last access drives the retention policy, see gc()
+            os.utime(self.manifest_path(name))
+        return out
+
+    def remove(self, name: str):
+        """Removes a manifest. Its chunks are freed by the next gc() if no other artifact uses them."""
+        with self.lock():
+            os.remove(self.manifest_path(name))
+
+    def stats(self) -> dict:
+        """Logical size of all artifacts vs. bytes actually stored."""
+        manifests = [self.manifest(name) for name in self.names()]
+        unique = {}
+        for manifest in manifests:
+            unique.update((digest, size) for digest, size in manifest["chunks"])
+        stored_bytes, stored_chunks = 0, 0
+        for directory, _, filenames in os.walk(self.chunks_dir):
+            for filename in filenames:
+                if not filename.startswith(".tmp."):
+                    stored_bytes += os.path.getsize(os.path.join(directory, filename))
+                    stored_chunks += 1
+        logical_bytes = sum(manifest["size"] for manifest in manifests)
+        unique_bytes = sum(unique.values())
+        return {
+            "artifacts": len(manifests),
+            "logical_bytes": logical_bytes,
+            "unique_chunks": len(unique),
+            "unique_bytes": unique_bytes,
+            "stored_chunks": stored_chunks,
+            "stored_bytes": stored_bytes,
+            "dedup_ratio": logical_bytes / max(unique_bytes, 1),
+            "compression_ratio": unique_bytes / max(stored_bytes, 1),
+            "saved_bytes": logical_bytes - stored_bytes,
+        }
+
+    def gc(self, keep_last: int = None, max_age_days: float = None, pinned=(), dry_run: bool = False) -> dict:
+        """Removes artifacts outside the retention policy, then every chunk no remaining artifact uses.
+
+        Parameters
+        ----------
+        keep_last: int
+            Keep the `keep_last` most recently created artifacts of each group. The group is
+            metadata["group"] (ex: the ONNX model an engine was built from), or the name.
+        max_age_days: float
+            Remove artifacts not loaded (or created) for this many days.
+        pinned: List[str]
+            Names that are always kept.
+        """
+        with self.lock(exclusive=True):
+            now = time.time()
+            manifests = {name: self.manifest(name) for name in self.names()}
+            last_access = {name: os.path.getmtime(self.manifest_path(name)) for name in manifests}
+
+            expired = set()
+            if max_age_days is not None:
+                expired.update(name for name in manifests if now - last_access[name] > max_age_days * 86400)
+            if keep_last is not None:
+                groups = {}
+                for name, manifest in manifests.items():
+                    groups.setdefault(manifest["metadata"].get("group", name), []).append(name)
+                for names in groups.values():
+                    names.sort(key=lambda name: manifests[name]["created"], reverse=True)
+                    expired.update(names[keep_last:])
+            expired -= set(pinned)
+
+            referenced = set()
+            for name, manifest in manifests.items():
+                if name not in expired:
+                    referenced.update(digest for digest, _ in manifest["chunks"])
+
+            removed_chunks, freed_bytes = 0, 0
+            for name in sorted(expired):
+                logger.info("{:}Removing artifact [{:}]".format("(dry run) " if dry_run else "", name))
+                if not dry_run:
+                    os.remove(self.manifest_path(name))
+            for directory, _, filenames in os.walk(self.chunks_dir):
+                for filename in filenames:
+                    # Leftovers of interrupted writes are garbage too
+                    if filename not in referenced:
+                        path = os.path.join(directory, filename)
+                        removed_chunks += 1
+                        freed_bytes += os.path.getsize(path)
+                        if not dry_run:
+                            os.remove(path)
+
+        logger.info("{:}Removed {:} artifacts and {:} chunks, freed {:.1f} MB".format(
+            "(dry run) " if dry_run else "", len(expired), removed_chunks, freed_bytes / 2**20))
+        return {"removed_artifacts": sorted(expired), "removed_chunks": removed_chunks, "freed_bytes": freed_bytes}
+
+
+def load_engine(store: ArtifactStore, name: str, runtime, verify: bool = True):
+    """Deserializes an engine from the store, ex: load_engine(store, "resnet50_fp16", trt.Runtime(TRT_LOGGER))"""
+    return runtime.deserialize_cuda_engine(store.get(name, verify=verify))
+
+
+def synthetic_engines(num_variants: int = 4, weights_size: int = 64 * 2**20, seed: int = 0):
+    """Engine-like blobs for benchmarking without TensorRT: shared FP16 weights (as in engines built
+    from the same model with different profiles) surrounded by per-variant headers and kernels."""
+    rng = np.random.RandomState(seed)
+    weights = rng.normal(0, 0.05, size=weights_size // 2).astype(np.float16).tobytes()
+    engines = {}
+    for i in range(num_variants):
+        header = rng.randint(0, 256, size=rng.randint(4096, 65536), dtype=np.uint8).tobytes()
+        kernels = rng.randint(0, 256, size=rng.randint(2, 8) * 2**20, dtype=np.uint8).tobytes()
+        engines["synthetic_{:d}".format(i)] = header + weights + kernels
+    return engines
+
+
+def benchmark(store: ArtifactStore, engine_files, repeats: int = 5, codec: str = None, num_threads: int = 4,
+              deserialize: bool = False):
+    """Stores every engine and compares the storage used and load time against the raw files."""
+    runtime = None
+    if deserialize:
+        import tensorrt as trt
+        runtime = trt.Runtime(trt.Logger(trt.Logger.WARNING))
+
+    raw_bytes = 0
+    for name, path in engine_files.items():
+        store.put_file(name, path, codec)
+        raw_bytes += os.path.getsize(path)
+
+    print("{:<32} {:>10} {:>12} {:>12} {:>12} {:>10}".format(
+        "engine", "MB", "raw ms", "store ms", "no-verify ms", "overhead"))
+    for name, path in engine_files.items():
+        def read_raw():
+            with open(path, "rb") as f:
+                data = f.read()
+            return runtime.deserialize_cuda_engine(data) if runtime else data
+
+        def read_store(verify):
+            data = store.get(name, verify=verify, num_threads=num_threads)
+            return runtime.deserialize_cuda_engine(data) if runtime else data
+
+        with open(path, "rb") as f:
+            assert store.get(name) == f.read()
+        timings = []
+        for func in (read_raw, lambda: read_store(True), lambda: read_store(False)):
+            func()
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                func()
+                samples.append(time.perf_counter() - start)
+            timings.append(1000 * np.median(samples))
+        print("{:<32} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f} {:>9.2f}x".format(
+            name[:32], os.path.getsize(path) / 2**20, timings[0], timings[1], timings[2], timings[1] / timings[0]))
+
+    stats = store.stats()
+    print("Raw files: {:.1f} MB, store: {:.1f} MB ({:.1f}% saved, dedup {:.2f}x, compression {:.2f}x)".format(
+        raw_bytes / 2**20, stats["stored_bytes"] / 2**20, 100 * (1 - stats["stored_bytes"] / max(raw_bytes, 1)),
+        stats["dedup_ratio"], stats["compression_ratio"]))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed, deduplicated and compressed engine store.")
+    parser.add_argument("-s", "--store", required=True, type=str, help="Root directory of the store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    put = subparsers.add_parser("put", help="Store engine files.")
+    put.add_argument("engines", nargs="+", help="Engine files, stored under their file name unless --name is given.")
+    put.add_argument("--name", type=str, default=None, help="Artifact name (single engine only).")
+    put.add_argument("--group", type=str, default=None, help="Retention group, see 'gc --keep-last'.")
+    put.add_argument("--codec", type=str, default=None, choices=sorted(CODEC_IDS), help="Chunk compression. Defaults to the best available.")
+
+    get = subparsers.add_parser("get", help="Write a stored engine to a file.")
+    get.add_argument("name", type=str)
+    get.add_argument("-o", "--output", required=True, type=str)
+
+    subparsers.add_parser("list", help="List stored engines.")
+    subparsers.add_parser("stats", help="Show storage saved by deduplication and compression.")
+
+    rm = subparsers.add_parser("rm", help="Remove stored engines, their chunks are freed by 'gc'.")
+    rm.add_argument("names", nargs="+")
+
+    gc = subparsers.add_parser("gc", help="Apply a retention policy and remove unused chunks.")
+    gc.add_argument("--keep-last", type=int, default=None, help="Keep this many of the most recent engines of each group.")
+    gc.add_argument("--max-age-days", type=float, default=None, help="Remove engines not loaded for this many days.")
+    gc.add_argument("--pin", nargs="+", default=[], help="Engines to always keep.")
+    gc.add_argument("--dry-run", action="store_true")
+
+    bench = subparsers.add_parser("bench", help="Compare storage and load time against raw engine files.")
+    bench.add_argument("engines", nargs="*", help="Engine files. Synthetic engines are used if none are given.")
+    bench.add_argument("--codec", type=str, default=None, choices=sorted(CODEC_IDS))
+    bench.add_argument("-r", "--repeats", type=int, default=5)
+    bench.add_argument("-j", "--num-threads", type=int, default=4, help="Chunk decompression threads.")
+    bench.add_argument("--deserialize", action="store_true", help="Include deserialization (requires TensorRT).")
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.store)
+    if args.command == "put":
+        if args.name and len(args.engines) > 1:
+            raise ValueError("ERROR: --name can only be used with a single engine")
+        for path in args.engines:
+            name = args.name or os.path.basename(path)
+            metadata = {"group": args.group} if args.group else {}
+            manifest = store.put_file(name, path, args.codec, metadata)
+            logger.info("Stored [{:}]: {:.1f} MB in {:} chunks, {:.1f} MB written".format(
+                name, manifest["size"] / 2**20, len(manifest["chunks"]), manifest["written"]["bytes"] / 2**20))
+    elif args.command == "get":
+        with open(args.output, "wb") as f:
+            f.write(store.get(args.name))
+    elif args.command == "list":
+        for name in store.names():
+            manifest = store.manifest(name)
+            print("{:<40} {:>10.1f} MB {:>6} chunks  {:}".format(
+                name, manifest["size"] / 2**20, len(manifest["chunks"]), time.ctime(manifest["created"])))
+    elif args.command == "stats":
+        print(json.dumps(store.stats(), indent=4))
+    elif args.command == "rm":
+        for name in args.names:
+            store.remove(name)
+    elif args.command == "gc":
+        store.gc(args.keep_last, args.max_age_days, args.pin, args.dry_run)
+    elif args.command == "bench":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine_files = {os.path.basename(path): path for path in args.engines}
+            if not engine_files:
+                logger.info("Generating synthetic engines")
+                for name, data in synthetic_engines().items():
+                    engine_files[name] = os.path.join(tmp_dir, name + ".engine")
+                    with open(engine_files[name], "wb") as f:
+                        f.write(data)
+            benchmark(store, engine_files, args.repeats, args.codec, args.num_threads, args.deserialize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import importlib
+import itertools
+import subprocess
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+# onnx_to_tensorrt.py argument values for each precision choice
+PRECISION_ARGS = {
+    "fp32": {"fp16": False, "int8": False},
+    "fp16": {"fp16": True, "int8": False},
+    "int8": {"fp16": True, "int8": True},
+}
+# infer.py lives with the inference scripts
+INFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "inference")
+
+
+def candidate_space(workspace_sizes, batch_range, opt_batch_sizes, precisions):
+    """Returns every combination of the search dimensions as onnx_to_tensorrt.py argument dicts.
+
+    Each candidate has one optimization profile covering `batch_range` (min, max), tuned for
+    one of `opt_batch_sizes` (kOPT). Opt batch sizes outside the range are skipped.
+    """
+    min_bs, max_bs = batch_range
+    opt_batch_sizes = [bs for bs in opt_batch_sizes if min_bs <= bs <= max_bs]
+    if not opt_batch_sizes:
+        raise ValueError("ERROR: No opt batch size within the batch range {}".format(batch_range))
+
+    candidates = []
+    for workspace_size, opt_bs, precision in itertools.product(workspace_sizes, opt_batch_sizes, precisions):
+        candidate = {"workspace_size": workspace_size, "batch_profiles": ["{}:{}:{}".format(min_bs, opt_bs, max_bs)]}
+        candidate.update(PRECISION_ARGS[precision])
+        candidates.append(candidate)
+    return candidates
+
+
+def covers(candidate, batch_sizes):
+    """Whether every one of `batch_sizes` fits in one of the candidate's profiles."""
+    ranges = [[int(bs) for bs in spec.split(":")] for spec in candidate["batch_profiles"]]
+    return all(any(lo <= bs <= hi for lo, _, hi in ranges) for bs in batch_sizes)
+
+
+def candidate_name(candidate):
+    precision = "int8" if candidate.get("int8") else "fp16" if candidate.get("fp16") else "fp32"
+    profiles = "_".join(spec.replace(":", "-") for spec in candidate["batch_profiles"])
+    return "ws{}_bs{}_{}".format(candidate["workspace_size"], profiles, precision)
+
+
+def successive_halving(candidates, measure, min_budget=10, eta=2, max_budget=None):
+    """Finds the candidate with the lowest cost without measuring every candidate at full budget.
+
+    Every candidate is first measured with `min_budget`. After each round only the best
+    1/`eta` of the candidates are kept, and the budget is multiplied by `eta`, until one
+    candidate remains or `max_budget` is reached.
+
+    Parameters
+    ----------
+    candidates: List[dict]
+        Configurations to search.
+    measure: Callable[[dict, int], float]
+        Returns the cost (ex: latency) of a candidate measured with the given budget
+        (ex: number of benchmark iterations). Failed candidates should return math.inf.
+    min_budget: int
+        Budget of the first round.
+    eta: int
+        Reduction factor between rounds.
+    max_budget: int
+        (Optional) Stop after the round with at least this budget.
+
+    Returns
+    -------
+    best: dict
+        The best candidate of the last round.
+    best_cost: float
+    history: List[dict]
+        Cost of every measurement, by round.
+    """
+    if eta < 2:
+        raise ValueError("ERROR: eta must be at least 2, got {}".format(eta))
+
+    survivors = list(candidates)
+    budget = min_budget
+    history = []
+    for round_index in itertools.count():
+        costs = np.array([measure(candidate, budget) for candidate in survivors], dtype=np.float64)
+        for candidate, cost in zip(survivors, costs):
+            history.append({"round": round_index, "budget": budget, "candidate": candidate, "cost": float(cost)})
+        logger.info("Round {} (budget {}): best cost {:.4g} of {} candidates".format(round_index, budget, costs.min(),
+                                                                                     len(survivors)))
+
+        order = np.argsort(costs, kind="stable")
+        if len(survivors) == 1 or (max_budget is not None and budget >= max_budget) or not np.isfinite(costs[order[0]]):
+            return survivors[order[0]], float(costs[order[0]]), history
+
+        keep = max(1, len(survivors) // eta)
+        survivors = [survivors[i] for i in order[:keep] if np.isfinite(costs[i])]
+        budget *= eta
+
+
+class BuildAndBenchmark:
+    """Default measure function: builds each candidate once with onnx_to_tensorrt.py, then
+    reports the mean over `batch_sizes` of the median latency in ms of `budget` inferences."""
+
+    def __init__(self, onnx, output_dir, batch_sizes, build_args=(), warmup=5):
+        self.onnx = onnx
+        self.output_dir = output_dir
+        self.batch_sizes = list(batch_sizes)
+        self.build_args = list(build_args)
+        self.warmup = warmup
+        self.engines = {}
+
+    def build(self, candidate):
+        name = candidate_name(candidate)
+        if name in self.engines:
+            return self.engines[name]
+
+        engine_path = os.path.join(self.output_dir, "{}.engine".format(name))
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_to_tensorrt.py")
+        command = [sys.executable, script, "--onnx", self.onnx, "-o", engine_path, "--explicit-batch",
+                   "--workspace-size", str(candidate["workspace_size"]),
+                   "--batch-profiles"] + candidate["batch_profiles"]
+        command += ["--{}".format(flag) for flag in ("fp16", "int8") if candidate.get(flag)]
+        logger.info("Building candidate {}".format(name))
+        start = time.time()
+        result = subprocess.run(command + self.build_args)
+        if result.returncode != 0:
+            logger.warning("Candidate {} failed to build".format(name))
+            engine_path = None
+        else:
+            logger.info("Built candidate {} in {:.1f}s".format(name, time.time() - start))
+
+        self.engines[name] = engine_path
+        return engine_path
+
+    def __call__(self, candidate, budget):
+        engine_path = self.build(candidate)
+        if engine_path is None:
+            return math.inf
+
+        if INFERENCE_DIR not in sys.path:
+            sys.path.append(INFERENCE_DIR)
+        import infer  # local module
+
+        engine = infer.load_engine(engine_path)
+        runners = {}
+        latencies = []
+        for batch_size in self.batch_sizes:
+            for profile_index in range(engine.num_optimization_profiles):
+                input_binding_idxs, _ = infer.get_binding_idxs(engine, profile_index)
+                kmin, _, kmax = engine.get_profile_shape(profile_index, input_binding_idxs[0])
+                if kmin[0] <= batch_size <= kmax[0]:
+                    break
+            else:
+                logger.warning("Candidate {} has no profile for batch size {}".format(candidate_name(candidate), batch_size))
+                return math.inf
+
+            if profile_index not in runners:
+                runners[profile_index] = infer.EngineRunner(engine, profile_index)
+            host_inputs = []
+            for binding_index in input_binding_idxs:
+                shape = engine.get_profile_shape(profile_index, binding_index)[2]
+                host_inputs.append(np.random.random((batch_size, *shape[1:])).astype(np.float32))
+
+            timings = []
+            for i in range(self.warmup + budget):
+                start = time.perf_counter()
+                runners[profile_index].infer(host_inputs)
+                timings.append(time.perf_counter() - start)
+            latencies.append(1000 * float(np.median(timings[self.warmup:])))
+
+        del runners, engine
+        return float(np.mean(latencies))
+
+
+def load_measure(spec):
+    """Loads a measure function from a "module:function" spec, ex: "my_cost_model:estimate_latency"."""
+    module_name, _, func_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches workspace size, optimization profile opt batch size and precision "
+                                                 "flags for onnx_to_tensorrt.py, and saves the best as a build recipe.")
+    parser.add_argument("--onnx", required=True, help="The ONNX model to tune the build for.")
+    parser.add_argument("-o", "--output", default="recipe.json", help="The path at which to write the best build recipe.")
+    parser.add_argument("--output-dir", default="autotune", help="Directory to write candidate engines to.")
+    parser.add_argument("--workspace-sizes", type=int, nargs="+", default=[256, 1024, 4096], help="Workspace sizes (MiB) to try.")
+    parser.add_argument("--batch-range", type=int, nargs=2, default=[1, 64], metavar=("MIN", "MAX"),
+                        help="Batch sizes the optimization profile must accept (kMIN and kMAX).")
+    parser.add_argument("--opt-batch-sizes", type=int, nargs="+", default=[1, 8, 16, 32, 64],
+                        help="Batch sizes to try as the profile's kOPT, the batch size its kernels are tuned for.")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "fp16"], choices=sorted(PRECISION_ARGS),
+                        help="Precision flags to try.")
+    parser.add_argument("-b", "--batch-sizes", type=int, nargs="+", default=[1, 8, 32],
+                        help="Batch sizes to benchmark candidates at, the cost is their mean latency.")
+    parser.add_argument("--min-budget", type=int, default=20, help="Benchmark iterations per candidate in the first round.")
+    parser.add_argument("--max-budget", type=int, default=None, help="Stop after the round with at least this many iterations.")
+    parser.add_argument("--eta", type=int, default=2, help="Keep the best 1/eta candidates after each round.")
+    parser.add_argument("--measure", type=str, default=None,
+                        help="Use this 'module:function' as the measure function instead of building and benchmarking.")
+    # Any other arguments (ex: --calibration-cache, --timing-cache) are passed through to onnx_to_tensorrt.py
+    args, build_args = parser.parse_known_args()
+
+    candidates = candidate_space(args.workspace_sizes, args.batch_range, args.opt_batch_sizes, args.precisions)
+    # Candidates that can't run every benchmarked batch size are never built
+    uncovered = [candidate for candidate in candidates if not covers(candidate, args.batch_sizes)]
+    if uncovered:
+        logger.warning("Skipping {} candidates whose profiles don't accept batch sizes {}".format(len(uncovered), args.batch_sizes))
+        candidates = [candidate for candidate in candidates if candidate not in uncovered]
+    if not candidates:
+        raise ValueError("ERROR: --batch-range {} doesn't cover --batch-sizes {}".format(args.batch_range, args.batch_sizes))
+    logger.info("Searching {} candidates".format(len(candidates)))
+
+    if args.measure:
+        measure = load_measure(args.measure)
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        measure = BuildAndBenchmark(args.onnx, args.output_dir, args.batch_sizes, build_args)
+
+    best, best_cost, history = successive_halving(candidates, measure, args.min_budget, args.eta, args.max_budget)
+    if not math.isfinite(best_cost):
+        raise Exception("ERROR: No candidate could be built and benchmarked.")
+
+    logger.info("Best candidate: {} ({:.4g})".format(candidate_name(best), best_cost))
+    recipe = {
+        "args": dict(best, explicit_batch=True),
+        "cost": best_cost,
+        "batch_sizes": args.batch_sizes,
+        "onnx": args.onnx,
+        "history": history,
+    }
+    with open(args.output, "w") as f:
+        logger.info("Writing build recipe: {}".format(args.output))
+        json.dump(recipe, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
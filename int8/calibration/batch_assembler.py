@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import logging
+import argparse
+import collections
+
+import numpy as np
+from PIL import Image
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ("NCHW", "NHWC")
+# What to do when the number of samples isn't a multiple of the batch size
+LAST_BATCH_POLICIES = ("repeat", "partial", "drop")
+
+
+class InputSpec(collections.namedtuple("InputSpec", ["name", "shape", "layout", "preprocess_func", "dtype"])):
+    """One network input to calibrate.
+
+    Parameters
+    ----------
+    name: str
+        Input tensor name (None for single input models).
+    shape: Tuple[int]
+        Shape of one sample, without the batch dimension, in `layout` order: (C, H, W) or (H, W, C).
+    layout: str
+        "NCHW" or "NHWC"
+    preprocess_func: str or function -> numpy.ndarray
+        Pre-processing function (or name of a function in `processing.py`) called as
+        func(image, channels, height, width), returning a CHW array.
+    dtype: numpy.dtype
+    """
+
+    def __new__(cls, name, shape, layout="NCHW", preprocess_func="preprocess_imagenet", dtype=np.float32):
+        if layout not in LAYOUTS:
+            raise ValueError("ERROR: Unknown layout [{:}], choose from {:}".format(layout, LAYOUTS))
+        if len(shape) != 3:
+            raise ValueError("ERROR: Expected a 3D sample shape for input [{:}], got {:}".format(name, shape))
+        return super().__new__(cls, name, tuple(int(dim) for dim in shape), layout, preprocess_func, np.dtype(dtype))
+
+    @property
+    def chw(self):
+        """(channels, height, width) passed to the pre-processing function."""
+        if self.layout == "NHWC":
+            height, width, channels = self.shape
+            return channels, height, width
+        return self.shape
+
+
+def parse_input_spec(spec, default_preprocess_func="preprocess_imagenet"):
+    """Parses "name:CxHxW[:layout[:preprocess_func]]", ex: "input:3x224x224:NCHW:preprocess_imagenet".
+    The shape is given in `layout` order."""
+    fields = spec.split(":")
+    if len(fields) < 2:
+        raise ValueError("ERROR: Expected name:CxHxW[:layout[:preprocess_func]], got [{:}]".format(spec))
+    name, dims = fields[:2]
+    layout = fields[2] if len(fields) > 2 and fields[2] else "NCHW"
+    preprocess_func = fields[3] if len(fields) > 3 and fields[3] else default_preprocess_func
+    return InputSpec(name, [int(dim) for dim in dims.split("x")], layout, preprocess_func)
+
+
+def guess_input_spec(name, shape, preprocess_func="preprocess_imagenet"):
+    """InputSpec from a network input shape (with batch dimension), guessing NHWC when the
+    last dimension looks like channels and the first doesn't."""
+    _, d1, d2, d3 = shape
+    layout = "NHWC" if d3 in (1, 3) and d1 not in (1, 3) else "NCHW"
+    return InputSpec(name, (d1, d2, d3), layout, preprocess_func)
+
+
+def to_layout(chw, layout):
+    """Converts a CHW sample to `layout`. Returns a view where possible."""
+    return chw.transpose(1, 2, 0) if layout == "NHWC" else chw
+
+
+class BatchAssembler:
+    """Assembles calibration batches for one or more named inputs.
+
+    Every input has a single buffer of shape (batch_size, *shape), allocated once with
+    `allocator` (ex: pycuda.driver.pagelocked_empty for pinned memory) and overwritten by
+    each batch. Each file is decoded once per batch, even when several inputs of a sample
+    read it, and a last batch with fewer than `batch_size` samples is never padded by
+    decoding files again:
+
+        "repeat": the missing rows are copies of the decoded rows (full batch)
+        "partial": only the decoded rows are returned (a smaller batch)
+        "drop": the last batch is skipped
+
+    Parameters
+    ----------
+    inputs: List[InputSpec]
+    batch_size: int
+    last_batch: str
+        One of LAST_BATCH_POLICIES.
+    allocator: function(shape, dtype) -> numpy.ndarray
+    decode_options: dict
+        Options for pre-processing functions given by name, ex: {"draft": True, "resize_filter": "bilinear"}.
+        See processing.get_preprocess_func().
+    """
+
+    def __init__(self, inputs, batch_size, last_batch="repeat", allocator=np.empty, decode_options=None):
+        if last_batch not in LAST_BATCH_POLICIES:
+            raise ValueError("ERROR: Unknown last_batch [{:}], choose from {:}".format(last_batch, LAST_BATCH_POLICIES))
+        if batch_size < 1:
+            raise ValueError("ERROR: batch_size must be positive, got {:}".format(batch_size))
+        self.inputs = list(inputs)
+        self.batch_size = batch_size
+        self.last_batch = last_batch
+        self.buffers = collections.OrderedDict((spec.name, allocator((batch_size, *spec.shape), spec.dtype))
+                                               for spec in self.inputs)
+        decode_options = dict(decode_options or {})
+        # A file read by several inputs is decoded once, so the reduced decode size must suit
+        # the largest of them: draft is applied here instead of by each pre-processing function
+        self.draft_size = None
+        if decode_options.pop("draft", False):
+            self.draft_size = (max(spec.chw[2] for spec in self.inputs), max(spec.chw[1] for spec in self.inputs))
+        self.preprocess_funcs = {spec.name: self._get_preprocess_func(spec.preprocess_func, decode_options)
+                                 for spec in self.inputs}
+        self.num_decoded = 0
+
+    @staticmethod
+    def _get_preprocess_func(preprocess_func, decode_options):
+        if callable(preprocess_func):
+            return preprocess_func
+        import processing  # local module
+        return processing.get_preprocess_func(preprocess_func, **decode_options)
+
+    def decode(self, filename):
+        # Pixels are only decoded on first access, so a reduced JPEG decode size can still be
+        # picked (see processing.resize)
+        self.num_decoded += 1
+        image = Image.open(filename)
+        if self.draft_size:
+            image.draft(image.mode, self.draft_size)
+        return image
+
+    def num_batches(self, num_samples):
+        if self.last_batch == "drop":
+            return num_samples // self.batch_size
+        return -(-num_samples // self.batch_size)
+
+    def fill(self, samples):
+        """Pre-processes `samples` into the first rows of the input buffers.
+
+        Each sample is either a filename read by every input, or a {input_name: filename} dict.
+        """
+        decoded = {}
+        try:
+            for row, sample in enumerate(samples):
+                for spec in self.inputs:
+                    filename = sample[spec.name] if isinstance(sample, dict) else sample
+                    if filename not in decoded:
+                        decoded[filename] = self.decode(filename)
+                    chw = self.preprocess_funcs[spec.name](decoded[filename], *spec.chw)
+                    self.buffers[spec.name][row] = to_layout(chw, spec.layout)
+        finally:
+            for image in decoded.values():
+                image.close()
+
+    def batches(self, samples):
+        """Yields {input_name: batch} for every batch of `samples`. The batches are views of
+        the reusable input buffers, so they are only valid until the next batch."""
+        for index in range(self.num_batches(len(samples))):
+            chunk = samples[index * self.batch_size:(index + 1) * self.batch_size]
+            rows = len(chunk)
+            self.fill(chunk)
+            if rows < self.batch_size and self.last_batch == "repeat":
+                repeats = np.arange(rows, self.batch_size) % rows
+                for buffer in self.buffers.values():
+                    buffer[rows:] = buffer[repeats]
+                rows = self.batch_size
+            yield collections.OrderedDict((name, buffer[:rows]) for name, buffer in self.buffers.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assembles calibration batches from a directory of images on the CPU, "
+                                                 "reporting batch shapes and the number of decoded files.")
+    parser.add_argument("--calibration-data", required=True, help="The directory containing {*.jpg, *.jpeg, *.png} files.")
+    parser.add_argument("--inputs", nargs="+", default=["input:3x224x224"],
+                        help="Input specs name:CxHxW[:layout[:preprocess_func]], ex: input:224x224x3:NHWC:preprocess_inception")
+    parser.add_argument("-b", "--batch-size", type=int, default=32, help="Calibration batch size.")
+    parser.add_argument("--last-batch", default="repeat", choices=LAST_BATCH_POLICIES, help="How to handle the last, incomplete batch.")
+    parser.add_argument("--draft-decode", action="store_true", help="Decode JPEGs at reduced resolution.")
+    parser.add_argument("--resize-filter", default=None, help="Resize filter, see processing.RESIZE_FILTERS.")
+    args = parser.parse_args()
+
+    files = sorted(path for path in glob.iglob(os.path.join(args.calibration_data, "**"), recursive=True)
+                   if os.path.isfile(path) and path.lower().endswith((".jpeg", ".jpg", ".png")))
+    assembler = BatchAssembler([parse_input_spec(spec) for spec in args.inputs], args.batch_size, args.last_batch,
+                               decode_options={"draft": args.draft_decode, "resize_filter": args.resize_filter})
+    for index, batch in enumerate(assembler.batches(files)):
+        print("Batch {}: {}".format(index, ", ".join("{} {}".format(name, array.shape) for name, array in batch.items())))
+    print("Decoded {} files for {} samples".format(assembler.num_decoded, len(files)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import logging
+import argparse
+import collections
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+METHODS = ("minmax", "percentile", "entropy")
+# Calibration cache header written for each method, ex: "TRT-7100-EntropyCalibration2"
+CACHE_HEADERS = {
+    "minmax": "MinMaxCalibration",
+    "percentile": "LegacyCalibration",
+    "entropy": "EntropyCalibration2",
+}
+INT8_MAX = 127
+
+
+class ActivationHistogram:
+    """Streaming histogram of the absolute values of one tensor.
+
+    The range starts at the max of the first batch, and when a later batch exceeds it, the
+    range is doubled (as many times as needed) by merging pairs of adjacent bins, so earlier
+    batches never have to be revisited.
+    """
+
+    def __init__(self, num_bins=2048):
+        if num_bins & (num_bins - 1):
+            raise ValueError("num_bins must be a power of 2, got {}".format(num_bins))
+        self.num_bins = num_bins
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.range = 0.0
+        self.amax = 0.0
+
+    @property
+    def bin_width(self):
+        return self.range / self.num_bins
+
+    def update(self, activations):
+        values = np.abs(np.asarray(activations, dtype=np.float32).ravel())
+        if values.size == 0:
+            return
+        batch_max = float(values.max())
+        self.amax = max(self.amax, batch_max)
+
+        if self.range == 0.0:
+            self.range = batch_max if batch_max > 0 else 1.0
+        while batch_max > self.range:
+            factor = min(self.num_bins, 2 ** int(np.ceil(np.log2(batch_max / self.range))))
+            self.counts = np.concatenate([self.counts.reshape(-1, factor).sum(axis=1),
+                                          np.zeros(self.num_bins - self.num_bins // factor, dtype=np.int64)])
+            self.range *= factor
+
+        self.counts += np.histogram(values, bins=self.num_bins, range=(0, self.range))[0]
+
+
+def amax_minmax(histogram):
+    return histogram.amax
+
+
+def amax_percentile(histogram, percentile=99.99):
+    """Smallest bin edge below which `percentile` % of the values lie."""
+    cdf = np.cumsum(histogram.counts)
+    index = int(np.searchsorted(cdf, cdf[-1] * percentile / 100))
+    return min(histogram.amax, (index + 1) * histogram.bin_width)
+
+
+def amax_entropy(histogram, num_quantized_bins=INT8_MAX + 1, stride=1):
+    """TensorRT style entropy calibration: picks the threshold minimizing the KL divergence
+    between the clipped reference distribution and its `num_quantized_bins` quantization."""
+    counts = histogram.counts.astype(np.float64)
+    total = counts.sum()
+    if total == 0:
+        return 0.0
+    tail = total - np.cumsum(counts)  # tail[i - 1] = values at or beyond bin i
+
+    best_threshold, best_divergence = histogram.num_bins, np.inf
+    for threshold in range(num_quantized_bins, histogram.num_bins + 1, stride):
+        reference = counts[:threshold].copy()
+        # Values beyond the threshold are clipped into the last bin
+        reference[-1] += tail[threshold - 1]
+
+        # Merge the bins into num_quantized_bins groups, and spread each group's count evenly
+        # over its non-empty bins
+        groups = np.arange(threshold) * num_quantized_bins // threshold
+        nonzero = counts[:threshold] > 0
+        group_sums = np.bincount(groups, weights=counts[:threshold], minlength=num_quantized_bins)
+        group_sizes = np.bincount(groups, weights=nonzero, minlength=num_quantized_bins)
+        quantized = np.where(nonzero, group_sums[groups] / np.maximum(group_sizes[groups], 1), 0)
+
+        p = reference / reference.sum()
+        q = quantized / max(quantized.sum(), 1e-12)
+        mask = p > 0
+        if np.any(q[mask] == 0):
+            continue
+        divergence = float(np.sum(p[mask] * np.log(p[mask] / q[mask])))
+        if divergence < best_divergence:
+            best_threshold, best_divergence = threshold, divergence
+
+    return min(histogram.amax, best_threshold * histogram.bin_width)
+
+
+def collect_histograms(activation_files, num_bins=2048):
+    """Streams the activations in NPZ files (keyed by tensor name, one file per batch) into
+    an ActivationHistogram per tensor."""
+    histograms = collections.OrderedDict()
+    for filename in activation_files:
+        with np.load(filename) as activations:
+            for name in activations.files:
+                if name not in histograms:
+                    histograms[name] = ActivationHistogram(num_bins)
+                histograms[name].update(activations[name])
+    logger.info("Collected histograms of {:} tensors from {:} files".format(len(histograms), len(activation_files)))
+    return histograms
+
+
+def compute_dynamic_ranges(histograms, method="entropy", percentile=99.99, stride=1):
+    """Returns {tensor_name: amax} using the calibration `method` (one of METHODS)."""
+    if method == "minmax":
+        return {name: amax_minmax(h) for name, h in histograms.items()}
+    if method == "percentile":
+        return {name: amax_percentile(h, percentile) for name, h in histograms.items()}
+    if method == "entropy":
+        return {name: amax_entropy(h, stride=stride) for name, h in histograms.items()}
+    raise ValueError("ERROR: Unknown calibration method [{:}], choose from {:}".format(method, METHODS))
+
+
+def write_calibration_cache(filename, amaxes, header):
+    """Writes dynamic ranges in TensorRT's calibration cache format (scale = amax / 127),
+    see precision_plan.read_calibration_cache_scales."""
+    with open(filename, "w") as f:
+        f.write(header + "\n")
+        for name, amax in amaxes.items():
+            f.write("{}: {}\n".format(name, struct.pack("!f", amax / INT8_MAX).hex()))
+    logger.info("Wrote {:} dynamic ranges to: {:}".format(len(amaxes), filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Computes INT8 dynamic ranges offline from saved activations with several "
+                                                 "calibration methods, to compare them without building engines.")
+    parser.add_argument("activations", nargs="+", help="NPZ files of activations keyed by tensor name, ex: one per calibration batch.")
+    parser.add_argument("--methods", nargs="+", default=list(METHODS), choices=METHODS, help="Calibration methods to compare.")
+    parser.add_argument("--num-bins", type=int, default=2048, help="Number of histogram bins per tensor.")
+    parser.add_argument("--percentile", type=float, default=99.99, help="Percentile used by the percentile method.")
+    parser.add_argument("--stride", type=int, default=1, help="Only try every stride-th threshold in the entropy method.")
+    parser.add_argument("--calibration-cache", help="Also compare against the ranges in this TensorRT calibration cache.")
+    parser.add_argument("-o", "--output", help="Write the ranges of the first of --methods to this path as a calibration cache.")
+    parser.add_argument("--trt-version", default="7100", help="TensorRT version number written in the --output cache header.")
+    args = parser.parse_args()
+
+    histograms = collect_histograms(args.activations, args.num_bins)
+    ranges = collections.OrderedDict((method, compute_dynamic_ranges(histograms, method, args.percentile, args.stride))
+                                     for method in args.methods)
+    if args.calibration_cache:
+        from precision_plan import read_calibration_cache_scales # local module
+        scales = read_calibration_cache_scales(args.calibration_cache)
+        ranges["cache"] = {name: scale * INT8_MAX for name, scale in scales.items()}
+
+    print("{:<40}".format("Tensor") + "".join("{:>14}".format(column) for column in ranges))
+    for name in histograms:
+        print("{:<40}".format(name[-40:]) + "".join("{:>14.5g}".format(r[name]) if name in r else "{:>14}".format("-")
+                                                    for r in ranges.values()))
+
+    if args.output:
+        method = args.methods[0]
+        write_calibration_cache(args.output, ranges[method], "TRT-{}-{}".format(args.trt_version, CACHE_HEADERS[method]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import json
+import random
+import hashlib
+import logging
+import argparse
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+SELECTION_METHODS = ("random", "kcenter", "stratified")
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tensorrt-utils", "calibration_selection")
+THUMBNAIL_SIZE = 8
+HISTOGRAM_BINS = 16
+
+
+def image_features(filename):
+    """Cheap image statistics used to compare images: an 8x8 RGB thumbnail, per-channel
+    mean/std and a luminance histogram. JPEGs are decoded at reduced resolution."""
+    with Image.open(filename) as image:
+        image.draft("RGB", (4 * THUMBNAIL_SIZE, 4 * THUMBNAIL_SIZE))
+        image = image.convert("RGB")
+        thumbnail = np.asarray(image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BILINEAR), dtype=np.float32) / 255
+        pixels = np.asarray(image, dtype=np.float32).reshape(-1, 3) / 255
+
+    luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    histogram = np.histogram(luminance, bins=HISTOGRAM_BINS, range=(0, 1))[0].astype(np.float32) / len(luminance)
+    return np.concatenate([thumbnail.ravel(), pixels.mean(axis=0), pixels.std(axis=0), histogram])
+
+
+def compute_features(files, num_workers=None):
+    """Computes image_features for every file in parallel. Returns an array of shape (len(files), num_features)."""
+    with multiprocessing.Pool(num_workers) as pool:
+        return np.stack(pool.map(image_features, files, chunksize=max(1, len(files) // (4 * (num_workers or os.cpu_count())))))
+
+
+def standardize(features):
+    """Scales every feature to zero mean and unit variance, so no single statistic dominates distances."""
+    std = features.std(axis=0)
+    return (features - features.mean(axis=0)) / np.where(std > 0, std, 1)
+
+
+def kcenter_greedy(features, k, seed=42):
+    """Greedy k-center selection: repeatedly picks the sample farthest from everything selected so far,
+    which covers the feature space (including rare images) with few samples.
+
+    Returns the indices of the `k` selected samples, in selection order.
+    """
+    features = standardize(np.asarray(features, dtype=np.float32))
+    num_samples = features.shape[0]
+    k = min(k, num_samples)
+    squared_norms = np.einsum("ij,ij->i", features, features)
+
+    selected = [int(np.random.RandomState(seed).randint(num_samples))]
+    min_distances = np.full(num_samples, np.inf, dtype=np.float32)
+    for _ in range(k - 1):
+        center = features[selected[-1]]
+        distances = squared_norms - 2 * features @ center + center @ center
+        np.minimum(min_distances, distances, out=min_distances)
+        min_distances[selected[-1]] = -np.inf
+        selected.append(int(np.argmax(min_distances)))
+    return np.array(selected, dtype=np.int64)
+
+
+def stratified_sample(features, k, num_strata=16, seed=42):
+    """Stratified sampling along the first principal component of the features: samples are
+    split into `num_strata` equally populated strata, and each stratum contributes samples in
+    proportion to its size.
+
+    Returns the indices of the `k` selected samples, sorted.
+    """
+    features = standardize(np.asarray(features, dtype=np.float64))
+    num_samples = features.shape[0]
+    k = min(k, num_samples)
+
+    # First right singular vector = direction of largest variance
+    _, _, vt = np.linalg.svd(features, full_matrices=False)
+    projection = features @ vt[0]
+    edges = np.quantile(projection, np.linspace(0, 1, num_strata + 1)[1:-1])
+    strata = np.searchsorted(edges, projection)
+
+    counts = np.bincount(strata, minlength=num_strata)
+    quotas = counts * k / num_samples
+    allocation = np.floor(quotas).astype(np.int64)
+    # Largest remainder method to allocate the rest
+    remainder = k - allocation.sum()
+    allocation[np.argsort(allocation - quotas)[:remainder]] += 1
+
+    rng = np.random.RandomState(seed)
+    selected = [rng.choice(np.flatnonzero(strata == s), size=n, replace=False)
+                for s, n in enumerate(allocation) if n > 0]
+    return np.sort(np.concatenate(selected))
+
+
+def dataset_fingerprint(files):
+    """Identifies a set of files by their paths, sizes and modification times."""
+    sha256 = hashlib.sha256()
+    for path in sorted(files):
+        stat = os.stat(path)
+        sha256.update("{}\0{}\0{}\n".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def select_calibration_files(files, max_calibration_size, method="kcenter", cache_dir=DEFAULT_CACHE_DIR,
+                             num_workers=None, seed=42):
+    """Returns a representative subset of `max_calibration_size` files.
+
+    Features and selections are cached in `cache_dir` by dataset fingerprint, so re-building
+    with the same calibration data doesn't recompute them.
+    """
+    if method not in SELECTION_METHODS:
+        raise ValueError("ERROR: Unknown selection method [{:}], choose from {:}".format(method, SELECTION_METHODS))
+    if len(files) <= max_calibration_size:
+        return list(files)
+    if method == "random":
+        random.seed(seed)  # Set seed for reproducibility
+        return random.sample(files, max_calibration_size)
+
+    files = sorted(files)
+    fingerprint = dataset_fingerprint(files) if cache_dir else None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        selection_file = os.path.join(cache_dir, "{}.{}.{}.{}.json".format(fingerprint, method, max_calibration_size, seed))
+        if os.path.exists(selection_file):
+            logger.info("Using cached calibration selection: {:}".format(selection_file))
+            with open(selection_file, "r") as f:
+                return json.load(f)
+
+    features_file = os.path.join(cache_dir, "{}.features.npy".format(fingerprint)) if cache_dir else None
+    if features_file and os.path.exists(features_file):
+        features = np.load(features_file)
+    else:
+        logger.info("Computing image features for {:} calibration files".format(len(files)))
+        features = compute_features(files, num_workers)
+        if features_file:
+            np.save(features_file, features)
+
+    if method == "kcenter":
+        indices = kcenter_greedy(features, max_calibration_size, seed)
+    else:
+        indices = stratified_sample(features, max_calibration_size, seed=seed)
+    selected = [files[i] for i in indices]
+    logger.info("Selected {:}/{:} calibration files with {:} sampling".format(len(selected), len(files), method))
+
+    if cache_dir:
+        with open(selection_file, "w") as f:
+            json.dump(selected, f)
+    return selected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Selects a small, representative calibration subset from a directory of images.")
+    parser.add_argument("--calibration-data", required=True, help="The directory containing {*.jpg, *.jpeg, *.png} files.")
+    parser.add_argument("--max-calibration-size", type=int, default=512, help="Number of files to select.")
+    parser.add_argument("--method", default="kcenter", choices=SELECTION_METHODS, help="Selection method.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory to cache features and selections in.")
+    parser.add_argument("-j", "--num-workers", type=int, default=None, help="Processes for computing features.")
+    parser.add_argument("-o", "--output", default=None, help="Write the selected filenames to this file, one per line.")
+    args = parser.parse_args()
+
+    files = [path for path in glob.iglob(os.path.join(args.calibration_data, "**"), recursive=True)
+             if os.path.isfile(path) and path.lower().endswith((".jpeg", ".jpg", ".png"))]
+    selected = select_calibration_files(files, args.max_calibration_size, args.method, args.cache_dir, args.num_workers)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("\n".join(selected) + "\n")
+    else:
+        print("\n".join(selected))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import logging
+
+import numpy as np
+import tensorrt as trt
+import pycuda.driver as cuda
+import pycuda.autoinit
+
+from batch_assembler import BatchAssembler, InputSpec # local module
+
+INFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "inference")
+if INFERENCE_DIR not in sys.path:
+    sys.path.append(INFERENCE_DIR)
+from instrumentation import metrics # local module
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+# https://docs.nvidia.com/deeplearning/tensorrt/api/python_api/infer/Int8/Calibrator.html
+CALIBRATION_ALGORITHMS = {
+    "entropy2": "IInt8EntropyCalibrator2",
+    "entropy": "IInt8EntropyCalibrator",
+    "minmax": "IInt8MinMaxCalibrator",
+    "legacy": "IInt8LegacyCalibrator",
+}
+
+
+class CalibrationCache:
+    """Reads/writes a calibration (or histogram) cache file."""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+
+    def read(self):
+        # If there is a cache, use it instead of calibrating again. Otherwise, implicitly return None.
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, "rb") as f:
+                logger.info("Using calibration cache to save time: {:}".format(self.cache_file))
+                return f.read()
+
+    def write(self, cache):
+        with open(self.cache_file, "wb") as f:
+            logger.info("Caching calibration data for future use: {:}".format(self.cache_file))
+            f.write(cache)
+
+
+class DeviceBuffers:
+    """Device buffers for the calibration inputs, allocated on the first upload and re-used after."""
+
+    def __init__(self):
+        self.device_inputs = None
+
+    def upload(self, host_batches):
+        if self.device_inputs is None:
+            self.device_inputs = [cuda.mem_alloc(batch.nbytes) for batch in host_batches]
+        for device_input, batch in zip(self.device_inputs, host_batches):
+            cuda.memcpy_htod(device_input, np.ascontiguousarray(batch))
+        return [int(device_input) for device_input in self.device_inputs]
+
+
+class ImageDataSource:
+    """Batches of pre-processed images, assembled by batch_assembler.BatchAssembler into one
+    reusable pinned buffer per input.
+
+    Parameters
+    ----------
+    files: List[str]
+        List of image filenames (or {input_name: filename} dicts) to use for INT8 Calibration
+    batch_size: int
+        Number of images to pass through in one batch during calibration
+    input_shape: Tuple[int]
+        Tuple of integers defining the shape of input to the model, for single input models.
+    preprocess_func: function -> numpy.ndarray
+        Pre-processing function to run on each image, returning an array of shape `input_shape`.
+    inputs: List[batch_assembler.InputSpec]
+        Names, shapes, layouts and pre-processing functions of each input, instead of
+        `input_shape` and `preprocess_func`.
+    decode_options: dict
+        Options for pre-processing functions given by name, see processing.get_preprocess_func().
+    """
+
+    def __init__(self, files, batch_size, input_shape=(3, 224, 224), preprocess_func=None, inputs=None,
+                 decode_options=None):
+        self.batch_size = batch_size
+        self.files = list(files)
+        if inputs is None:
+            inputs = [InputSpec(None, input_shape, "NCHW", preprocess_func)]
+        # The last batch repeats already decoded rows, calibration needs full batches
+        self.assembler = BatchAssembler(inputs, batch_size, last_batch="repeat", allocator=cuda.pagelocked_empty,
+                                        decode_options=decode_options)
+
+    def batches(self, input_names):
+        for index, batch in enumerate(self.assembler.batches(self.files)):
+            logger.info("Calibration images pre-processed: {:}/{:}".format(min((index + 1) * self.batch_size, len(self.files)),
+                                                                           len(self.files)))
+            # Single input models don't need to name their input
+            yield list(batch.values()) if None in batch else batch
+
+
+class RandomDataSource:
+    """Batches of random data shaped like the network inputs (or the calibration profile, if set)."""
+
+    def __init__(self, network, calib_profile=None, num_batches=1000):
+        # TODO: Not sure of difference between get_batch_size and what's returned in get_batch ?
+        # Notes:
+        #     get_batch_size() is required to return non-null value
+        #     get_batch_size() can return  0 with seemingly no consequence with/without calibration cache
+        #     get_batch_size() can return -1 with seemingly no consequence with/without calibration cache
+        #     get_batch() seems to do the work, as long as get_batch_size doesn't throw an error
+        self.batch_size = -1
+        self.network = network
+        self.calib_profile = calib_profile
+        self.num_batches = num_batches
+
+    def get_shapes(self, input_names):
+        if self.calib_profile:
+            return [self.calib_profile.get_shape(name) for name in input_names]
+
+        shapes = []
+        # This assumes order of input_names matches the network input indices
+        for i, name in enumerate(input_names):
+            shape = self.network.get_input(i).shape
+            # Replace any dynamic dimensions with ones if any
+            _shape = tuple(1 if dim < 0 else dim for dim in shape)
+            if _shape != tuple(shape):
+                logger.warning("[{}] has dynamic shape: {}. Set to {} instead.".format(name, shape, _shape))
+            shapes.append(_shape)
+        return shapes
+
+    def batches(self, input_names):
+        shapes = self.get_shapes(input_names)
+        for _ in range(self.num_batches):
+            yield [np.random.random(s).astype(np.float32) for s in shapes]
+
+
+class CalibratorBase:
+    """Calibrator plumbing shared by every calibration algorithm: batches come from a data
+    source, are uploaded to the device with DeviceBuffers, and the calibration cache is
+    read/written with CalibrationCache.
+
+    This must be combined with one of TensorRT's calibrator classes, see create_calibrator().
+
+    Parameters
+    ----------
+    data_source:
+        Object with a `batch_size` attribute and a `batches(input_names)` method yielding,
+        for each batch, a list of host arrays (one per input, in `input_names` order) or a
+        dict of host arrays by input name.
+    cache_file: str
+        Name of file to read/write calibration cache from/to.
+    quantile: float
+        (legacy ONLY) Quantile of the activation histogram used as the dynamic range.
+    regression_cutoff: float
+        (legacy ONLY) Fraction of the histogram tail used by the regression.
+    """
+
+    def __init__(self, data_source, cache_file="calibration.cache", quantile=0.9999, regression_cutoff=1.0):
+        super().__init__()
+        self.data_source = data_source
+        self.cache = CalibrationCache(cache_file)
+        self.histogram_cache = CalibrationCache(cache_file + ".histogram")
+        self.device_buffers = DeviceBuffers()
+        self.batches = None
+        self.quantile = quantile
+        self.regression_cutoff = regression_cutoff
+
+    @property
+    def cache_file(self):
+        return self.cache.cache_file
+
+    def get_batch_size(self):
+        return self.data_source.batch_size
+
+    def get_batch(self, names, p_str=None):
+        if self.batches is None:
+            self.batches = iter(self.data_source.batches(names))
+        try:
+            with metrics.timer("calibration_batch_load"):
+                host_batches = next(self.batches)
+        except StopIteration:
+            # When we're out of batches, we return either [] or None.
+            # This signals to TensorRT that there is no calibration data remaining.
+            return None
+
+        if isinstance(host_batches, dict):
+            host_batches = [host_batches[name] for name in names]
+        metrics.count("calibration_batches")
+        with metrics.timer("calibration_h2d"):
+            return self.device_buffers.upload(host_batches)
+
+    def read_calibration_cache(self):
+        return self.cache.read()
+
+    def write_calibration_cache(self, cache):
+        self.cache.write(cache)
+
+    # Only used by IInt8LegacyCalibrator
+    def get_quantile(self):
+        return self.quantile
+
+    def get_regression_cutoff(self):
+        return self.regression_cutoff
+
+    def read_histogram_cache(self, length):
+        return self.histogram_cache.read()
+
+    def write_histogram_cache(self, data, length):
+        self.histogram_cache.write(data)
+
+
+def create_calibrator(algorithm, data_source, cache_file="calibration.cache", **kwargs):
+    """Creates a calibrator using the TensorRT calibration `algorithm` (one of CALIBRATION_ALGORITHMS)
+    with the given data source. See CalibratorBase for the other arguments."""
+    if algorithm not in CALIBRATION_ALGORITHMS:
+        raise ValueError("ERROR: Unknown calibration algorithm [{:}], choose from {:}".format(algorithm, sorted(CALIBRATION_ALGORITHMS)))
+
+    trt_calibrator = getattr(trt, CALIBRATION_ALGORITHMS[algorithm])
+    calibrator_class = type(trt_calibrator.__name__.replace("IInt8", ""), (CalibratorBase, trt_calibrator), {})
+    logger.info("Using {:} for INT8 calibration".format(trt_calibrator.__name__))
+    return calibrator_class(data_source, cache_file, **kwargs)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import glob
+import time
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+import processing # local module
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+
+def create_synthetic_jpegs(directory, num_images=8, width=4000, height=3000, quality=90, seed=42):
+    """Writes photo-like JPEGs (smooth gradients, shapes and sensor-like noise) to `directory`."""
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    files = []
+    for i in range(num_images):
+        image = np.empty((height, width, 3), dtype=np.float32)
+        for c in range(3):
+            fx, fy, phase = rng.uniform(1, 8, size=2).tolist() + [rng.uniform(0, 2 * np.pi)]
+            image[..., c] = 127 + 80 * np.sin(2 * np.pi * (fx * x / width + fy * y / height) + phase)
+        cx, cy, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(height / 8, height / 3)
+        image[(x - cx) ** 2 + (y - cy) ** 2 < r ** 2] *= 0.5
+        image += rng.normal(0, 8, size=image.shape).astype(np.float32)
+        path = os.path.join(directory, "synthetic_{:03d}.jpg".format(i))
+        Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(path, quality=quality)
+        files.append(path)
+    return files
+
+
+def run_config(files, preprocess_func, input_shape, repeats=1):
+    """Returns (per-image seconds, pre-processed arrays) of opening + decoding + pre-processing each file."""
+    timings, outputs = [], []
+    for filename in files:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            with Image.open(filename) as image:
+                output = preprocess_func(image, *input_shape)
+            timings.append(time.perf_counter() - start)
+        outputs.append(output)
+    return np.array(timings), np.stack(outputs)
+
+
+def accuracy_impact(reference, candidate):
+    """Differences between pre-processed tensors, per image then averaged."""
+    reference = reference.reshape(len(reference), -1).astype(np.float64)
+    candidate = candidate.reshape(len(candidate), -1).astype(np.float64)
+    errors = np.abs(reference - candidate)
+    cosine = np.sum(reference * candidate, axis=1) / np.maximum(
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12)
+    mse = np.mean((reference - candidate) ** 2, axis=1)
+    signal = np.ptp(reference, axis=1) ** 2
+    return {
+        "mean_abs_error": float(errors.mean()),
+        "max_abs_error": float(errors.max()),
+        "cosine": float(cosine.mean()),
+        "psnr": float(np.mean(np.where(mse > 0, 10 * np.log10(signal / np.maximum(mse, 1e-12)), np.inf))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares full resolution and reduced resolution (draft) JPEG decoding, "
+                                                 "with several resize filters, for speed and impact on pre-processed inputs.")
+    parser.add_argument("-d", "--data", default=None, help="Directory of JPEGs. Synthetic large JPEGs are generated if not given.")
+    parser.add_argument("-n", "--num-images", type=int, default=8, help="Number of synthetic images (or max number of --data images).")
+    parser.add_argument("--size", type=int, nargs=2, default=[4000, 3000], metavar=("WIDTH", "HEIGHT"), help="Synthetic image size.")
+    parser.add_argument("-p", "--preprocess_func", default="preprocess_imagenet", help="Function defined in 'processing.py'.")
+    parser.add_argument("--input-shape", type=int, nargs=3, default=[3, 224, 224], help="CHW input shape.")
+    parser.add_argument("--filters", nargs="+", default=["lanczos", "bilinear"], choices=sorted(processing.RESIZE_FILTERS),
+                        help="Resize filters to try. The first one, without draft, is the reference.")
+    parser.add_argument("-r", "--repeats", type=int, default=1, help="Times to decode each image.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.data:
+            files = sorted(glob.glob(os.path.join(args.data, "*.jp*g")))[:args.num_images]
+        else:
+            logger.info("Generating {} synthetic {}x{} JPEGs".format(args.num_images, *args.size))
+            files = create_synthetic_jpegs(tmp_dir, args.num_images, *args.size)
+        if not files:
+            raise Exception("ERROR: No JPEGs found in: {}".format(args.data))
+
+        reference = None
+        print("{:<10} {:<6} {:>12} {:>12} {:>9} {:>14} {:>13} {:>10} {:>8}".format(
+            "filter", "draft", "mean ms", "p95 ms", "speedup", "mean abs err", "max abs err", "cosine", "psnr"))
+        for resize_filter in args.filters:
+            for draft in (False, True):
+                preprocess_func = processing.get_preprocess_func(args.preprocess_func, draft, resize_filter)
+                timings, outputs = run_config(files, preprocess_func, args.input_shape, args.repeats)
+                if reference is None:
+                    reference, reference_time = outputs, timings.mean()
+                impact = accuracy_impact(reference, outputs)
+                print("{:<10} {:<6} {:>12.2f} {:>12.2f} {:>8.2f}x {:>14.5f} {:>13.5f} {:>10.6f} {:>8.2f}".format(
+                    resize_filter, str(draft), 1000 * timings.mean(), 1000 * np.percentile(timings, 95),
+                    reference_time / timings.mean(), impact["mean_abs_error"], impact["max_abs_error"],
+                    impact["cosine"], impact["psnr"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+SIDECAR_VERSION = 1
+
+
+def sidecar_path(engine_path):
+    """The metadata for "model.engine" is written to "model.engine.json" """
+    return engine_path + ".json"
+
+
+def file_sha256(filename, chunk_size=2**20):
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_engine_metadata(engine, onnx_path=None, build_time=None, builder_flags=(), **build_info):
+    """Collects binding, profile and build information about a built engine.
+
+    Parameters
+    ----------
+    engine: tensorrt.ICudaEngine
+        The built (or deserialized) engine.
+    onnx_path: str
+        (Optional) The ONNX model the engine was built from, hashed to identify the source model.
+    build_time: float
+        (Optional) Seconds spent in builder.build_engine.
+    builder_flags: List[str]
+        Names of the builder flags that were set, ex: ["fp16", "int8"]
+    build_info:
+        Any other JSON serializable build settings to record, ex: workspace_size=1024.
+
+    Returns
+    -------
+    metadata: dict
+        JSON serializable engine metadata.
+    """
+    import tensorrt as trt
+
+    num_profiles = engine.num_optimization_profiles
+    bindings_per_profile = engine.num_bindings // num_profiles
+    bindings = []
+    for index in range(engine.num_bindings):
+        bindings.append({
+            "index": index,
+            "name": engine.get_binding_name(index),
+            "is_input": engine.binding_is_input(index),
+            "shape": list(engine.get_binding_shape(index)),
+            "dtype": trt.nptype(engine.get_binding_dtype(index)).__name__,
+            "profile": index // bindings_per_profile,
+        })
+
+    profiles = []
+    if not engine.has_implicit_batch_dimension:
+        for profile_index in range(num_profiles):
+            shapes = {}
+            for binding in bindings:
+                if binding["profile"] == profile_index and binding["is_input"]:
+                    kmin, kopt, kmax = engine.get_profile_shape(profile_index, binding["index"])
+                    # Bindings of profiles after 0 are named "input [profile k]", key every
+                    # profile by the profile 0 name so they can be queried by input name
+                    base_name = bindings[binding["index"] % bindings_per_profile]["name"]
+                    shapes[base_name] = {"min": list(kmin), "opt": list(kopt), "max": list(kmax)}
+            profiles.append(shapes)
+
+    return {
+        "sidecar_version": SIDECAR_VERSION,
+        "tensorrt_version": trt.__version__,
+        "implicit_batch": engine.has_implicit_batch_dimension,
+        "max_batch_size": engine.max_batch_size,
+        "num_profiles": num_profiles,
+        "bindings": bindings,
+        "profiles": profiles,
+        "builder_flags": sorted(builder_flags),
+        "build": dict(build_info, build_time=build_time, timestamp=time.time(), host=socket.gethostname()),
+        "onnx": {
+            "path": os.path.abspath(onnx_path),
+            "sha256": file_sha256(onnx_path),
+        } if onnx_path else None,
+    }
+
+
+def write_sidecar(engine_path, metadata):
+    path = sidecar_path(engine_path)
+    metadata = dict(metadata, engine=os.path.basename(engine_path), engine_size=os.path.getsize(engine_path))
+    with open(path, "w") as f:
+        logger.info("Writing engine metadata: {:}".format(path))
+        json.dump(metadata, f, indent=4, sort_keys=True)
+    return path
+
+
+def read_sidecar(engine_path):
+    with open(sidecar_path(engine_path), "r") as f:
+        return json.load(f)
@@ -17,12 +17,20 @@
 import os
 import sys
 import glob
+import json
 import math
+import time
 import logging
 import argparse
 
 import tensorrt as trt
 
+# The instrumentation module is shared with the inference scripts
+INFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "inference")
+if INFERENCE_DIR not in sys.path:
+    sys.path.append(INFERENCE_DIR)
+from instrumentation import metrics # local module
+
 TRT_LOGGER = trt.Logger()
 logging.basicConfig(level=logging.DEBUG,
                     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -78,8 +86,16 @@ def get_batch_sizes(max_batch_size):
         yield max_batch_size
 
 
+def parse_batch_profile(spec):
+    """Parses a "min:opt:max" batch size range, ex: "1:8:64" """
+    values = [int(value) for value in spec.split(":")]
+    if len(values) != 3 or not 1 <= values[0] <= values[1] <= values[2]:
+        raise ValueError("ERROR: Batch profile [{}] must be min:opt:max with 1 <= min <= opt <= max".format(spec))
+    return tuple(values)
+
+
 # TODO: This only covers dynamic shape for batch size, not dynamic shape for other dimensions
-def create_optimization_profiles(builder, inputs, batch_sizes=[1,8,16,32,64]): 
+def create_optimization_profiles(builder, inputs, batch_sizes=[1,8,16,32,64], batch_profiles=None): 
     # Check if all inputs are fixed explicit batch to create a single profile and avoid duplicates
     if all([inp.shape[0] > -1 for inp in inputs]):
         profile = builder.create_optimization_profile()
@@ -87,6 +103,19 @@ def create_optimization_profiles(builder, inputs, batch_sizes=[1,8,16,32,64]):
             fbs, shape = inp.shape[0], inp.shape[1:]
             profile.set_shape(inp.name, min=(fbs, *shape), opt=(fbs, *shape), max=(fbs, *shape))
             return [profile]
+
+    # One profile per (min, opt, max) batch range, tuned for its opt batch size
+    if batch_profiles:
+        profiles = []
+        for min_bs, opt_bs, max_bs in batch_profiles:
+            profile = builder.create_optimization_profile()
+            for inp in inputs:
+                shape = inp.shape[1:]
+                # Fixed explicit batch inputs keep their batch size
+                lo, opt, hi = [inp.shape[0]] * 3 if inp.shape[0] > -1 else (min_bs, opt_bs, max_bs)
+                profile.set_shape(inp.name, min=(lo, *shape), opt=(opt, *shape), max=(hi, *shape))
+            profiles.append(profile)
+        return profiles
     
     # Otherwise for mixed fixed+dynamic explicit batch inputs, create several profiles
     profiles = {}
@@ -123,10 +152,44 @@ def main():
     parser.add_argument("--calibration-data", help="(INT8 ONLY) The directory containing {*.jpg, *.jpeg, *.png} files to use for calibration. (ex: Imagenet Validation Set)", default=None)
     parser.add_argument("--calibration-batch-size", help="(INT8 ONLY) The batch size to use during calibration.", type=int, default=32)
     parser.add_argument("--max-calibration-size", help="(INT8 ONLY) The max number of data to calibrate on from --calibration-data.", type=int, default=512)
+    parser.add_argument("--calibration-selection", choices=("random", "kcenter", "stratified"), default="random", help="(INT8 ONLY) How to sample --max-calibration-size files from --calibration-data. See calibration_selection.py.")
+    parser.add_argument("--calibration-selection-cache", type=str, default=None, help="(INT8 ONLY) Directory to cache calibration selections in, by dataset fingerprint.")
+    parser.add_argument("--calibration-algo", choices=("entropy2", "entropy", "minmax", "legacy"), default="entropy2", help="(INT8 ONLY) TensorRT calibration algorithm. See calibrators.py.")
+    parser.add_argument("--calibration-quantile", type=float, default=0.9999, help="(INT8 legacy ONLY) Quantile of the activation histogram used as the dynamic range.")
+    parser.add_argument("--calibration-regression-cutoff", type=float, default=1.0, help="(INT8 legacy ONLY) Fraction of the activation histogram tail used by the regression.")
     parser.add_argument("-p", "--preprocess_func", type=str, default=None, help="(INT8 ONLY) Function defined in 'processing.py' to use for pre-processing calibration data.")
+    parser.add_argument("--calibration-inputs", nargs="+", default=None, help="(INT8 ONLY) Calibration input specs name:CxHxW[:layout[:preprocess_func]] for multiple input or NHWC models, ex: image:224x224x3:NHWC:preprocess_inception. Defaults to the network's input if its shape is static, else 3x224x224. See batch_assembler.py.")
+    parser.add_argument("--draft-decode", action="store_true", help="(INT8 ONLY) Decode calibration JPEGs at reduced resolution (PIL draft mode). See decode_benchmark.py for its speed and accuracy impact.")
+    parser.add_argument("--resize-filter", type=str, default=None, help="(INT8 ONLY) Resize filter for calibration images (nearest, box, bilinear, hamming, bicubic, lanczos). Defaults to the pre-processing function's filter.")
     parser.add_argument("-s", "--simple", action="store_true", help="Use SimpleCalibrator with random data instead of ImagenetCalibrator for INT8 calibration.")
+    parser.add_argument("--timing-cache", type=str, default=None, help="Path to a timing cache file to load before and merge into after building, to skip re-timing known tactics.")
+    parser.add_argument("--timing-cache-stats", type=str, default=None, help="(--timing-cache ONLY) Append per-build timing cache statistics as a JSON line to this file.")
+    parser.add_argument("--workspace-size", type=int, default=1024, help="Max builder workspace size in MiB.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16, 32, 64], help="(EXPLICIT BATCH ONLY) Batch sizes to create optimization profiles for.")
+    parser.add_argument("--batch-profiles", type=str, nargs="+", default=None, help="(EXPLICIT BATCH ONLY) Optimization profiles as min:opt:max batch sizes, ex: 1:8:64. Replaces --batch-sizes.")
+    parser.add_argument("--recipe", type=str, default=None, help="Build recipe (JSON) created by autotune.py. Arguments given on the command line override the recipe.")
+    parser.add_argument("--precision-plan", type=str, default=None, help="Per-layer precision plan (JSON) created by precision_plan.py. Implies --strict-types.")
+    parser.add_argument("--artifact-store", type=str, default=None, help="Also store the engine in this deduplicated artifact store, see artifact_store.py.")
+    parser.add_argument("--artifact-name", type=str, default=None, help="(--artifact-store ONLY) Name to store the engine under. Defaults to the --output file name.")
+    parser.add_argument("--artifact-codec", type=str, default=None, choices=["none", "zlib", "zstd", "lz4"], help="(--artifact-store ONLY) Chunk compression. Defaults to the best available.")
+    parser.add_argument("--metrics", type=str, default=None, help="Write parse/build/calibration/serialize timings to this file in Prometheus text format.")
+    parser.add_argument("--trace", type=str, default=None, help="Write the timed build steps to this file as a Chrome trace (chrome://tracing).")
     args, _ = parser.parse_known_args()
 
+    # Recipe values replace the defaults, then arguments are re-parsed so explicit ones still take priority
+    if args.recipe:
+        with open(args.recipe, "r") as f:
+            recipe = json.load(f)
+        logger.info("Using build recipe {:}: {:}".format(args.recipe, recipe["args"]))
+        parser.set_defaults(**recipe["args"])
+        args, _ = parser.parse_known_args()
+
+    if not 0 < args.calibration_quantile <= 1 or not 0 < args.calibration_regression_cutoff <= 1:
+        raise ValueError("ERROR: --calibration-quantile and --calibration-regression-cutoff must be in (0, 1]")
+
+    if args.metrics or args.trace:
+        metrics.enable()
+
     # Adjust logging verbosity
     if args.verbosity is None:
         TRT_LOGGER.min_severity = trt.Logger.Severity.ERROR
@@ -154,13 +217,21 @@ def main():
             'int8': trt.BuilderFlag.INT8,
     }
 
+    # Timing cache hits are counted from the builder's log messages
+    builder_logger = TRT_LOGGER
+    if args.timing_cache:
+        from timing_cache import TimingCacheFile, TimingCacheStats, create_counting_logger # local module
+        timing_cache_file = TimingCacheFile(args.timing_cache)
+        timing_cache_stats = TimingCacheStats()
+        builder_logger = create_counting_logger(TRT_LOGGER.min_severity, timing_cache_stats)
+
     # Building engine
-    with trt.Builder(TRT_LOGGER) as builder, \
+    with trt.Builder(builder_logger) as builder, \
          builder.create_network(network_flags) as network, \
          builder.create_builder_config() as config, \
          trt.OnnxParser(network, TRT_LOGGER) as parser:
             
-        config.max_workspace_size = 2**30 # 1GiB
+        config.max_workspace_size = args.workspace_size * 2**20 # MiB
 
         # Set Builder Config Flags
         for flag in builder_flag_map:
@@ -168,8 +239,13 @@ def main():
                 logger.info("Setting {}".format(builder_flag_map[flag]))
                 config.set_flag(builder_flag_map[flag])
 
+        use_timing_cache = False
+        if args.timing_cache:
+            from timing_cache import load_timing_cache # local module
+            use_timing_cache = load_timing_cache(config, timing_cache_file)
+
         # Fill network atrributes with information by parsing model
-        with open(args.onnx, "rb") as f:
+        with open(args.onnx, "rb") as f, metrics.timer("parse"):
             if not parser.parse(f.read()):
                 print('ERROR: Failed to parse the ONNX file: {}'.format(args.onnx))
                 for error in range(parser.num_errors):
@@ -181,10 +257,11 @@ def main():
 
         if args.explicit_batch:
             # Add optimization profiles
-            batch_sizes = [1, 8, 16, 32, 64]
             inputs = [network.get_input(i) for i in range(network.num_inputs)]
-            opt_profiles = create_optimization_profiles(builder, inputs, batch_sizes)
-            add_profiles(config, inputs, opt_profiles)
+            with metrics.timer("profile_setup"):
+                batch_profiles = [parse_batch_profile(spec) for spec in args.batch_profiles] if args.batch_profiles else None
+                opt_profiles = create_optimization_profiles(builder, inputs, args.batch_sizes, batch_profiles)
+                add_profiles(config, inputs, opt_profiles)
         # Implicit Batch Network
         else:
             builder.max_batch_size = args.max_batch_size
@@ -197,22 +274,99 @@ def main():
         if args.int8 and not builder.platform_has_fast_int8:
             logger.warning("INT8 not supported on this platform.")
 
+        if args.precision_plan:
+            from precision_plan import load_precision_plan, apply_precision_plan # local module
+            logger.info("Applying precision plan: {}".format(args.precision_plan))
+            used_precisions = apply_precision_plan(network, load_precision_plan(args.precision_plan))
+            if "fp16" in used_precisions and not args.fp16:
+                logger.warning("Precision plan uses FP16 layers, setting {}".format(trt.BuilderFlag.FP16))
+                config.set_flag(trt.BuilderFlag.FP16)
+            if "int8" in used_precisions and not args.int8:
+                logger.warning("Precision plan uses INT8 layers, but --int8 was not set. These layers will not run in INT8.")
+            # Layer precisions are only treated as constraints with strict types
+            if not args.strict_types:
+                logger.info("Setting {}".format(trt.BuilderFlag.STRICT_TYPES))
+                config.set_flag(trt.BuilderFlag.STRICT_TYPES)
+
         if args.int8:
             if args.simple:
-                from SimpleCalibrator import SimpleCalibrator # local module
-                config.int8_calibrator = SimpleCalibrator(network, config)
+                from SimpleCalibrator import get_simple_calibrator # local module
+                config.int8_calibrator = get_simple_calibrator(network, config, args.calibration_algo,
+                                                               quantile=args.calibration_quantile,
+                                                               regression_cutoff=args.calibration_regression_cutoff)
             else:
                 from ImagenetCalibrator import ImagenetCalibrator, get_int8_calibrator # local module
+                from batch_assembler import parse_input_spec, guess_input_spec # local module
+                calibration_inputs = None
+                if args.calibration_inputs:
+                    calibration_inputs = [parse_input_spec(spec, args.preprocess_func or "preprocess_imagenet")
+                                          for spec in args.calibration_inputs]
+                elif network.num_inputs == 1 and len(network.get_input(0).shape) == 4 and min(network.get_input(0).shape[1:]) > 0:
+                    calibration_inputs = [guess_input_spec(network.get_input(0).name, network.get_input(0).shape,
+                                                           args.preprocess_func or "preprocess_imagenet")]
                 config.int8_calibrator = get_int8_calibrator(args.calibration_cache,
                                                              args.calibration_data,
                                                              args.max_calibration_size,
                                                              args.preprocess_func,
-                                                             args.calibration_batch_size)
+                                                             args.calibration_batch_size,
+                                                             args.calibration_selection,
+                                                             args.calibration_selection_cache,
+                                                             args.calibration_algo,
+                                                             calibration_inputs,
+                                                             {"draft": args.draft_decode, "resize_filter": args.resize_filter},
+                                                             args.calibration_quantile,
+                                                             args.calibration_regression_cutoff)
 
         logger.info("Building Engine...")
-        with builder.build_engine(network, config) as engine, open(args.output, "wb") as f:
+        build_start = time.time()
+        with metrics.timer("build"):
+            engine = builder.build_engine(network, config)
+        with engine, open(args.output, "wb") as f:
+            build_time = time.time() - build_start
+            logger.info("Engine built in {:.2f}s".format(build_time))
             logger.info("Serializing engine to file: {:}".format(args.output))
-            f.write(engine.serialize())
+            with metrics.timer("serialize"):
+                serialized_engine = engine.serialize()
+                f.write(serialized_engine)
+            f.close()
+
+            # Sidecar metadata lets tools inspect the engine without deserializing it
+            from engine_metadata import get_engine_metadata, write_sidecar # local module
+            metadata = get_engine_metadata(engine, onnx_path=args.onnx, build_time=build_time,
+                                           builder_flags=[flag for flag in builder_flag_map if config.get_flag(builder_flag_map[flag])],
+                                           workspace_size=args.workspace_size,
+                                           precision_plan=args.precision_plan,
+                                           calibration_cache=args.calibration_cache if args.int8 else None)
+            write_sidecar(args.output, metadata)
+
+            if args.artifact_store:
+                # Deduplicates the engine's chunks against every other engine in the store
+                from artifact_store import ArtifactStore # local module
+                artifact_name = args.artifact_name or os.path.basename(args.output)
+                with metrics.timer("artifact_store"):
+                    manifest = ArtifactStore(args.artifact_store).put(
+                        artifact_name, serialized_engine, args.artifact_codec,
+                        dict(metadata, group=os.path.splitext(os.path.basename(args.onnx))[0]))
+                logger.info("Stored engine as [{:}] in {:}: {:.1f}MB written for a {:.1f}MB engine".format(
+                    artifact_name, args.artifact_store, manifest["written"]["bytes"] / 2**20, manifest["size"] / 2**20))
+
+            if args.refittable:
+                # Lets refit.py find which weights changed in a later model
+                from refit import write_weights_manifest # local module
+                write_weights_manifest(args.output, args.onnx)
+
+        if use_timing_cache:
+            from timing_cache import save_timing_cache, record_build_stats # local module
+            cache_size_before, cache_size_after = save_timing_cache(config, timing_cache_file)
+            stats = timing_cache_stats.summary()
+            logger.info("Timing cache stats: {:}".format(stats))
+            if args.timing_cache_stats:
+                record_build_stats(args.timing_cache_stats, onnx=args.onnx, engine=args.output, build_time=build_time,
+                                   cache_bytes_before=cache_size_before, cache_bytes_after=cache_size_after, **stats)
+
+    if metrics.enabled:
+        logger.info("Build timings: {:}".format(metrics.summary()))
+        metrics.write(args.metrics, args.trace)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import struct
+import logging
+import argparse
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ("fp32", "fp16", "int8")
+PLAN_VERSION = 1
+
+
+def read_calibration_cache_scales(filename):
+    """Parses a TensorRT calibration cache into a {tensor_name: scale} dict.
+
+    Each line after the header looks like "gpu_0/conv1_1: 3dd3d571", where the
+    value is the big-endian hex representation of a float32 scale.
+    """
+    scales = {}
+    with open(filename, "r") as f:
+        header = f.readline()
+        logger.debug("Calibration cache header: {:}".format(header.strip()))
+        for line in f:
+            name, _, value = line.strip().rpartition(":")
+            if name:
+                scales[name] = struct.unpack("!f", bytes.fromhex(value.strip()))[0]
+
+    return scales
+
+
+def simulate_int8(activations, scales):
+    """Fake-quantizes recorded FP32 activations with the per-tensor INT8 scales from a calibration cache.
+    Tensors without a scale are skipped."""
+    simulated = {}
+    for name, values in activations.items():
+        if name not in scales:
+            continue
+        scale = scales[name]
+        simulated[name] = np.clip(np.round(values / scale), -127, 127) * scale
+
+    return simulated
+
+
+def tensor_errors(reference, candidate):
+    """Per-tensor error of `candidate` activations relative to `reference` activations.
+
+    Parameters
+    ----------
+    reference: Dict[str, numpy.ndarray]
+        Activations recorded in the reference precision (usually FP32), by tensor name.
+    candidate: Dict[str, numpy.ndarray]
+        Activations of the same tensors recorded (or simulated) in the candidate precision.
+
+    Returns
+    -------
+    errors: Dict[str, Dict[str, float]]
+        For each tensor present in both, the normalized mean squared error ("nmse", error
+        energy relative to signal energy) and cosine similarity ("cosine").
+    """
+    errors = {}
+    for name in sorted(set(reference) & set(candidate)):
+        ref = np.asarray(reference[name], dtype=np.float64).ravel()
+        cand = np.asarray(candidate[name], dtype=np.float64).ravel()
+        if ref.shape != cand.shape:
+            logger.warning("Skipping [{:}], shape mismatch: {:} vs {:}".format(name, ref.shape, cand.shape))
+            continue
+
+        signal = np.dot(ref, ref)
+        noise = np.sum((ref - cand) ** 2)
+        cand_signal = np.dot(cand, cand)
+        norms = np.sqrt(signal * cand_signal)
+        if norms > 0:
+            cosine = float(np.dot(ref, cand) / norms)
+        else:
+            # Both zero agree, but a tensor that underflowed to zero (or came out of nothing) doesn't
+            cosine = 1.0 if signal == 0 and cand_signal == 0 else 0.0
+        errors[name] = {
+            "nmse": float(noise / signal) if signal > 0 else float(noise > 0),
+            "cosine": cosine,
+        }
+
+    return errors
+
+
+def tensor_producers(nodes, names):
+    """Maps each tensor in `names` to the tensors in `names` it is computed from: the inputs of the
+    node producing it, looking through tensors that weren't recorded (ex: inside fused layers).
+
+    Parameters
+    ----------
+    nodes: List[onnx.NodeProto]
+        Nodes of the graph the activations were recorded from, ex: onnx.load(path).graph.node
+    names: Iterable[str]
+        Names of the recorded tensors.
+    """
+    node_inputs = {}
+    for node in nodes:
+        for output in node.output:
+            node_inputs[output] = [name for name in node.input if name]
+
+    names = set(names)
+    producers = {}
+    for name in names:
+        found, seen, pending = set(), set(), list(node_inputs.get(name, []))
+        while pending:
+            tensor = pending.pop()
+            if tensor in seen:
+                continue
+            seen.add(tensor)
+            if tensor in names:
+                found.add(tensor)
+            else:
+                # Graph inputs and initializers have no producer and end the search
+                pending.extend(node_inputs.get(tensor, []))
+        producers[name] = sorted(found)
+
+    return producers
+
+
+def added_errors(errors, producers):
+    """Error each tensor adds over the tensors it is computed from, so a layer isn't blamed for the
+    error accumulated upstream when activations were recorded from an INT8 engine.
+
+    NMSE adds up approximately along a chain of layers, and so does the angle between reference
+    and candidate, so each tensor's "nmse" is reduced by the largest NMSE of its inputs and its
+    "cosine" is the cosine of its angle minus the largest angle of its inputs. The recorded values
+    are kept as "accumulated_nmse" and "accumulated_cosine".
+
+    Parameters
+    ----------
+    errors: Dict[str, Dict[str, float]]
+        As returned by `tensor_errors`.
+    producers: Dict[str, List[str]]
+        As returned by `tensor_producers`.
+    """
+    angles = {name: np.arccos(np.clip(error["cosine"], -1.0, 1.0)) for name, error in errors.items()}
+    added = {}
+    for name, error in errors.items():
+        inputs = [producer for producer in producers.get(name, []) if producer in errors]
+        input_nmse = max((errors[producer]["nmse"] for producer in inputs), default=0.0)
+        input_angle = max((angles[producer] for producer in inputs), default=0.0)
+        added[name] = {
+            "nmse": max(error["nmse"] - input_nmse, 0.0),
+            "cosine": float(np.cos(max(angles[name] - input_angle, 0.0))),
+            "accumulated_nmse": error["nmse"],
+            "accumulated_cosine": error["cosine"],
+        }
+
+    return added
+
+
+def rank_tensors(errors, metric="nmse"):
+    """Returns tensor names ordered from most to least sensitive."""
+    if metric == "cosine":
+        return sorted(errors, key=lambda name: errors[name]["cosine"])
+    return sorted(errors, key=lambda name: errors[name][metric], reverse=True)
+
+
+def create_precision_plan(errors, keep_count=None, keep_fraction=None, keep_precision="fp16",
+                          default_precision="int8", metric="nmse"):
+    """Creates a per-tensor precision plan from the errors returned by `tensor_errors`.
+
+    The `keep_count` most sensitive tensors (or `keep_fraction` of all tensors) are kept in
+    `keep_precision`, everything else is assigned `default_precision`.
+    """
+    if keep_precision not in PRECISIONS or default_precision not in PRECISIONS:
+        raise ValueError("ERROR: Precisions must be one of {:}".format(PRECISIONS))
+
+    ranking = rank_tensors(errors, metric)
+    if keep_count is None:
+        keep_count = int(np.ceil(len(ranking) * (keep_fraction or 0.0)))
+    keep = set(ranking[:keep_count])
+
+    layers = {}
+    for name in ranking:
+        precision = keep_precision if name in keep else default_precision
+        layers[name] = {"precision": precision, "output_type": precision}
+
+    return {
+        "version": PLAN_VERSION,
+        "metric": metric,
+        "default_precision": default_precision,
+        "layers": layers,
+        "ranking": [dict(name=name, **errors[name]) for name in ranking],
+    }
+
+
+def save_precision_plan(plan, filename):
+    with open(filename, "w") as f:
+        logger.info("Writing precision plan: {:}".format(filename))
+        json.dump(plan, f, indent=4)
+
+
+def load_precision_plan(filename):
+    with open(filename, "r") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError("ERROR: Unsupported precision plan version in {:}: {:}".format(filename, plan.get("version")))
+    return plan
+
+
+def apply_precision_plan(network, plan):
+    """Sets layer.precision and the layer output types from `plan` on a parsed network.
+
+    Plan entries are matched against layer names first, then against the names of the
+    layer's output tensors (activations are usually recorded by tensor name).
+
+    Returns
+    -------
+    precisions: Set[str]
+        The precisions used by the applied plan, so the caller can make sure the matching
+        builder flags are set.
+    """
+    import tensorrt as trt
+    dtypes = {"fp32": trt.float32, "fp16": trt.float16, "int8": trt.int8}
+
+    entries = plan["layers"]
+    used, applied = set(), 0
+    for i in range(network.num_layers):
+        layer = network.get_layer(i)
+        outputs = [layer.get_output(j) for j in range(layer.num_outputs)]
+        # Precision can only be constrained for layers producing floating point activations
+        if not outputs or any(out.dtype != trt.float32 for out in outputs):
+            continue
+
+        entry = entries.get(layer.name)
+        if entry is None:
+            entry = next((entries[out.name] for out in outputs if out.name in entries), None)
+        if entry is None:
+            continue
+
+        layer.precision = dtypes[entry["precision"]]
+        for j in range(layer.num_outputs):
+            layer.set_output_type(j, dtypes[entry.get("output_type", entry["precision"])])
+        used.add(entry["precision"])
+        applied += 1
+        logger.debug("Layer [{:}] set to {:}".format(layer.name, entry["precision"]))
+
+    logger.info("Applied precision plan to {:}/{:} layers".format(applied, network.num_layers))
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranks layers by INT8 sensitivity and writes a per-layer precision plan "
+                                                 "for onnx_to_tensorrt.py --precision-plan.")
+    parser.add_argument("--reference", required=True, help="NPZ file of reference (FP32) activations keyed by tensor name.")
+    parser.add_argument("--candidate", help="NPZ file of activations of the same tensors recorded from an INT8 engine.")
+    parser.add_argument("--onnx", help="(--candidate only) ONNX model the activations were recorded from. Tensors are "
+                                       "ranked by the error they add over their inputs, not the error accumulated upstream.")
+    parser.add_argument("--calibration-cache", help="Simulate INT8 activations from --reference using the scales in this "
+                                                    "calibration cache instead of using --candidate.")
+    parser.add_argument("-o", "--output", default="precision_plan.json", help="The path at which to write the precision plan.")
+    parser.add_argument("--keep-count", type=int, default=None, help="Number of most sensitive layers to keep in --keep-precision.")
+    parser.add_argument("--keep-fraction", type=float, default=0.1,
+                        help="Fraction of most sensitive layers to keep in --keep-precision, if --keep-count isn't set.")
+    parser.add_argument("--keep-precision", default="fp16", choices=PRECISIONS, help="Precision for the sensitive layers.")
+    parser.add_argument("--metric", default="nmse", choices=("nmse", "cosine"), help="Error metric to rank layers by.")
+    args = parser.parse_args()
+
+    reference = dict(np.load(args.reference))
+    if args.candidate:
+        if not args.onnx:
+            parser.error("--onnx is required with --candidate, to rank tensors by the error they add over their inputs")
+        candidate = dict(np.load(args.candidate))
+    elif args.calibration_cache:
+        candidate = simulate_int8(reference, read_calibration_cache_scales(args.calibration_cache))
+    else:
+        parser.error("One of --candidate or --calibration-cache is required")
+
+    errors = tensor_errors(reference, candidate)
+    if not errors:
+        raise Exception("ERROR: No tensors in common between the reference and candidate activations.")
+    # Simulated activations are each quantized from the FP32 ones, recorded ones carry the error of
+    # every layer before them
+    if args.candidate:
+        import onnx
+        errors = added_errors(errors, tensor_producers(onnx.load(args.onnx).graph.node, errors))
+
+    plan = create_precision_plan(errors, args.keep_count, args.keep_fraction, args.keep_precision, metric=args.metric)
+    for entry in plan["ranking"][:20]:
+        logger.info("{:<40} nmse={:.3e} cosine={:.6f} -> {:}".format(entry["name"], entry["nmse"], entry["cosine"],
+                                                                     plan["layers"][entry["name"]]["precision"]))
+    save_precision_plan(plan, args.output)
+
+
+if __name__ == "__main__":
+    main()
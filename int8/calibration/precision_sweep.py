@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+# onnx_to_tensorrt.py flags used to build each precision variant
+PRECISION_FLAGS = {
+    "fp32": [],
+    "fp16": ["--fp16"],
+    "int8": ["--fp16", "--int8"],
+}
+REFERENCE_PRECISION = "fp32"
+
+
+def load_labels(filename):
+    """Returns the list of class names in `filename`, where the line number is the class index.
+    (Same format as labels/imagenet1k_labels.txt)"""
+    with open(filename, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_ground_truth(filename, labels=None):
+    """Reads a held-out dataset description with one "<image_path> <label>" entry per line.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the ground truth file. Relative image paths are resolved against the directory
+        containing this file.
+    labels: List[str]
+        Class names as returned by `load_labels`. Required if any <label> is given by name
+        (ex: "great white shark") rather than by class index.
+
+    Returns
+    -------
+    files: List[str]
+        Image paths, in file order.
+    targets: numpy.ndarray
+        Class index for each image.
+    """
+    label_to_index = {name: i for i, name in enumerate(labels or [])}
+    root = os.path.dirname(os.path.abspath(filename))
+    files, targets = [], []
+    with open(filename, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            path, label = line.split(maxsplit=1)
+            if label.isdigit():
+                index = int(label)
+            elif label in label_to_index:
+                index = label_to_index[label]
+            else:
+                raise ValueError("ERROR: Unknown label [{:}] on line {:} of {:}".format(label, line_number, filename))
+
+            files.append(path if os.path.isabs(path) else os.path.join(root, path))
+            targets.append(index)
+
+    return files, np.array(targets, dtype=np.int64)
+
+
+def topk(outputs, k=5):
+    """Returns the indices of the `k` largest scores of each row of `outputs`, best first."""
+    outputs = outputs.reshape(outputs.shape[0], -1)
+    k = min(k, outputs.shape[1])
+    candidates = np.argpartition(-outputs, k-1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(outputs, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def evaluate_outputs(outputs, reference, targets=None, k=5):
+    """Compares the saved outputs of one engine variant against the reference (FP32) outputs.
+
+    Parameters
+    ----------
+    outputs: numpy.ndarray
+        Variant outputs of shape (N, num_classes).
+    reference: numpy.ndarray
+        Reference outputs of the same shape.
+    targets: numpy.ndarray
+        (Optional) Ground truth class index for each of the N samples.
+    k: int
+        Number of predictions to consider for the top-k metrics.
+
+    Returns
+    -------
+    metrics: Dict[str, float]
+    """
+    if outputs.shape != reference.shape:
+        raise ValueError("ERROR: Output shape {:} does not match reference shape {:}".format(outputs.shape, reference.shape))
+
+    outputs = outputs.reshape(outputs.shape[0], -1).astype(np.float32)
+    reference = reference.reshape(reference.shape[0], -1).astype(np.float32)
+    top_outputs = topk(outputs, k)
+    top_reference = topk(reference, k)
+    error = np.abs(outputs - reference)
+
+    metrics = {
+        "samples": int(outputs.shape[0]),
+        # Fraction of samples whose top-1 class matches the reference top-1
+        "top1_agreement": float(np.mean(top_outputs[:, 0] == top_reference[:, 0])),
+        # Fraction of samples whose reference top-1 class is in the variant's top-k
+        "top{}_agreement".format(k): float(np.mean(np.any(top_outputs == top_reference[:, :1], axis=1))),
+        "max_abs_error": float(error.max()),
+        "mean_abs_error": float(error.mean()),
+    }
+
+    if targets is not None:
+        metrics["top1_accuracy"] = float(np.mean(top_outputs[:, 0] == targets))
+        metrics["top{}_accuracy".format(k)] = float(np.mean(np.any(top_outputs == targets[:, None], axis=1)))
+
+    return metrics
+
+
+def pareto_front(results, cost="latency_ms", error="top1_agreement", higher_is_better=True):
+    """Returns the names of the variants in `results` that are not dominated by any other variant,
+    ie. no other variant is both at least as fast and at least as accurate (and strictly better in one).
+
+    Parameters
+    ----------
+    results: Dict[str, Dict[str, float]]
+        Metrics for each variant name.
+    cost: str
+        Metric to minimize.
+    error: str
+        Accuracy metric to trade off against `cost`.
+    higher_is_better: bool
+        Whether larger values of `error` are better (agreement/accuracy) or worse (error).
+    """
+    names = sorted(results)
+    costs = np.array([results[name][cost] for name in names], dtype=np.float64)
+    quality = np.array([results[name][error] for name in names], dtype=np.float64)
+    if not higher_is_better:
+        quality = -quality
+
+    # dominates[i, j] is True if variant i dominates variant j
+    no_worse = (costs[:, None] <= costs[None, :]) & (quality[:, None] >= quality[None, :])
+    better = (costs[:, None] < costs[None, :]) | (quality[:, None] > quality[None, :])
+    dominated = np.any(no_worse & better, axis=0)
+    return [name for name, is_dominated in zip(names, dominated) if not is_dominated]
+
+
+def format_table(results, front, k=5):
+    columns = ["latency_ms", "top1_agreement", "top{}_agreement".format(k), "max_abs_error", "mean_abs_error",
+               "top1_accuracy", "top{}_accuracy".format(k)]
+    columns = [c for c in columns if any(c in metrics for metrics in results.values())]
+    rows = ["{:<10} {:>7} ".format("variant", "pareto") + " ".join("{:>16}".format(c) for c in columns)]
+    for name in sorted(results, key=lambda n: results[n].get("latency_ms", 0)):
+        values = ["{:>16.6g}".format(results[name][c]) if c in results[name] else "{:>16}".format("-") for c in columns]
+        rows.append("{:<10} {:>7} ".format(name, "*" if name in front else "") + " ".join(values))
+
+    return "\n".join(rows)
+
+
+def build_variant(onnx, precision, engine_path, build_args=()):
+    """Builds one precision variant with onnx_to_tensorrt.py"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_to_tensorrt.py")
+    command = [sys.executable, script, "--onnx", onnx, "-o", engine_path] + PRECISION_FLAGS[precision] + list(build_args)
+    logger.info("Building {:} engine: {:}".format(precision, " ".join(command)))
+    subprocess.run(command, check=True)
+
+
+def run_variant(engine_path, files, preprocess_func, batch_size, warmup=5):
+    """Runs every file in `files` through the engine at `engine_path`.
+
+    Returns
+    -------
+    outputs: numpy.ndarray
+        First engine output for each file, shape (len(files), ...)
+    latency_ms: float
+        Median latency of one batch (H2D + execute + D2H) in milliseconds
+    """
+    import tensorrt as trt
+    import pycuda.driver as cuda
+    import pycuda.autoinit  # noqa: F401
+    from PIL import Image
+
+    with open(engine_path, "rb") as f, trt.Runtime(trt.Logger(trt.Logger.WARNING)) as runtime:
+        engine = runtime.deserialize_cuda_engine(f.read())
+    context = engine.create_execution_context()
+
+    if engine.has_implicit_batch_dimension:
+        # Binding shapes don't include the batch dimension, which is given to execute()
+        input_idx = [i for i in range(engine.num_bindings) if engine.binding_is_input(i)][0]
+        output_idx = [i for i in range(engine.num_bindings) if not engine.binding_is_input(i)][0]
+        batch_size = min(batch_size, engine.max_batch_size)
+        input_shape = (batch_size, *engine.get_binding_shape(input_idx))
+        output_shape = (batch_size, *engine.get_binding_shape(output_idx))
+        execute = lambda bindings: context.execute(batch_size, bindings)
+    else:
+        # Bindings of profile k are offset by k * bindings_per_profile
+        bindings_per_profile = engine.num_bindings // engine.num_optimization_profiles
+        input_idx = [i for i in range(bindings_per_profile) if engine.binding_is_input(i)][0]
+        output_idx = [i for i in range(bindings_per_profile) if not engine.binding_is_input(i)][0]
+        input_shape = tuple(engine.get_binding_shape(input_idx))
+        if input_shape[0] < 0:
+            # Like autotune.py, run on the first profile whose batch range covers batch_size
+            ranges = [engine.get_profile_shape(profile_index, profile_index * bindings_per_profile + input_idx)
+                      for profile_index in range(engine.num_optimization_profiles)]
+            profiles = [profile_index for profile_index, (kmin, _, kmax) in enumerate(ranges) if kmin[0] <= batch_size <= kmax[0]]
+            if not profiles:
+                raise ValueError("ERROR: No optimization profile of {:} accepts batch size {:}, profile batch ranges: {:}".format(
+                    engine_path, batch_size, [(kmin[0], kmax[0]) for kmin, _, kmax in ranges]))
+            context.active_optimization_profile = profiles[0]
+            input_idx += profiles[0] * bindings_per_profile
+            output_idx += profiles[0] * bindings_per_profile
+            input_shape = (batch_size, *input_shape[1:])
+            if not context.set_binding_shape(input_idx, input_shape):
+                raise RuntimeError("ERROR: Failed to set input shape {:} on profile {:}".format(input_shape, profiles[0]))
+        if not context.all_binding_shapes_specified:
+            raise RuntimeError("ERROR: Not all input shapes of {:} are specified".format(engine_path))
+        output_shape = tuple(context.get_binding_shape(output_idx))
+        execute = context.execute_v2
+    batch_size = input_shape[0]
+
+    host_input = np.zeros(input_shape, dtype=np.float32)
+    host_output = np.empty(output_shape, dtype=np.float32)
+    device_input = cuda.mem_alloc(host_input.nbytes)
+    device_output = cuda.mem_alloc(host_output.nbytes)
+    bindings = [0] * engine.num_bindings
+    bindings[input_idx], bindings[output_idx] = int(device_input), int(device_output)
+
+    outputs = np.empty((len(files), *host_output.shape[1:]), dtype=np.float32)
+    timings = []
+    for index in range(0, len(files), batch_size):
+        batch_files = files[index:index+batch_size]
+        for offset, filename in enumerate(batch_files):
+            host_input[offset] = preprocess_func(Image.open(filename), *input_shape[1:])
+        # Repeat the last image to fill a partial final batch, the extra outputs are discarded
+        host_input[len(batch_files):] = host_input[len(batch_files)-1]
+
+        start = time.perf_counter()
+        cuda.memcpy_htod(device_input, host_input)
+        execute(bindings)
+        cuda.memcpy_dtoh(host_output, device_output)
+        timings.append(time.perf_counter() - start)
+
+        outputs[index:index+len(batch_files)] = host_output[:len(batch_files)]
+        logger.debug("{:} - Processed {:}/{:}".format(engine_path, index+len(batch_files), len(files)))
+
+    # Ignore the first few batches, which include lazy initialization
+    timings = timings[warmup:] if len(timings) > warmup else timings
+    return outputs, 1000 * float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds FP32/FP16/INT8 variants of an ONNX model and compares their "
+                                                 "accuracy against FP32 and their latency.")
+    parser.add_argument("--onnx", help="The ONNX model to build variants of. Not needed with --evaluate-only.")
+    parser.add_argument("--ground-truth", required=True,
+                        help="File of '<image_path> <label>' lines, where <label> is a class index or a name from --labels.")
+    parser.add_argument("--labels", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "labels", "imagenet1k_labels.txt"),
+                        help="Class names, one per line. Line number is the class index.")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "fp16", "int8"], choices=sorted(PRECISION_FLAGS),
+                        help="Precision variants to build and evaluate.")
+    parser.add_argument("--output-dir", default="sweep", help="Directory to write engines, saved outputs and results to.")
+    parser.add_argument("-b", "--batch-size", type=int, default=32, help="Batch size to use for dynamic shape engines.")
+    parser.add_argument("-k", "--top-k", type=int, default=5, help="k for the top-k agreement/accuracy metrics.")
+    parser.add_argument("-p", "--preprocess_func", type=str, default="preprocess_imagenet",
+                        help="Function defined in 'processing.py' to use for pre-processing the dataset.")
+    parser.add_argument("--evaluate-only", action="store_true",
+                        help="Skip building/inference and evaluate the outputs already saved in --output-dir.")
+    # Any other arguments (ex: --explicit-batch, --calibration-cache) are passed through to onnx_to_tensorrt.py
+    args, build_args = parser.parse_known_args()
+
+    if REFERENCE_PRECISION not in args.precisions:
+        args.precisions.insert(0, REFERENCE_PRECISION)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    labels = load_labels(args.labels)
+    files, targets = load_ground_truth(args.ground_truth, labels)
+    logger.info("Evaluating on {:} labeled images from {:}".format(len(files), args.ground_truth))
+
+    latencies = {}
+    latency_file = os.path.join(args.output_dir, "latency.json")
+    if os.path.exists(latency_file):
+        with open(latency_file, "r") as f:
+            latencies = json.load(f)
+
+    if not args.evaluate_only:
+        if not args.onnx:
+            parser.error("--onnx is required unless --evaluate-only is set")
+
+        import processing
+        preprocess_func = getattr(processing, args.preprocess_func)
+        for precision in args.precisions:
+            engine_path = os.path.join(args.output_dir, "model.{}.engine".format(precision))
+            build_variant(args.onnx, precision, engine_path, build_args)
+            outputs, latencies[precision] = run_variant(engine_path, files, preprocess_func, args.batch_size)
+            np.save(os.path.join(args.output_dir, "outputs.{}.npy".format(precision)), outputs)
+            logger.info("{:} - median batch latency: {:.3f} ms".format(precision, latencies[precision]))
+
+        with open(latency_file, "w") as f:
+            json.dump(latencies, f, indent=4, sort_keys=True)
+
+    # Everything below only needs the saved outputs, so it can be re-run on CPU
+    reference = np.load(os.path.join(args.output_dir, "outputs.{}.npy".format(REFERENCE_PRECISION)), mmap_mode="r")
+    results = {}
+    for precision in args.precisions:
+        outputs = np.load(os.path.join(args.output_dir, "outputs.{}.npy".format(precision)), mmap_mode="r")
+        results[precision] = evaluate_outputs(outputs, reference, targets, k=args.top_k)
+        if precision in latencies:
+            results[precision]["latency_ms"] = latencies[precision]
+
+    if all("latency_ms" in metrics for metrics in results.values()):
+        front = pareto_front(results, cost="latency_ms", error="top1_agreement")
+    else:
+        logger.warning("Latency missing for some variants, skipping Pareto front.")
+        front = []
+
+    print(format_table(results, front, k=args.top_k))
+    with open(os.path.join(args.output_dir, "results.json"), "w") as f:
+        json.dump({"variants": results, "pareto_front": front}, f, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
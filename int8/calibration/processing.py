@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 import logging
+import functools
 
 import numpy as np
 from PIL import Image
@@ -23,8 +25,51 @@ logging.basicConfig(level=logging.DEBUG,
                     datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger(__name__)
 
+# Resampling filters for resizing images (ANTIALIAS is an alias of LANCZOS)
+RESIZE_FILTERS = {
+    "nearest": Image.NEAREST,
+    "box": Image.BOX,
+    "bilinear": Image.BILINEAR,
+    "hamming": Image.HAMMING,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+}
 
-def preprocess_imagenet(image, channels=3, height=224, width=224):
+
+def get_preprocess_func(name, draft=False, resize_filter=None):
+    """Returns the pre-processing function called `name` in this file, with the given decode options.
+
+    Parameters
+    ----------
+    name: str
+        Name of the pre-processing function, ex: "preprocess_imagenet"
+    draft: bool
+        Decode JPEGs at reduced resolution, see resize().
+    resize_filter: str
+        One of RESIZE_FILTERS, instead of the function's default filter.
+    """
+    preprocess_func = getattr(sys.modules[__name__], name)
+    options = {}
+    if draft:
+        options["draft"] = True
+    if resize_filter:
+        options["resize_filter"] = resize_filter
+    return functools.partial(preprocess_func, **options) if options else preprocess_func
+
+
+def resize(image, height, width, resize_filter="bilinear", draft=False):
+    """Resizes an image to (height, width).
+
+    With `draft`, JPEGs are decoded directly at the smallest of 1/1, 1/2, 1/4 or 1/8 scale that
+    is still at least (height, width), by skipping DCT coefficients, which is much faster for large
+    photos. This has no effect on images that are already loaded or aren't JPEGs.
+    """
+    if draft:
+        image.draft(image.mode, (width, height))
+    return image.resize((width, height), RESIZE_FILTERS[resize_filter])
+
+
+def preprocess_imagenet(image, channels=3, height=224, width=224, draft=False, resize_filter="lanczos"):
     """Pre-processing for Imagenet-based Image Classification Models:
         resnet50, vgg16, mobilenet, etc. (Doesn't seem to work for Inception)
 
@@ -38,6 +83,10 @@ def preprocess_imagenet(image, channels=3, height=224, width=224):
         The desired height of the image (usually 224 for Imagenet data)
     width: int
         The desired width of the image  (usually 224 for Imagenet data)
+    draft: bool
+        Decode JPEGs at reduced resolution before resizing, see resize().
+    resize_filter: str
+        One of RESIZE_FILTERS.
 
     Returns
     -------
@@ -46,7 +95,7 @@ def preprocess_imagenet(image, channels=3, height=224, width=224):
 
     """
     # Get the image in CHW format
-    resized_image = image.resize((width, height), Image.ANTIALIAS)
+    resized_image = resize(image, height, width, resize_filter, draft)
     img_data = np.asarray(resized_image).astype(np.float32)
 
     if len(img_data.shape) == 2:
@@ -67,7 +116,7 @@ def preprocess_imagenet(image, channels=3, height=224, width=224):
     return img_data
 
 
-def preprocess_inception(image, channels=3, height=224, width=224):
+def preprocess_inception(image, channels=3, height=224, width=224, draft=False, resize_filter="bilinear"):
     """Pre-processing for InceptionV1. Inception expects different pre-processing
     than {resnet50, vgg16, mobilenet}. This may not be totally correct,
     but it worked for some simple test images.
@@ -82,6 +131,10 @@ def preprocess_inception(image, channels=3, height=224, width=224):
         The desired height of the image (usually 224 for Imagenet data)
     width: int
         The desired width of the image  (usually 224 for Imagenet data)
+    draft: bool
+        Decode JPEGs at reduced resolution before resizing, see resize().
+    resize_filter: str
+        One of RESIZE_FILTERS.
 
     Returns
     -------
@@ -90,7 +143,7 @@ def preprocess_inception(image, channels=3, height=224, width=224):
 
     """
     # Get the image in CHW format
-    resized_image = image.resize((width, height), Image.BILINEAR)
+    resized_image = resize(image, height, width, resize_filter, draft)
     img_data = np.asarray(resized_image).astype(np.float32)
 
     if len(img_data.shape) == 2:
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def _first(inputs, attributes):
+    return inputs[0]
+
+
+def _fully_connected_kernel(inputs, attributes):
+    # FullyConnected kernels are (outputs, inputs), like Gemm's B with transB=1
+    return inputs[0] if attributes.get("transB", 0) else inputs[0].T
+
+
+def _batchnorm_scale(inputs, attributes):
+    scale, _, _, var = [np.asarray(array, dtype=np.float32) for array in inputs]
+    return scale / np.sqrt(var + attributes.get("epsilon", 1e-5))
+
+
+def _batchnorm_shift(inputs, attributes):
+    _, bias, mean, _ = [np.asarray(array, dtype=np.float32) for array in inputs]
+    return bias - mean * _batchnorm_scale(inputs, attributes)
+
+
+# Refittable layer weights TensorRT 7's ONNX parser creates from each op's initializers:
+# {role: (input indices, function computing the layer weights from those inputs and the node's attributes)}
+# BatchNormalization is folded into a Scale layer, and Gemm becomes a FullyConnected layer when
+# alpha = beta = 1 and transA = 0. Other ops' weights (ex: MatMul's) live in Constant layers that
+# can't be mapped back to initializers, so changing them requires a rebuild.
+# TensorRT 8 refits by initializer name instead (Refitter.set_named_weights).
+LAYER_WEIGHT_ROLES = {
+    "Conv": {"KERNEL": ([1], _first), "BIAS": ([2], _first)},
+    "ConvTranspose": {"KERNEL": ([1], _first), "BIAS": ([2], _first)},
+    "Gemm": {"KERNEL": ([1], _fully_connected_kernel), "BIAS": ([2], _first)},
+    "BatchNormalization": {"SCALE": ([1, 2, 3, 4], _batchnorm_scale), "SHIFT": ([1, 2, 3, 4], _batchnorm_shift)},
+}
+
+
+def manifest_path(engine_path):
+    """The weights of "model.engine" are recorded in "model.engine.weights.json" """
+    return engine_path + ".weights.json"
+
+
+def load_initializers(onnx_path):
+    """Returns the initializers of an ONNX model as a {name: numpy.ndarray} dict."""
+    import onnx
+    from onnx import numpy_helper
+
+    model = onnx.load(onnx_path)
+    return {initializer.name: numpy_helper.to_array(initializer) for initializer in model.graph.initializer}
+
+
+def weight_digests(weights):
+    """Shape, dtype and content hash of each weight, as recorded in the weights manifest."""
+    digests = {}
+    for name, array in weights.items():
+        array = np.ascontiguousarray(array)
+        digests[name] = {
+            "shape": list(array.shape),
+            "dtype": array.dtype.name,
+            "sha256": hashlib.sha256(array.tobytes()).hexdigest(),
+        }
+    return digests
+
+
+def write_weights_manifest(engine_path, onnx_path, weights=None):
+    """Records the weights an engine was built with, so later models can be diffed against them."""
+    weights = load_initializers(onnx_path) if weights is None else weights
+    path = manifest_path(engine_path)
+    manifest = {
+        "manifest_version": MANIFEST_VERSION,
+        "onnx": os.path.abspath(onnx_path),
+        "weights": weight_digests(weights),
+    }
+    with open(path, "w") as f:
+        logger.info("Writing weights manifest: {:}".format(path))
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    return path
+
+
+def read_weights_manifest(engine_path):
+    with open(manifest_path(engine_path), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("manifest_version") != MANIFEST_VERSION:
+        raise ValueError("ERROR: Unsupported weights manifest version: {:}".format(manifest.get("manifest_version")))
+    return manifest
+
+
+def diff_weights(recorded, current):
+    """Compares the weight digests recorded at build time with those of a new model.
+
+    Returns
+    -------
+    diff: dict
+        "changed": names with new values but the same shape and dtype (refittable)
+        "incompatible": names whose shape or dtype changed
+        "added", "removed": names only in the new or recorded weights
+    """
+    changed, incompatible = [], []
+    for name in sorted(set(recorded) & set(current)):
+        old, new = recorded[name], current[name]
+        if old["shape"] != new["shape"] or old["dtype"] != new["dtype"]:
+            incompatible.append(name)
+        elif old["sha256"] != new["sha256"]:
+            changed.append(name)
+    return {
+        "changed": changed,
+        "incompatible": incompatible,
+        "added": sorted(set(current) - set(recorded)),
+        "removed": sorted(set(recorded) - set(current)),
+    }
+
+
+def layer_weight_targets(nodes):
+    """Finds the refittable layer weights TensorRT 7's ONNX parser creates from initializers,
+    for the ops in LAYER_WEIGHT_ROLES. Layers are named after their node, or its first output
+    if the node has no name.
+
+    Parameters
+    ----------
+    nodes: List[onnx.NodeProto]
+        Nodes of the graph, ex: onnx.load(path).graph.node
+
+    Returns
+    -------
+    targets: Dict[Tuple[str, str], Tuple[List[str], Callable, dict]]
+        (layer name, role) -> (input names, function computing the weights, node attributes)
+    """
+    from onnx import helper
+
+    targets = {}
+    for node in nodes:
+        roles = LAYER_WEIGHT_ROLES.get(node.op_type)
+        if not roles:
+            continue
+        attributes = {attribute.name: helper.get_attribute_value(attribute) for attribute in node.attribute}
+        if node.op_type == "Gemm" and (attributes.get("alpha", 1.0) != 1.0 or attributes.get("beta", 1.0) != 1.0
+                                       or attributes.get("transA", 0)):
+            continue
+        layer_name = node.name or node.output[0]
+        for role, (indices, convert) in roles.items():
+            if all(index < len(node.input) and node.input[index] for index in indices):
+                targets[(layer_name, role)] = ([node.input[index] for index in indices], convert, attributes)
+    return targets
+
+
+def unmapped_weights(names, targets):
+    """Names of the initializers that aren't used by any of `targets` (see layer_weight_targets()),
+    which TensorRT 7 can't refit."""
+    mapped = {name for inputs, _, _ in targets.values() for name in inputs}
+    return [name for name in names if name not in mapped]
+
+
+def target_weights(target, weights):
+    """Computes the layer weights of one of layer_weight_targets()'s targets from the initializers."""
+    inputs, convert, attributes = target
+    return np.ascontiguousarray(convert([weights[name] for name in inputs], attributes))
+
+
+def refit_engine(engine, weights, names, trt_logger, targets=None):
+    """Pushes the `names` weights (and any others the refitter requires along with them) into
+    a refittable engine.
+
+    Parameters
+    ----------
+    engine: tensorrt.ICudaEngine
+    weights: Dict[str, numpy.ndarray]
+        All initializers of the new model.
+    names: List[str]
+        Initializers to update.
+    trt_logger: tensorrt.ILogger
+    targets: Dict[Tuple[str, str], Tuple[List[str], Callable, dict]]
+        (TensorRT 7 ONLY) Layer weights computed from initializers, see layer_weight_targets().
+
+    Returns
+    -------
+    refitted: List[str]
+        Names of the weights (TensorRT 8) or "layer:role" layer weights (TensorRT 7) that were set.
+    """
+    import tensorrt as trt
+
+    refitter = trt.Refitter(engine, trt_logger)
+    # The refitter only keeps pointers, the arrays must outlive refit_cuda_engine()
+    arrays = {}
+
+    if hasattr(refitter, "set_named_weights"):
+        def set_weights(name):
+            arrays[name] = np.ascontiguousarray(weights[name])
+            if not refitter.set_named_weights(name, arrays[name]):
+                raise RuntimeError("ERROR: Failed to set refit weights [{:}]".format(name))
+
+        for name in names:
+            set_weights(name)
+        # Layers may need all of their weights, even the unchanged ones
+        for name in list(refitter.get_missing_weights()):
+            set_weights(name)
+    else:
+        unmapped = unmapped_weights(names, targets)
+        if unmapped:
+            raise ValueError("ERROR: With TensorRT 7, these weights don't map to refittable layer weights, "
+                             "rebuild the engine instead: {:}".format(", ".join(unmapped)))
+
+        def set_weights(key):
+            layer_name, role = key
+            arrays["{}:{}".format(layer_name, role)] = array = target_weights(targets[key], weights)
+            if not refitter.set_weights(layer_name, getattr(trt.WeightsRole, role), array):
+                raise RuntimeError("ERROR: Failed to set refit weights {:} of layer [{:}], the engine may not have "
+                                   "this layer (ex: the parser didn't fold it), rebuild the engine instead.".format(role, layer_name))
+
+        changed = set(names)
+        for key, (inputs, _, _) in targets.items():
+            if changed.intersection(inputs):
+                set_weights(key)
+        layer_names, roles = refitter.get_missing()
+        missing = [(layer_name, str(role).split(".")[-1]) for layer_name, role in zip(layer_names, roles)]
+        unknown = [key for key in missing if key not in targets]
+        if unknown:
+            raise ValueError("ERROR: Refitter requires weights that don't map to initializers: {:}".format(unknown))
+        for key in missing:
+            set_weights(key)
+
+    if not refitter.refit_cuda_engine():
+        raise RuntimeError("ERROR: Failed to refit engine.")
+    return list(arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Updates the weights of an engine built with onnx_to_tensorrt.py --refittable "
+                                                 "from a new ONNX model, without rebuilding it.")
+    parser.add_argument("-e", "--engine", required=True, type=str, help="Refittable TensorRT engine to update.")
+    parser.add_argument("--onnx", required=True, type=str, help="ONNX model with the new weights (same architecture).")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Path to write the refitted engine to. Defaults to --engine.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which weights changed.")
+    args = parser.parse_args()
+
+    output = args.output or args.engine
+    manifest = read_weights_manifest(args.engine)
+    weights = load_initializers(args.onnx)
+    diff = diff_weights(manifest["weights"], weight_digests(weights))
+    logger.info("{:} changed, {:} incompatible, {:} added, {:} removed weights".format(
+        len(diff["changed"]), len(diff["incompatible"]), len(diff["added"]), len(diff["removed"])))
+    if diff["incompatible"] or diff["added"] or diff["removed"]:
+        raise ValueError("ERROR: The model architecture changed ({:}), rebuild the engine instead.".format(
+            ", ".join(diff["incompatible"] + diff["added"] + diff["removed"])[:500]))
+
+    import onnx
+    targets = layer_weight_targets(onnx.load(args.onnx).graph.node)
+    unmapped = unmapped_weights(diff["changed"], targets)
+    if unmapped:
+        logger.warning("With TensorRT 7, {:} changed weights can't be refitted and need a rebuild: {:}".format(
+            len(unmapped), ", ".join(unmapped)[:500]))
+    if args.dry_run:
+        print("\n".join(diff["changed"]))
+        return
+    if not diff["changed"]:
+        logger.info("No weights changed, nothing to refit.")
+        return
+
+    import tensorrt as trt
+    TRT_LOGGER = trt.Logger()
+
+    with open(args.engine, "rb") as f, trt.Runtime(TRT_LOGGER) as runtime:
+        engine = runtime.deserialize_cuda_engine(f.read())
+
+    refit_start = time.time()
+    refitted = refit_engine(engine, weights, diff["changed"], TRT_LOGGER, targets)
+    refit_time = time.time() - refit_start
+    logger.info("Refitted {:} weights in {:.2f}s".format(len(refitted), refit_time))
+
+    with open(output, "wb") as f:
+        logger.info("Serializing engine to file: {:}".format(output))
+        f.write(engine.serialize())
+    write_weights_manifest(output, args.onnx, weights)
+
+    from engine_metadata import read_sidecar, write_sidecar, file_sha256 # local module
+    try:
+        metadata = read_sidecar(args.engine)
+    except FileNotFoundError:
+        metadata = None
+    if metadata:
+        build_time = metadata["build"].get("build_time")
+        if build_time:
+            logger.info("Refit took {:.2f}s vs {:.2f}s for a full build ({:.1f}x faster)".format(
+                refit_time, build_time, build_time / max(refit_time, 1e-9)))
+        metadata["onnx"] = {"path": os.path.abspath(args.onnx), "sha256": file_sha256(args.onnx)}
+        metadata["refit"] = {"refit_time": refit_time, "weights": len(refitted), "timestamp": time.time()}
+        write_sidecar(output, metadata)
+
+
+if __name__ == "__main__":
+    main()
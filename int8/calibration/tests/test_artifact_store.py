@@ -0,0 +1,197 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+
+import numpy as np
+import pytest
+
+from artifact_store import ArtifactStore, chunk_boundaries
+
+CHUNKING = {"min_size": 256, "avg_size": 1024, "max_size": 4096}
+
+
+def random_bytes(size, seed):
+    return np.random.RandomState(seed).randint(0, 256, size=size, dtype=np.uint8).tobytes()
+
+
+def chunks(data, boundaries):
+    return [data[start:end] for start, end in zip([0] + boundaries[:-1], boundaries)]
+
+
+def set_created(store, name, created):
+    path = store.manifest_path(name)
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    manifest["created"] = created
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / "store"), CHUNKING)
+
+
+@pytest.mark.parametrize("size", [0, 1, 255, 4096, 4097, 100000])
+def test_chunk_sizes_are_bounded(size):
+    boundaries = chunk_boundaries(random_bytes(size, seed=size), block_size=4096, **CHUNKING)
+    assert boundaries == sorted(set(boundaries))
+    assert (boundaries[-1] if boundaries else 0) == size
+    sizes = np.diff([0] + boundaries)
+    assert (sizes <= CHUNKING["max_size"]).all()
+    # Only the last chunk can be shorter than min_size
+    assert (sizes[:-1] >= CHUNKING["min_size"]).all()
+
+
+def test_chunks_are_independent_of_hash_block_size():
+    data = random_bytes(50000, seed=1)
+    assert chunk_boundaries(data, block_size=1000, **CHUNKING) == chunk_boundaries(data, block_size=2**16, **CHUNKING)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_region_shared_near_the_end_is_deduplicated(seed):
+    # Identical weights between headers and kernels of different lengths, ending less than
+    # max_size from the end: they must be cut by content all the way, or the last max_size bytes
+    # end up in a single chunk that also holds the variant's kernels
+    chunking = {"min_size": 64, "avg_size": 256, "max_size": 4096}
+    shared = random_bytes(6 * chunking["max_size"], seed=seed)
+    first = random_bytes(1000, seed=seed + 100) + shared + random_bytes(500, seed=seed + 200)
+    second = random_bytes(3333, seed=seed + 300) + shared + random_bytes(900, seed=seed + 400)
+
+    shared_chunks = set(chunks(first, chunk_boundaries(first, **chunking))) & \
+        set(chunks(second, chunk_boundaries(second, **chunking)))
+    # Only the chunks straddling the start and the end of the shared region differ
+    assert len(shared) - sum(len(chunk) for chunk in shared_chunks) < chunking["max_size"] // 4
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+@pytest.mark.parametrize("size", [0, 10, 50000])
+def test_round_trip(store, codec, size):
+    # Half random, half compressible, so both raw and compressed chunks are stored
+    data = random_bytes(size // 2, seed=5) + bytes(size - size // 2)
+    manifest = store.put("engine", data, codec=codec, metadata={"group": "resnet50"})
+    assert manifest["size"] == size and manifest["metadata"] == {"group": "resnet50"}
+    assert sum(size for _, size in manifest["chunks"]) == size
+
+    for num_threads in (1, 4):
+        out = store.get("engine", num_threads=num_threads)
+        assert isinstance(out, bytearray) and out == data
+    assert store.names() == ["engine"]
+
+
+def test_corrupted_chunk_is_detected(store):
+    manifest = store.put("engine", random_bytes(20000, seed=6), codec="none")
+    digest = manifest["chunks"][1][0]
+    with open(store.chunk_path(digest), "r+b") as f:
+        f.seek(10)
+        f.write(b"\xff\x00")
+    with pytest.raises(IOError):
+        store.get("engine")
+
+
+def test_variants_share_chunks(store):
+    weights = random_bytes(20 * CHUNKING["max_size"], seed=7)
+    variants = {"variant_{}".format(i): random_bytes(500 + 700 * i, seed=10 + i) + weights + random_bytes(3000, seed=20 + i)
+                for i in range(3)}
+    written = [store.put(name, data, codec="none")["written"]["bytes"] for name, data in variants.items()]
+    # Later variants only write their own header and kernels, plus the chunks around them
+    assert all(bytes_written < len(weights) // 4 for bytes_written in written[1:])
+
+    stats = store.stats()
+    assert stats["artifacts"] == 3
+    assert stats["logical_bytes"] == sum(len(data) for data in variants.values())
+    assert stats["dedup_ratio"] > 2.5
+    for name, data in variants.items():
+        assert store.get(name) == data
+
+    # Storing the same engine again writes nothing
+    assert store.put("variant_0", variants["variant_0"], codec="none")["written"] == {"chunks": 0, "bytes": 0}
+
+
+def test_invalid_names_are_rejected(store):
+    for name in ["../engine", "", ".hidden", "a/b"]:
+        with pytest.raises(ValueError):
+            store.put(name, b"data")
+
+
+@pytest.fixture
+def versions(store):
+    """Three versions of two groups, sharing some chunks, created at increasing times."""
+    base = random_bytes(8 * CHUNKING["max_size"], seed=30)
+    data = {}
+    for i in range(3):
+        for group in ("resnet50", "bert"):
+            name = "{}_v{}".format(group, i)
+            data[name] = random_bytes(5000, seed=40 + 10 * i + len(group)) + base
+            store.put(name, data[name], codec="none", metadata={"group": group})
+            set_created(store, name, 1000 + i)
+    return data
+
+
+def chunk_files(store):
+    return sorted(filename for _, _, filenames in os.walk(store.chunks_dir) for filename in filenames)
+
+
+def test_gc_keep_last_per_group(store, versions):
+    result = store.gc(keep_last=1)
+    assert result["removed_artifacts"] == ["bert_v0", "bert_v1", "resnet50_v0", "resnet50_v1"]
+    assert store.names() == ["bert_v2", "resnet50_v2"]
+    # Chunks of removed versions are freed, those still used are kept
+    assert result["removed_chunks"] > 0 and result["freed_bytes"] > 0
+    remaining = {digest for name in store.names() for digest, _ in store.manifest(name)["chunks"]}
+    assert set(chunk_files(store)) == remaining
+    for name in store.names():
+        assert store.get(name) == versions[name]
+
+
+def test_gc_keeps_pinned(store, versions):
+    result = store.gc(keep_last=1, pinned=["resnet50_v0"])
+    assert "resnet50_v0" not in result["removed_artifacts"]
+    assert store.names() == ["bert_v2", "resnet50_v0", "resnet50_v2"]
+    assert store.get("resnet50_v0") == versions["resnet50_v0"]
+
+
+def test_gc_dry_run_removes_nothing(store, versions):
+    names, files = store.names(), chunk_files(store)
+    dry_run = store.gc(keep_last=2, dry_run=True)
+    assert dry_run["removed_artifacts"] == ["bert_v0", "resnet50_v0"] and dry_run["removed_chunks"] > 0
+    assert store.names() == names and chunk_files(store) == files
+    # A real run removes exactly what the dry run reported
+    assert store.gc(keep_last=2) == dry_run
+
+
+def test_gc_max_age_uses_last_access(store, versions):
+    old = time.time() - 10 * 86400
+    for name in store.names():
+        os.utime(store.manifest_path(name), (old, old))
+    store.get("bert_v0")
+    assert store.gc(max_age_days=5)["removed_artifacts"] == [name for name in sorted(versions) if name != "bert_v0"]
+    assert store.names() == ["bert_v0"]
+
+
+def test_gc_removes_unreferenced_chunks(store, versions):
+    store.remove("bert_v1")
+    leftover = os.path.join(store.chunks_dir, "ab", ".tmp.interrupted")
+    os.makedirs(os.path.dirname(leftover), exist_ok=True)
+    with open(leftover, "wb") as f:
+        f.write(b"partial")
+    result = store.gc()
+    assert result["removed_artifacts"] == []
+    assert result["removed_chunks"] >= 2
+    assert not os.path.exists(leftover)
+    for name in store.names():
+        assert store.get(name) == versions[name]
@@ -0,0 +1,90 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import pytest
+
+from autotune import candidate_space, candidate_name, covers, successive_halving
+
+
+class SyntheticCost:
+    """Cost model standing in for build + benchmark: a fixed cost per candidate, inf for failed builds."""
+
+    def __init__(self, costs, failing=()):
+        self.costs = costs
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, candidate, budget):
+        name = candidate["name"]
+        self.calls.append((name, budget))
+        if name in self.failing:
+            return math.inf
+        return self.costs[name]
+
+
+def test_budget_grows_and_survivors_shrink_each_round():
+    candidates = [{"name": "c{}".format(i)} for i in range(8)]
+    measure = SyntheticCost({"c{}".format(i): 10.0 + i for i in range(8)})
+    best, best_cost, history = successive_halving(candidates, measure, min_budget=5, eta=2)
+
+    rounds = sorted({entry["round"] for entry in history})
+    assert rounds == [0, 1, 2, 3]
+    for round_index in rounds:
+        entries = [entry for entry in history if entry["round"] == round_index]
+        assert {entry["budget"] for entry in entries} == {5 * 2**round_index}
+        assert len(entries) == 8 // 2**round_index
+    assert best["name"] == "c0" and best_cost == 10.0
+
+
+def test_failed_candidates_are_eliminated():
+    candidates = [{"name": "c{}".format(i)} for i in range(6)]
+    measure = SyntheticCost({"c{}".format(i): 10.0 + i for i in range(6)}, failing=["c0", "c1", "c2", "c3"])
+    best, best_cost, _ = successive_halving(candidates, measure, min_budget=1, eta=2)
+    # The best half (3) would include a failed candidate, which is dropped instead of measured again
+    assert [call for call in measure.calls if call[1] > 1] == [("c4", 2), ("c5", 2), ("c4", 4)]
+    assert best["name"] == "c4" and best_cost == 14.0
+
+
+def test_all_failed_returns_inf():
+    candidates = [{"name": "a"}, {"name": "b"}]
+    best, best_cost, _ = successive_halving(candidates, SyntheticCost({}, failing=["a", "b"]), min_budget=1)
+    assert math.isinf(best_cost)
+
+
+def test_max_budget_stops_early_with_best_so_far():
+    candidates = [{"name": "c{}".format(i)} for i in range(16)]
+    measure = SyntheticCost({"c{}".format(i): 100.0 - i for i in range(16)})
+    best, _, history = successive_halving(candidates, measure, min_budget=10, eta=4, max_budget=40)
+    assert max(entry["budget"] for entry in history) == 40
+    assert best["name"] == "c15"
+
+
+def test_eta_must_be_at_least_two():
+    with pytest.raises(ValueError):
+        successive_halving([{"name": "a"}], SyntheticCost({"a": 1.0}), eta=1)
+
+
+def test_candidate_space_varies_opt_within_a_covering_range():
+    candidates = candidate_space([256, 1024], (1, 32), [1, 8, 64], ["fp32", "fp16"])
+    # 64 is outside the range
+    assert len(candidates) == 2 * 2 * 2
+    assert {tuple(c["batch_profiles"]) for c in candidates} == {("1:1:32",), ("1:8:32",)}
+    assert all(covers(c, [1, 8, 32]) for c in candidates)
+    assert not covers(candidates[0], [64])
+    assert len({candidate_name(c) for c in candidates}) == len(candidates)
+
+    with pytest.raises(ValueError):
+        candidate_space([256], (16, 32), [1, 8], ["fp32"])
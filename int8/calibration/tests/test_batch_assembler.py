@@ -0,0 +1,147 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from batch_assembler import BatchAssembler, InputSpec, guess_input_spec, parse_input_spec, to_layout
+
+
+class CountingPreprocess:
+    """Returns a CHW array whose channel c holds 100 * c + the sample's index, recorded
+    in the image's red value, and counts calls per decoded image."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, image, channels, height, width):
+        self.calls.append(id(image))
+        index = image.convert("RGB").getpixel((0, 0))[0]
+        chw = np.empty((channels, height, width), dtype=np.float32)
+        chw[:] = index + 100 * np.arange(channels, dtype=np.float32)[:, None, None]
+        chw[:, 0, 0] = -1  # Marks the top left pixel, so transposes are visible
+        return chw
+
+
+@pytest.fixture
+def image_files(tmp_path):
+    files = []
+    for index in range(10):
+        path = str(tmp_path / "{:02d}.png".format(index))
+        Image.new("RGB", (8, 6), (index, 0, 0)).save(path)
+        files.append(path)
+    return files
+
+
+def sample_indices(batch):
+    """Index of the sample in each row of an NCHW or NHWC batch."""
+    return [int(row.flat[-1]) % 100 for row in batch]
+
+
+@pytest.mark.parametrize("last_batch, expected", [
+    ("repeat", [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 8, 9]]),
+    ("partial", [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]),
+    ("drop", [[0, 1, 2, 3], [4, 5, 6, 7]]),
+])
+def test_last_batch_policies(image_files, last_batch, expected):
+    preprocess = CountingPreprocess()
+    assembler = BatchAssembler([InputSpec("input", (3, 4, 5), preprocess_func=preprocess)], 4, last_batch)
+    assert assembler.num_batches(len(image_files)) == len(expected)
+
+    batches = [sample_indices(batch["input"]) for batch in assembler.batches(image_files)]
+    assert batches == expected
+    # Padding a batch never decodes or pre-processes files again
+    num_samples = sum(len(set(batch)) for batch in expected)
+    assert assembler.num_decoded == num_samples
+    assert len(preprocess.calls) == num_samples
+
+
+def test_batch_of_single_sample_is_repeated(image_files):
+    assembler = BatchAssembler([InputSpec("input", (3, 4, 5), preprocess_func=CountingPreprocess())], 4, "repeat")
+    batches = list(assembler.batches(image_files[:5]))
+    assert sample_indices(batches[-1]["input"]) == [4, 4, 4, 4]
+    assert assembler.num_decoded == 5
+
+
+def test_file_read_by_several_inputs_is_decoded_once(image_files):
+    preprocesses = [CountingPreprocess(), CountingPreprocess()]
+    inputs = [InputSpec("image", (3, 4, 5), "NCHW", preprocesses[0]),
+              InputSpec("thumbnail", (2, 2, 3), "NHWC", preprocesses[1])]
+    assembler = BatchAssembler(inputs, 3, "partial")
+
+    samples = image_files[:3] + [{"image": image_files[3], "thumbnail": image_files[0]}]
+    batches = [{name: array.copy() for name, array in batch.items()} for batch in assembler.batches(samples)]
+    assert [sample_indices(batch["image"]) for batch in batches] == [[0, 1, 2], [3]]
+    assert [sample_indices(batch["thumbnail"]) for batch in batches] == [[0, 1, 2], [0]]
+    # 3 shared files, then 2 files for the dict sample
+    assert assembler.num_decoded == 5
+    # Both inputs of a shared sample saw the same decoded image
+    assert preprocesses[0].calls[:3] == preprocesses[1].calls[:3]
+
+
+def test_nchw_and_nhwc_layouts(image_files):
+    inputs = [InputSpec("nchw", (3, 4, 5), "NCHW", CountingPreprocess()),
+              InputSpec("nhwc", (4, 5, 3), "NHWC", CountingPreprocess())]
+    assert inputs[1].chw == (3, 4, 5)
+    batch = next(BatchAssembler(inputs, 2, "repeat").batches(image_files))
+
+    assert batch["nchw"].shape == (2, 3, 4, 5)
+    assert batch["nhwc"].shape == (2, 4, 5, 3)
+    np.testing.assert_array_equal(batch["nhwc"], batch["nchw"].transpose(0, 2, 3, 1))
+    assert batch["nchw"][1, 2, 1, 1] == 201
+    assert batch["nhwc"][1, 1, 1, 2] == 201
+    assert (batch["nhwc"][:, 0, 0, :] == -1).all()
+
+
+def test_buffers_are_allocated_once(image_files):
+    allocations = []
+
+    def allocator(shape, dtype):
+        allocations.append((shape, dtype))
+        return np.empty(shape, dtype)
+
+    assembler = BatchAssembler([InputSpec("input", (4, 5, 3), "NHWC", CountingPreprocess(), np.float16)], 4,
+                               allocator=allocator)
+    buffer = assembler.buffers["input"]
+    for batch in assembler.batches(image_files):
+        assert np.shares_memory(batch["input"], buffer)
+        assert batch["input"].dtype == np.float16
+    assert allocations == [((4, 4, 5, 3), np.dtype(np.float16))]
+
+
+def test_to_layout_returns_views():
+    chw = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    assert to_layout(chw, "NCHW") is chw
+    hwc = to_layout(chw, "NHWC")
+    assert hwc.shape == (3, 4, 2) and np.shares_memory(hwc, chw)
+
+
+def test_input_specs():
+    spec = parse_input_spec("input:224x224x3:NHWC:preprocess_inception")
+    assert (spec.name, spec.shape, spec.layout, spec.preprocess_func) == ("input", (224, 224, 3), "NHWC", "preprocess_inception")
+    assert spec.chw == (3, 224, 224)
+    assert parse_input_spec("input:3x224x224").layout == "NCHW"
+
+    assert guess_input_spec("input", (-1, 224, 224, 3)).layout == "NHWC"
+    assert guess_input_spec("input", (-1, 3, 224, 224)).layout == "NCHW"
+    assert guess_input_spec("input", (-1, 1, 28, 1)).layout == "NCHW"
+
+    for spec in ["input", "input:3x224x224:NCWH", "input:224x224"]:
+        with pytest.raises(ValueError):
+            parse_input_spec(spec)
+    with pytest.raises(ValueError):
+        BatchAssembler([parse_input_spec("input:3x4x5")], 4, "pad")
+    with pytest.raises(ValueError):
+        BatchAssembler([parse_input_spec("input:3x4x5")], 0)
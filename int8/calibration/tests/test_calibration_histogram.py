@@ -0,0 +1,106 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from calibration_histogram import (ActivationHistogram, CACHE_HEADERS, INT8_MAX, amax_entropy, amax_minmax,
+                                   amax_percentile, collect_histograms, compute_dynamic_ranges,
+                                   write_calibration_cache)
+from precision_plan import read_calibration_cache_scales
+
+
+def test_histogram_range_grows_without_losing_counts():
+    rng = np.random.RandomState(0)
+    first, second = rng.uniform(-1, 1, 10000), rng.uniform(-3, 3, 10000)
+    histogram = ActivationHistogram(num_bins=256)
+    histogram.update(first)
+    first_range = histogram.range
+    histogram.update(second)
+
+    # 3x the first batch's max needs the range doubled twice
+    assert histogram.range == pytest.approx(4 * first_range)
+    assert histogram.amax == pytest.approx(np.abs(second).max())
+    assert histogram.counts.sum() == 20000
+    # Merging bins gives the histogram the first batch would have had on the final range, except
+    # for its max, which sits on a merged bin's right edge
+    direct = np.histogram(np.abs(np.concatenate([first, second])), bins=256, range=(0, histogram.range))[0]
+    assert np.abs(histogram.counts - direct).sum() <= 2
+
+
+def test_histogram_edge_cases():
+    with pytest.raises(ValueError):
+        ActivationHistogram(num_bins=1000)
+    histogram = ActivationHistogram(num_bins=16)
+    histogram.update(np.zeros(0))
+    assert histogram.range == 0.0
+    histogram.update(np.zeros(10))
+    assert histogram.range == 1.0 and histogram.counts[0] == 10 and histogram.amax == 0.0
+    # A batch far beyond the range can't merge more than all bins into one
+    histogram.update([1e6])
+    assert histogram.counts.sum() == 11 and histogram.range >= 1e6
+
+
+@pytest.fixture
+def outlier_histogram():
+    """Mostly normal activations with a few large outliers."""
+    rng = np.random.RandomState(1)
+    histogram = ActivationHistogram(num_bins=2048)
+    for _ in range(4):
+        histogram.update(np.concatenate([rng.normal(0, 1, 25000), [50.0, -40.0]]))
+    return histogram
+
+
+def test_minmax_and_percentile(outlier_histogram):
+    assert amax_minmax(outlier_histogram) == 50.0
+    amax = amax_percentile(outlier_histogram, 99.0)
+    # 99% of |N(0, 1)| lies below 2.576, up to one bin of error
+    assert abs(amax - 2.576) < 0.1
+    assert amax_percentile(outlier_histogram, 99.99) > amax
+    assert amax_percentile(outlier_histogram, 100.0) == 50.0
+
+
+def test_entropy_clips_outliers(outlier_histogram):
+    amax = amax_entropy(outlier_histogram, stride=16)
+    assert 2.0 < amax < 25.0
+    assert amax_entropy(ActivationHistogram(num_bins=256)) == 0.0
+
+
+def test_compute_dynamic_ranges(outlier_histogram):
+    histograms = {"conv1": outlier_histogram}
+    assert compute_dynamic_ranges(histograms, "minmax") == {"conv1": 50.0}
+    assert compute_dynamic_ranges(histograms, "percentile", percentile=99.0) == \
+        {"conv1": amax_percentile(outlier_histogram, 99.0)}
+    assert compute_dynamic_ranges(histograms, "entropy", stride=16) == {"conv1": amax_entropy(outlier_histogram, stride=16)}
+    with pytest.raises(ValueError):
+        compute_dynamic_ranges(histograms, "mse")
+
+
+def test_collect_histograms_and_write_cache(tmp_path):
+    files = []
+    for i in range(3):
+        path = str(tmp_path / "batch_{}.npz".format(i))
+        np.savez(path, input=np.full(10, i + 1.0), conv1=np.linspace(-2, 2, 10) * (i + 1))
+        files.append(path)
+    histograms = collect_histograms(files, num_bins=64)
+    assert list(histograms) == ["input", "conv1"]
+    assert histograms["input"].counts.sum() == 30 and histograms["input"].amax == 3.0
+
+    ranges = compute_dynamic_ranges(histograms, "minmax")
+    cache = str(tmp_path / "model.cache")
+    write_calibration_cache(cache, ranges, "TRT-7100-" + CACHE_HEADERS["minmax"])
+    with open(cache) as f:
+        assert f.readline().strip() == "TRT-7100-MinMaxCalibration"
+    scales = read_calibration_cache_scales(cache)
+    assert scales == {"input": pytest.approx(3.0 / INT8_MAX), "conv1": pytest.approx(6.0 / INT8_MAX)}
@@ -0,0 +1,150 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import calibration_selection
+from calibration_selection import kcenter_greedy, select_calibration_files, standardize, stratified_sample
+
+
+def clustered_features(num_samples=600, num_features=8, seed=0):
+    """Mostly one dense cluster, plus a few small clusters of rare samples far from it."""
+    rng = np.random.RandomState(seed)
+    features = rng.randn(num_samples, num_features).astype(np.float32)
+    for i, offset in enumerate([10, -12, 15, -20]):
+        features[i * 5:(i + 1) * 5, i] += offset
+    return features
+
+
+def covering_radius(features, indices):
+    """Largest distance from any sample to its nearest selected sample (lower = better coverage)."""
+    features = standardize(np.asarray(features, dtype=np.float64))
+    distances = np.linalg.norm(features[:, None, :] - features[None, indices, :], axis=-1)
+    return distances.min(axis=1).max()
+
+
+@pytest.mark.parametrize("select", [kcenter_greedy, stratified_sample])
+def test_picks_are_unique(select):
+    features = clustered_features()
+    indices = select(features, 64)
+    assert len(indices) == 64
+    assert len(set(indices.tolist())) == 64
+    assert indices.min() >= 0 and indices.max() < len(features)
+
+
+@pytest.mark.parametrize("select", [kcenter_greedy, stratified_sample])
+def test_selection_is_capped_at_dataset_size(select):
+    features = clustered_features(num_samples=20)
+    assert sorted(select(features, 50).tolist()) == list(range(20))
+
+
+def test_kcenter_picks_unique_samples_among_duplicates():
+    features = np.repeat(clustered_features(num_samples=10), 4, axis=0)
+    indices = kcenter_greedy(features, 30)
+    assert len(set(indices.tolist())) == 30
+
+
+@pytest.mark.parametrize("select", [kcenter_greedy, stratified_sample])
+def test_selection_is_deterministic(select):
+    features = clustered_features()
+    np.testing.assert_array_equal(select(features, 32, seed=7), select(features.copy(), 32, seed=7))
+
+
+def test_kcenter_covers_better_than_random_sample():
+    features = clustered_features()
+    k = 32
+    kcenter_radius = covering_radius(features, kcenter_greedy(features, k))
+    for seed in range(10):
+        random.seed(seed)
+        random_indices = random.sample(range(len(features)), k)
+        assert kcenter_radius < covering_radius(features, random_indices)
+
+
+def test_kcenter_selects_rare_clusters():
+    features = clustered_features()
+    indices = set(kcenter_greedy(features, 16).tolist())
+    for i in range(4):
+        assert indices & set(range(i * 5, (i + 1) * 5))
+
+
+def test_stratified_sample_allocates_proportionally():
+    num_strata = 8
+    features = clustered_features(num_samples=800)
+    indices = stratified_sample(features, 4 * num_strata, num_strata=num_strata)
+
+    standardized = standardize(features.astype(np.float64))
+    projection = standardized @ np.linalg.svd(standardized, full_matrices=False)[2][0]
+    ranks = np.argsort(np.argsort(projection))
+    strata = ranks[indices] * num_strata // len(features)
+    assert np.bincount(strata, minlength=num_strata).tolist() == [4] * num_strata
+
+
+@pytest.fixture
+def image_files(tmp_path):
+    rng = np.random.RandomState(0)
+    files = []
+    for i in range(24):
+        path = str(tmp_path / "images" / "{:02d}.png".format(i))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.fromarray(rng.randint(0, 256, size=(16, 16, 3), dtype=np.uint8)).save(path)
+        files.append(path)
+    return files
+
+
+@pytest.fixture
+def feature_calls(monkeypatch):
+    calls = []
+
+    def compute_features(files, num_workers=None):
+        calls.append(list(files))
+        return np.stack([calibration_selection.image_features(path) for path in files])
+
+    monkeypatch.setattr(calibration_selection, "compute_features", compute_features)
+    return calls
+
+
+@pytest.mark.parametrize("method", ["kcenter", "stratified"])
+def test_selection_is_reused_when_fingerprint_matches(tmp_path, image_files, feature_calls, method):
+    cache_dir = str(tmp_path / "cache")
+    selected = select_calibration_files(image_files, 8, method, cache_dir)
+    assert len(set(selected)) == 8 and set(selected) <= set(image_files)
+    assert len(feature_calls) == 1
+
+    assert select_calibration_files(list(reversed(image_files)), 8, method, cache_dir) == selected
+    assert len(feature_calls) == 1
+
+    # Same dataset, another selection: features are reused, not recomputed
+    assert len(select_calibration_files(image_files, 6, method, cache_dir)) == 6
+    assert len(feature_calls) == 1
+
+
+def test_changed_dataset_is_not_served_from_cache(tmp_path, image_files, feature_calls):
+    cache_dir = str(tmp_path / "cache")
+    select_calibration_files(image_files, 8, "kcenter", cache_dir)
+    Image.new("RGB", (16, 16), (255, 0, 0)).save(image_files[0])
+    os.utime(image_files[0], ns=(0, 0))
+    select_calibration_files(image_files, 8, "kcenter", cache_dir)
+    assert len(feature_calls) == 2
+
+
+def test_small_datasets_and_unknown_methods(tmp_path, image_files, feature_calls):
+    assert select_calibration_files(image_files, 100, "kcenter", str(tmp_path / "cache")) == image_files
+    assert not feature_calls
+    with pytest.raises(ValueError):
+        select_calibration_files(image_files, 8, "median", str(tmp_path / "cache"))
@@ -0,0 +1,133 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from precision_plan import (added_errors, create_precision_plan, load_precision_plan, rank_tensors,
+                            read_calibration_cache_scales, save_precision_plan, simulate_int8, tensor_errors,
+                            tensor_producers)
+
+
+def node(inputs, outputs):
+    return SimpleNamespace(input=inputs, output=outputs)
+
+
+# input -> conv -> a -> relu (not recorded) -> b_in -> conv -> b -> conv -> c, and d = a + c
+NODES = [
+    node(["input", "conv_a.weight"], ["a"]),
+    node(["a"], ["a_relu"]),
+    node(["a_relu", "conv_b.weight", ""], ["b"]),
+    node(["b", "conv_c.weight"], ["c"]),
+    node(["a", "c"], ["d"]),
+]
+
+
+def recorded_activations(seed=0):
+    """Reference activations of the chain above, and activations "recorded from an INT8 engine"
+    where only layer b adds a large error, which then flows into c and d."""
+    rng = np.random.RandomState(seed)
+    a = rng.randn(1000)
+    reference = {"a": a, "b": 2 * np.maximum(a, 0)}
+    reference["c"] = 0.5 * reference["b"]
+    reference["d"] = reference["a"] + reference["c"]
+
+    noise = lambda scale: scale * rng.randn(1000)
+    candidate = {"a": reference["a"] + noise(0.001)}
+    candidate["b"] = 2 * np.maximum(candidate["a"], 0) + noise(0.2)
+    candidate["c"] = 0.5 * candidate["b"] + noise(0.01)
+    candidate["d"] = candidate["a"] + candidate["c"] + noise(0.001)
+    return reference, candidate
+
+
+def test_tensor_producers_look_through_unrecorded_tensors():
+    assert tensor_producers(NODES, ["a", "b", "c", "d"]) == {"a": [], "b": ["a"], "c": ["b"], "d": ["a", "c"]}
+    # Without c, d is computed from b through it
+    assert tensor_producers(NODES, ["a", "b", "d"]) == {"a": [], "b": ["a"], "d": ["a", "b"]}
+
+
+def test_accumulated_error_blames_downstream_layers():
+    errors = tensor_errors(*recorded_activations())
+    assert rank_tensors(errors)[0] == "c"
+    assert create_precision_plan(errors, keep_count=1)["layers"]["b"]["precision"] == "int8"
+
+
+@pytest.mark.parametrize("metric", ["nmse", "cosine"])
+def test_added_errors_rank_the_layer_adding_the_error_first(metric):
+    errors = tensor_errors(*recorded_activations())
+    added = added_errors(errors, tensor_producers(NODES, errors))
+    assert rank_tensors(added, metric)[0] == "b"
+    assert create_precision_plan(added, keep_count=1, metric=metric)["layers"]["b"]["precision"] == "fp16"
+    # c and d only add a little on top of b's error
+    assert added["c"]["nmse"] < 0.1 * added["b"]["nmse"]
+    assert added["d"]["nmse"] < 0.1 * added["b"]["nmse"]
+    assert added["c"]["cosine"] > added["b"]["cosine"]
+    # Tensors without recorded inputs keep their own error
+    assert added["a"]["nmse"] == errors["a"]["nmse"]
+    assert added["a"]["cosine"] == pytest.approx(errors["a"]["cosine"])
+    for name in errors:
+        assert added[name]["accumulated_nmse"] == errors[name]["nmse"]
+        assert added[name]["accumulated_cosine"] == errors[name]["cosine"]
+
+
+def test_added_errors_are_never_negative():
+    errors = {"a": {"nmse": 0.5, "cosine": 0.8}, "b": {"nmse": 0.1, "cosine": 0.99}}
+    added = added_errors(errors, {"a": [], "b": ["a"]})
+    assert added["b"]["nmse"] == 0.0 and added["b"]["cosine"] == 1.0
+
+
+def test_tensor_errors():
+    reference = {"x": np.array([1.0, 0.0, 0.0]), "zero": np.zeros(3), "underflow": np.ones(3), "shape": np.ones(3)}
+    candidate = {"x": np.array([1.0, 1.0, 0.0]), "zero": np.zeros(3), "underflow": np.zeros(3), "shape": np.ones(4),
+                 "extra": np.ones(3)}
+    errors = tensor_errors(reference, candidate)
+    assert sorted(errors) == ["underflow", "x", "zero"]
+    assert errors["x"]["nmse"] == pytest.approx(1.0)
+    assert errors["x"]["cosine"] == pytest.approx(1 / np.sqrt(2))
+    assert errors["zero"] == {"nmse": 0.0, "cosine": 1.0}
+    assert errors["underflow"] == {"nmse": 1.0, "cosine": 0.0}
+
+
+def test_calibration_cache_scales_and_simulation(tmp_path):
+    cache = tmp_path / "model.cache"
+    cache.write_text("TRT-7000-EntropyCalibration2\ninput: {}\nconv1: {}\n".format(
+        struct.pack("!f", 0.5).hex(), struct.pack("!f", 0.01).hex()))
+    scales = read_calibration_cache_scales(str(cache))
+    assert scales == {"input": 0.5, "conv1": pytest.approx(0.01)}
+
+    simulated = simulate_int8({"input": np.array([0.2, 0.3, 100.0, -100.0]), "other": np.ones(2)}, {"input": 0.5})
+    assert list(simulated) == ["input"]
+    np.testing.assert_allclose(simulated["input"], [0.0, 0.5, 63.5, -63.5])
+
+
+def test_precision_plan_keeps_most_sensitive(tmp_path):
+    errors = {"a": {"nmse": 0.01, "cosine": 0.99}, "b": {"nmse": 0.5, "cosine": 0.7},
+              "c": {"nmse": 0.1, "cosine": 0.95}, "d": {"nmse": 0.0, "cosine": 1.0}}
+    plan = create_precision_plan(errors, keep_count=2)
+    assert [entry["name"] for entry in plan["ranking"]] == ["b", "c", "a", "d"]
+    assert {name: entry["precision"] for name, entry in plan["layers"].items()} == \
+        {"a": "int8", "b": "fp16", "c": "fp16", "d": "int8"}
+
+    plan = create_precision_plan(errors, keep_fraction=0.1, keep_precision="fp32", metric="cosine")
+    assert [name for name, entry in plan["layers"].items() if entry["precision"] == "fp32"] == ["b"]
+
+    path = str(tmp_path / "plan.json")
+    save_precision_plan(plan, path)
+    assert load_precision_plan(path) == plan
+
+    with pytest.raises(ValueError):
+        create_precision_plan(errors, keep_count=1, keep_precision="bf16")
@@ -0,0 +1,113 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import numpy as np
+import pytest
+
+from precision_sweep import evaluate_outputs, format_table, load_ground_truth, load_labels, pareto_front, topk
+
+
+def test_load_ground_truth_by_index_and_name(tmp_path):
+    labels_file = tmp_path / "labels.txt"
+    labels_file.write_text("tench\ngoldfish\n\ngreat white shark\n")
+    labels = load_labels(str(labels_file))
+    assert labels == ["tench", "goldfish", "great white shark"]
+
+    ground_truth = tmp_path / "data" / "val.txt"
+    ground_truth.parent.mkdir()
+    ground_truth.write_text("# comment\nimages/a.jpg 1\n\n/abs/b.jpg great white shark\n")
+    files, targets = load_ground_truth(str(ground_truth), labels)
+    assert files == [os.path.join(str(tmp_path / "data"), "images/a.jpg"), "/abs/b.jpg"]
+    assert targets.tolist() == [1, 2] and targets.dtype == np.int64
+
+
+def test_load_ground_truth_rejects_unknown_labels(tmp_path):
+    ground_truth = tmp_path / "val.txt"
+    ground_truth.write_text("a.jpg 0\nb.jpg platypus\n")
+    with pytest.raises(ValueError, match="line 2"):
+        load_ground_truth(str(ground_truth), ["tench"])
+
+
+def test_topk_is_sorted_best_first():
+    outputs = np.array([[0.1, 0.5, 0.2, 0.9], [3.0, 2.0, 1.0, 0.0]], dtype=np.float32)
+    assert topk(outputs, k=3).tolist() == [[3, 1, 2], [0, 1, 2]]
+    # k is capped at the number of classes, extra dimensions are flattened
+    assert topk(outputs.reshape(2, 4, 1, 1), k=10).tolist() == [[3, 1, 2, 0], [0, 1, 2, 3]]
+
+
+def test_evaluate_outputs_agreement_and_accuracy():
+    reference = np.eye(4, dtype=np.float32)[[0, 1, 2, 3]]
+    outputs = reference.copy()
+    # Sample 2: top-1 changes, but the reference class is still second
+    outputs[2] = [0.0, 0.0, 0.5, 0.75]
+    # Sample 3: reference class drops out of the top-2
+    outputs[3] = [0.5, 0.25, 0.0, 0.0]
+    targets = np.array([0, 1, 2, 0])
+
+    metrics = evaluate_outputs(outputs, reference, targets, k=2)
+    assert metrics["samples"] == 4
+    assert metrics["top1_agreement"] == 0.5
+    assert metrics["top2_agreement"] == 0.75
+    assert metrics["max_abs_error"] == 1.0
+    assert metrics["mean_abs_error"] == pytest.approx((0.5 + 0.75 + 1.0 + 0.5 + 0.25) / 16)
+    assert metrics["top1_accuracy"] == 0.75
+    assert metrics["top2_accuracy"] == 1.0
+
+
+def test_evaluate_outputs_against_itself():
+    reference = np.random.RandomState(0).rand(16, 10).astype(np.float32)
+    metrics = evaluate_outputs(reference, reference, k=5)
+    assert metrics["top1_agreement"] == metrics["top5_agreement"] == 1.0
+    assert metrics["max_abs_error"] == 0.0
+    assert "top1_accuracy" not in metrics
+
+
+def test_evaluate_outputs_rejects_shape_mismatch():
+    with pytest.raises(ValueError):
+        evaluate_outputs(np.zeros((4, 10)), np.zeros((4, 11)))
+
+
+def test_pareto_front():
+    results = {
+        "fp32": {"latency_ms": 10.0, "top1_agreement": 1.0},
+        "fp16": {"latency_ms": 5.0, "top1_agreement": 0.99},
+        "int8": {"latency_ms": 3.0, "top1_agreement": 0.95},
+        # Slower and less accurate than fp16
+        "int8_bad": {"latency_ms": 6.0, "top1_agreement": 0.9},
+        # Ties fp16 on both: neither dominates the other
+        "fp16_copy": {"latency_ms": 5.0, "top1_agreement": 0.99},
+    }
+    assert pareto_front(results) == ["fp16", "fp16_copy", "fp32", "int8"]
+
+
+def test_pareto_front_of_error_metrics():
+    results = {
+        "fp32": {"latency_ms": 10.0, "max_abs_error": 0.0},
+        "fp16": {"latency_ms": 5.0, "max_abs_error": 0.01},
+        "int8": {"latency_ms": 5.0, "max_abs_error": 0.1},
+    }
+    assert pareto_front(results, error="max_abs_error", higher_is_better=False) == ["fp16", "fp32"]
+
+
+def test_format_table_sorts_by_latency_and_marks_front():
+    results = {
+        "fp32": {"latency_ms": 10.0, "top1_agreement": 1.0},
+        "int8": {"latency_ms": 3.0, "top1_agreement": 0.95, "top1_accuracy": 0.7},
+    }
+    lines = format_table(results, ["int8"], k=5).splitlines()
+    assert lines[0].split() == ["variant", "pareto", "latency_ms", "top1_agreement", "top1_accuracy"]
+    assert lines[1].split() == ["int8", "*", "3", "0.95", "0.7"]
+    assert lines[2].split() == ["fp32", "10", "1", "-"]
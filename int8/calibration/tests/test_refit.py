@@ -0,0 +1,153 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+# The repo's onnx/ directory can be picked up as a namespace package, require the real one
+pytest.importorskip("onnx.helper")
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+from refit import (diff_weights, layer_weight_targets, load_initializers, read_weights_manifest, target_weights,
+                   unmapped_weights, weight_digests, write_weights_manifest)
+
+
+def make_weights(seed=0):
+    rng = np.random.RandomState(seed)
+    return {
+        "conv.weight": rng.randn(4, 3, 3, 3).astype(np.float32),
+        "conv.bias": rng.randn(4).astype(np.float32),
+        "bn.scale": rng.rand(4).astype(np.float32) + 0.5,
+        "bn.bias": rng.randn(4).astype(np.float32),
+        "bn.mean": rng.randn(4).astype(np.float32),
+        "bn.var": rng.rand(4).astype(np.float32) + 0.1,
+        "fc.weight": rng.randn(10, 4).astype(np.float32),
+        "fc.bias": rng.randn(10).astype(np.float32),
+        "proj.weight": rng.randn(10, 5).astype(np.float32),
+    }
+
+
+def make_model(weights, gemm_attributes=None):
+    gemm_attributes = {"transB": 1} if gemm_attributes is None else gemm_attributes
+    nodes = [
+        helper.make_node("Conv", ["input", "conv.weight", "conv.bias"], ["conv_out"], name="conv", pads=[1, 1, 1, 1]),
+        helper.make_node("BatchNormalization", ["conv_out", "bn.scale", "bn.bias", "bn.mean", "bn.var"], ["bn_out"],
+                         name="bn", epsilon=1e-3),
+        helper.make_node("GlobalAveragePool", ["bn_out"], ["pool_out"], name="pool"),
+        helper.make_node("Flatten", ["pool_out"], ["flat_out"], name="flatten"),
+        helper.make_node("Gemm", ["flat_out", "fc.weight", "fc.bias"], ["fc_out"], name="fc", **gemm_attributes),
+        helper.make_node("MatMul", ["fc_out", "proj.weight"], ["output"], name="proj"),
+    ]
+    graph = helper.make_graph(
+        nodes, "refit_test",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 3, 8, 8])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, [1, 5])],
+        initializer=[numpy_helper.from_array(array, name) for name, array in weights.items()])
+    return helper.make_model(graph)
+
+
+def save_model(path, weights, **kwargs):
+    onnx.save(make_model(weights, **kwargs), str(path))
+    return str(path)
+
+
+def test_diff_weights_classifies_changes(tmp_path):
+    old = make_weights()
+    engine_path = str(tmp_path / "model.engine")
+    write_weights_manifest(engine_path, save_model(tmp_path / "old.onnx", old))
+    recorded = read_weights_manifest(engine_path)["weights"]
+
+    new = dict(old)
+    new["conv.weight"] = old["conv.weight"] + 1
+    new["fc.bias"] = np.zeros(11, dtype=np.float32)
+    new["bn.mean"] = old["bn.mean"].astype(np.float64)
+    del new["proj.weight"]
+    new["extra"] = np.ones(2, dtype=np.float32)
+
+    assert diff_weights(recorded, weight_digests(new)) == {
+        "changed": ["conv.weight"],
+        "incompatible": ["bn.mean", "fc.bias"],
+        "added": ["extra"],
+        "removed": ["proj.weight"],
+    }
+
+
+def test_diff_weights_of_identical_models_is_empty(tmp_path):
+    path = save_model(tmp_path / "model.onnx", make_weights())
+    engine_path = str(tmp_path / "model.engine")
+    write_weights_manifest(engine_path, path)
+    diff = diff_weights(read_weights_manifest(engine_path)["weights"], weight_digests(load_initializers(path)))
+    assert diff == {"changed": [], "incompatible": [], "added": [], "removed": []}
+
+
+def test_unsupported_manifest_version_is_rejected(tmp_path):
+    engine_path = str(tmp_path / "model.engine")
+    with open(engine_path + ".weights.json", "w") as f:
+        f.write('{"manifest_version": 0, "weights": {}}')
+    with pytest.raises(ValueError):
+        read_weights_manifest(engine_path)
+
+
+def test_layer_weight_targets_map_conv_batchnorm_and_gemm():
+    weights = make_weights()
+    targets = layer_weight_targets(make_model(weights).graph.node)
+    assert sorted(targets) == [("bn", "SCALE"), ("bn", "SHIFT"), ("conv", "BIAS"), ("conv", "KERNEL"),
+                               ("fc", "BIAS"), ("fc", "KERNEL")]
+
+    np.testing.assert_array_equal(target_weights(targets[("conv", "KERNEL")], weights), weights["conv.weight"])
+    np.testing.assert_array_equal(target_weights(targets[("conv", "BIAS")], weights), weights["conv.bias"])
+    np.testing.assert_array_equal(target_weights(targets[("fc", "KERNEL")], weights), weights["fc.weight"])
+    np.testing.assert_array_equal(target_weights(targets[("fc", "BIAS")], weights), weights["fc.bias"])
+
+
+def test_batchnorm_is_folded_into_scale_and_shift():
+    weights = make_weights()
+    targets = layer_weight_targets(make_model(weights).graph.node)
+    scale = target_weights(targets[("bn", "SCALE")], weights)
+    shift = target_weights(targets[("bn", "SHIFT")], weights)
+
+    x = np.random.RandomState(1).randn(4).astype(np.float32)
+    expected = (x - weights["bn.mean"]) / np.sqrt(weights["bn.var"] + 1e-3) * weights["bn.scale"] + weights["bn.bias"]
+    np.testing.assert_allclose(x * scale + shift, expected, rtol=1e-5, atol=1e-5)
+    assert scale.dtype == np.float32 and shift.dtype == np.float32
+
+
+def test_gemm_kernel_is_transposed_without_transb():
+    weights = make_weights()
+    weights["fc.weight"] = np.ascontiguousarray(weights["fc.weight"].T)
+    targets = layer_weight_targets(make_model(weights, gemm_attributes={}).graph.node)
+    kernel = target_weights(targets[("fc", "KERNEL")], weights)
+    np.testing.assert_array_equal(kernel, weights["fc.weight"].T)
+    assert kernel.flags["C_CONTIGUOUS"]
+
+
+@pytest.mark.parametrize("attributes", [{"transB": 1, "alpha": 2.0}, {"transB": 1, "beta": 0.5}, {"transA": 1}])
+def test_gemm_that_is_not_fully_connected_is_unmapped(attributes):
+    targets = layer_weight_targets(make_model(make_weights(), gemm_attributes=attributes).graph.node)
+    assert not [key for key in targets if key[0] == "fc"]
+    assert unmapped_weights(["fc.weight", "fc.bias", "conv.bias"], targets) == ["fc.weight", "fc.bias"]
+
+
+def test_matmul_weights_are_reported_unmapped():
+    targets = layer_weight_targets(make_model(make_weights()).graph.node)
+    assert unmapped_weights(["conv.weight", "proj.weight", "bn.var"], targets) == ["proj.weight"]
+
+
+def test_unnamed_nodes_use_their_first_output():
+    model = make_model(make_weights())
+    for node in model.graph.node:
+        node.name = ""
+    targets = layer_weight_targets(model.graph.node)
+    assert ("conv_out", "KERNEL") in targets and ("bn_out", "SCALE") in targets and ("fc_out", "BIAS") in targets
@@ -0,0 +1,112 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import multiprocessing
+
+import pytest
+
+from timing_cache import TimingCacheFile, TimingCacheStats, record_build_stats
+
+
+def append_lines(path, worker, num_merges):
+    cache_file = TimingCacheFile(path)
+    for i in range(num_merges):
+        cache_file.merge(lambda existing: existing + "{}:{}\n".format(worker, i).encode())
+
+
+def test_merge_passes_latest_contents_and_reports_sizes(tmp_path):
+    cache_file = TimingCacheFile(str(tmp_path / "caches" / "timing.cache"))
+    assert cache_file.read() == b""
+
+    seen = []
+
+    def merge(existing):
+        seen.append(existing)
+        return existing + b"entries"
+
+    assert cache_file.merge(merge) == (0, 7)
+    assert cache_file.merge(merge) == (7, 14)
+    assert seen == [b"", b"entries"]
+    assert cache_file.read() == b"entriesentries"
+
+
+def test_failed_merge_leaves_cache_and_directory_untouched(tmp_path):
+    cache_file = TimingCacheFile(str(tmp_path / "timing.cache"))
+    cache_file.merge(lambda existing: b"original")
+
+    def failing_merge(existing):
+        raise RuntimeError("combine failed")
+
+    with pytest.raises(RuntimeError):
+        cache_file.merge(failing_merge)
+    assert cache_file.read() == b"original"
+    assert sorted(os.listdir(str(tmp_path))) == ["timing.cache", "timing.cache.lock"]
+
+
+def test_write_replaces_the_file_atomically(tmp_path):
+    cache_file = TimingCacheFile(str(tmp_path / "timing.cache"))
+    cache_file.merge(lambda existing: b"old" * 1000)
+    # A reader that opened the old cache keeps reading all of it
+    with open(cache_file.path, "rb") as reader:
+        inode = os.fstat(reader.fileno()).st_ino
+        cache_file.merge(lambda existing: b"new")
+        assert reader.read() == b"old" * 1000
+    assert os.stat(cache_file.path).st_ino != inode
+    assert cache_file.read() == b"new"
+
+
+def test_concurrent_writers_never_lose_merges(tmp_path):
+    path = str(tmp_path / "timing.cache")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=append_lines, args=(path, worker, 25)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    lines = TimingCacheFile(path).read().decode().splitlines()
+    assert sorted(lines) == sorted("{}:{}".format(worker, i) for worker in range(4) for i in range(25))
+    # Each worker's merges land in order
+    for worker in range(4):
+        assert [line for line in lines if line.startswith("{}:".format(worker))] == \
+            ["{}:{}".format(worker, i) for i in range(25)]
+
+
+def test_stats_count_timed_tactics_and_hits():
+    stats = TimingCacheStats()
+    for message in ["Tactic: 0x0000000000000001 Time: 0.0512",
+                    "Tactic: 0x0000000000000002 Time: 0.0433",
+                    "Timing cache hit for layer conv1",
+                    "Building engine..."]:
+        stats.observe(message)
+    assert stats.summary() == {"timed_tactics": 2, "cache_hits": 1, "hit_rate": 1 / 3}
+
+
+def test_stats_unavailable_when_nothing_matches():
+    stats = TimingCacheStats()
+    stats.observe("Some other TensorRT version's wording")
+    assert stats.summary() == {"timed_tactics": None, "cache_hits": None, "hit_rate": None}
+
+
+def test_record_build_stats_appends_json_lines(tmp_path):
+    path = str(tmp_path / "stats.jsonl")
+    record_build_stats(path, build_time=1.5, cache_hits=3)
+    record_build_stats(path, build_time=0.5, cache_hits=None, host="builder-1")
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record["build_time"] for record in records] == [1.5, 0.5]
+    assert records[1]["host"] == "builder-1" and "timestamp" in records[0]
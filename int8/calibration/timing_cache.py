@@ -0,0 +1,181 @@
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import contextlib
+
+logging.basicConfig(level=logging.DEBUG,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+# TensorRT has no API for timing cache hits, so tactics timed vs. served from the timing cache are
+# counted from its VERBOSE builder messages. Their wording isn't part of the API and differs between
+# versions: timed tactics are matched by the "Tactic: <id> Time: <ms>" lines of TensorRT 8.x builders,
+# cache hits by any message mentioning a "cache hit".
+TIMED_TACTIC_PATTERN = re.compile(r"Tactic:.*Time:")
+CACHE_HIT_PATTERN = re.compile(r"cache hit", re.IGNORECASE)
+
+
+class TimingCacheFile:
+    """A timing cache file on disk, safe to share between concurrent builders.
+
+    Readers take a shared lock and writers an exclusive lock on a separate "<path>.lock"
+    file, and the cache itself is replaced atomically, so a reader never sees a partially
+    written cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+
+    @contextlib.contextmanager
+    def lock(self, exclusive=True):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return b""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def _write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".timing_cache.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self):
+        """Returns the cache contents, or b"" if there is no cache yet."""
+        with self.lock(exclusive=False):
+            return self._read()
+
+    def merge(self, merge_func):
+        """Re-reads the cache under an exclusive lock and replaces it with `merge_func(existing_bytes)`.
+
+        Other builders may have written to the cache since it was read at the start of our
+        build, so entries are merged into the latest version rather than overwriting it.
+        """
+        with self.lock(exclusive=True):
+            existing = self._read()
+            merged = merge_func(existing)
+            self._write(merged)
+            return len(existing), len(merged)
+
+
+class TimingCacheStats:
+    """Counts timed tactics and timing cache hits from builder log messages, see TIMED_TACTIC_PATTERN.
+
+    If no message matched either pattern (ex: a TensorRT version with different wording, or a
+    logger that didn't get VERBOSE messages), the counts are reported as None rather than 0.
+    """
+
+    def __init__(self):
+        self.timed_tactics = 0
+        self.cache_hits = 0
+        self.messages = 0
+
+    def observe(self, message):
+        self.messages += 1
+        if TIMED_TACTIC_PATTERN.search(message):
+            self.timed_tactics += 1
+        elif CACHE_HIT_PATTERN.search(message):
+            self.cache_hits += 1
+
+    def summary(self):
+        total = self.timed_tactics + self.cache_hits
+        if not total:
+            if self.messages:
+                logger.warning("None of {:} builder messages looked like a timed tactic or timing cache hit, "
+                               "hit statistics are unavailable for this TensorRT version".format(self.messages))
+            return {"timed_tactics": None, "cache_hits": None, "hit_rate": None}
+        return {
+            "timed_tactics": self.timed_tactics,
+            "cache_hits": self.cache_hits,
+            "hit_rate": self.cache_hits / total,
+        }
+
+
+def create_counting_logger(min_severity, stats):
+    """Returns a trt.ILogger that feeds every message to `stats` and prints messages
+    at or above `min_severity`, like trt.Logger would."""
+    import tensorrt as trt
+
+    class CountingLogger(trt.ILogger):
+        def __init__(self):
+            trt.ILogger.__init__(self)
+            self.min_severity = min_severity
+
+        def log(self, severity, msg):
+            stats.observe(msg)
+            if int(severity) <= int(self.min_severity):
+                print("[TensorRT] {}: {}".format(str(severity).split(".")[-1], msg))
+
+    return CountingLogger()
+
+
+def load_timing_cache(config, cache_file):
+    """Creates a timing cache from `cache_file` (or an empty one) and attaches it to the builder config.
+
+    Returns False if this TensorRT version doesn't support timing caches.
+    """
+    if not hasattr(config, "create_timing_cache"):
+        logger.warning("Timing cache is not supported by this TensorRT version, ignoring it.")
+        return False
+
+    data = cache_file.read()
+    logger.info("Loading timing cache: {:} ({:} bytes)".format(cache_file.path, len(data)))
+    cache = config.create_timing_cache(data)
+    config.set_timing_cache(cache, ignore_mismatch=False)
+    return True
+
+
+def save_timing_cache(config, cache_file):
+    """Merges the builder config's timing cache into `cache_file`."""
+    cache = config.get_timing_cache()
+
+    def merge(existing):
+        if existing:
+            cache.combine(config.create_timing_cache(existing), ignore_mismatch=False)
+        return bytes(memoryview(cache.serialize()))
+
+    before, after = cache_file.merge(merge)
+    logger.info("Saved timing cache: {:} ({:} -> {:} bytes)".format(cache_file.path, before, after))
+    return before, after
+
+
+def record_build_stats(filename, **stats):
+    """Appends one JSON line of build statistics to `filename`, for comparing builds across hosts."""
+    stats.setdefault("timestamp", time.time())
+    stats.setdefault("host", os.uname().nodename)
+    with open(filename, "a") as f:
+        f.write(json.dumps(stats, sort_keys=True) + "\n")
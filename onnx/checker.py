@@ -15,10 +15,25 @@
 # limitations under the License.
 
 import argparse
-parser = argparse.ArgumentParser()
-parser.add_argument("model", type=str, metavar="ONNX_MODEL", help="ONNX model to check.")
-args = parser.parse_args()
 
-import onnx
-model = onnx.load(args.model)
-onnx.checker.check_model(model)
+
+def check_model(model_path):
+    """Raises onnx.checker.ValidationError if the ONNX model at `model_path` is invalid.
+
+    The path is passed to the checker rather than a loaded model, so models over 2GB
+    (with external data) can be checked too.
+    """
+    import onnx
+    onnx.checker.check_model(model_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", type=str, metavar="ONNX_MODEL", help="ONNX model to check.")
+    args = parser.parse_args()
+
+    check_model(args.model)
+
+
+if __name__ == "__main__":
+    main()
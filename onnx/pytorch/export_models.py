@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    datefmt="%Y-%m-%d %H:%M:%S")
+logger = logging.getLogger(__name__)
+
+# For checker.py
+ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CACHE_VERSION = 1
+# Models loaded by this worker process: {(model, kwargs): (module, weights sha256)}
+_models = {}
+
+
+def normalize_spec(spec, defaults=None):
+    """Fills in the defaults of a model spec.
+
+    A spec is a dict like (only "name" is required):
+        {
+            "name": "resnet50",
+            "model": "torchvision:resnet50",        # or "my_package.my_module:factory"
+            "kwargs": {"pretrained": true},         # passed to the factory
+            "inputs": {"input": [1, 3, 224, 224]},  # input name -> export shape
+            "outputs": ["output"],
+            "dynamic_axes": {"input": {"0": "batch_size"}, "output": {"0": "batch_size"}},
+            "opsets": [11, 13],
+            "fixed": true                           # also export without dynamic axes
+        }
+    """
+    spec = dict(defaults or {}, **spec)
+    spec.setdefault("model", "torchvision:{}".format(spec["name"]))
+    kwargs = dict(spec.get("kwargs") or {})
+    if spec["model"].startswith("torchvision:"):
+        kwargs.setdefault("pretrained", spec.get("pretrained", True))
+    spec["kwargs"] = kwargs
+    spec.setdefault("inputs", {"input": [1, 3, 224, 224]})
+    spec.setdefault("outputs", ["output"])
+    spec.setdefault("dynamic_axes", None)
+    spec.setdefault("opsets", [11])
+    spec.setdefault("fixed", True)
+    if not spec["dynamic_axes"] and not spec["fixed"]:
+        raise ValueError("ERROR: Spec [{}] exports nothing, set dynamic_axes or fixed".format(spec["name"]))
+    # JSON keys are strings, torch.onnx.export() wants axis indices
+    if spec["dynamic_axes"]:
+        spec["dynamic_axes"] = {name: {int(axis): label for axis, label in axes.items()}
+                                for name, axes in spec["dynamic_axes"].items()}
+    return spec
+
+
+def export_tasks(specs, output_dir):
+    """One export per (spec, opset, fixed|dynamic), written to <output_dir>/<name>_opset<N>_<variant>.onnx"""
+    tasks = []
+    for spec in specs:
+        variants = (["fixed"] if spec["fixed"] else []) + (["dynamic"] if spec["dynamic_axes"] else [])
+        for opset in spec["opsets"]:
+            for variant in variants:
+                path = os.path.join(output_dir, "{}_opset{}_{}.onnx".format(spec["name"], opset, variant))
+                tasks.append((spec, opset, variant, path))
+    return tasks
+
+
+def sidecar_path(onnx_path):
+    """Export details of "model.onnx", including its cache key, are kept in "model.onnx.export.json" """
+    return onnx_path + ".export.json"
+
+
+def load_model(spec):
+    """Returns (model in eval mode on CPU, sha256 of its weights), re-using models this worker already loaded."""
+    model_key = (spec["model"], json.dumps(spec["kwargs"], sort_keys=True))
+    if model_key not in _models:
+        module_name, _, factory_name = spec["model"].partition(":")
+        if module_name == "torchvision":
+            module_name = "torchvision.models"
+        model = getattr(importlib.import_module(module_name), factory_name)(**spec["kwargs"]).cpu().eval()
+        digest = hashlib.sha256()
+        for name, tensor in sorted(model.state_dict().items()):
+            digest.update(name.encode())
+            digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+        # Keep only the last model, a zoo's models don't all fit in every worker's memory
+        _models.clear()
+        _models[model_key] = (model, digest.hexdigest())
+    return _models[model_key]
+
+
+def cache_key(spec, weights_sha256, opset, dynamic_axes, torch_version=None):
+    """Exports only need to be redone when the model, its weights, opset, shapes, axes or torch change.
+    `torch_version` defaults to the installed torch's."""
+    if torch_version is None:
+        import torch
+        torch_version = torch.__version__
+    key = {
+        "cache_version": CACHE_VERSION,
+        "model": spec["model"],
+        "kwargs": spec["kwargs"],
+        "weights_sha256": weights_sha256,
+        "opset": opset,
+        "inputs": spec["inputs"],
+        "outputs": spec["outputs"],
+        "dynamic_axes": {name: {str(axis): label for axis, label in axes.items()} for name, axes in dynamic_axes.items()}
+                        if dynamic_axes else None,
+        "torch": torch_version,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _init_worker(num_threads):
+    import torch
+    torch.set_num_threads(num_threads)
+    if ONNX_DIR not in sys.path:
+        sys.path.insert(0, ONNX_DIR)
+
+
+def export_one(spec, opset, variant, path, force=False):
+    """Exports one model variant on CPU, unless an identical export is already cached, then
+    validates it with checker.py. Runs in a worker process.
+
+    Returns
+    -------
+    result: dict
+        "status" is "exported", "cached" or "failed" (with "error").
+    """
+    import torch
+    from checker import check_model # local module
+
+    result = {"name": spec["name"], "opset": opset, "variant": variant, "path": path}
+    try:
+        model, weights_sha256 = load_model(spec)
+        dynamic_axes = spec["dynamic_axes"] if variant == "dynamic" else None
+        key = cache_key(spec, weights_sha256, opset, dynamic_axes)
+        result["cache_key"] = key
+
+        if not force and os.path.exists(path) and os.path.exists(sidecar_path(path)):
+            with open(sidecar_path(path), "r") as f:
+                if json.load(f).get("cache_key") == key:
+                    result["status"] = "cached"
+                    return result
+
+        dummy_inputs = tuple(torch.randn(*shape) for shape in spec["inputs"].values())
+        # Written next to the destination and renamed, so an interrupted export is never cached
+        tmp_path = "{}.tmp{}.onnx".format(path[:-len(".onnx")], os.getpid())
+        start = time.time()
+        with torch.no_grad():
+            torch.onnx.export(model, dummy_inputs, tmp_path, opset_version=opset,
+                              input_names=list(spec["inputs"]), output_names=spec["outputs"],
+                              dynamic_axes=dynamic_axes)
+        result["export_time"] = time.time() - start
+
+        start = time.time()
+        check_model(tmp_path)
+        result["check_time"] = time.time() - start
+        os.replace(tmp_path, path)
+
+        with open(sidecar_path(path), "w") as f:
+            json.dump({"cache_key": key, "model": spec["model"], "kwargs": spec["kwargs"], "opset": opset,
+                       "inputs": spec["inputs"], "outputs": spec["outputs"], "variant": variant,
+                       "weights_sha256": weights_sha256, "torch": torch.__version__,
+                       "export_time": result["export_time"], "timestamp": time.time()}, f, indent=4, sort_keys=True)
+        result["status"] = "exported"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        if "tmp_path" in locals() and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return result
+
+
+def export_models(specs, output_dir, num_workers=4, threads_per_worker=1, force=False):
+    """Exports every variant of `specs` in parallel CPU worker processes, logging each
+    one as it completes. Returns the results of export_one(), in completion order."""
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = export_tasks(specs, output_dir)
+    # Consecutive tasks of a model are likely to land on a worker that already loaded it
+    tasks.sort(key=lambda task: (task[0]["name"], task[1], task[2]))
+    logger.info("Exporting {} models with {} workers".format(len(tasks), num_workers))
+
+    results = []
+    # Spawned, not forked, since torch's thread pools don't survive fork
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(num_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(threads_per_worker,)) as executor:
+        futures = [executor.submit(export_one, spec, opset, variant, path, force) for spec, opset, variant, path in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "failed":
+                logger.error("[{}/{}] {}: {}".format(len(results), len(tasks), result["path"], result["error"]))
+            elif result["status"] == "cached":
+                logger.info("[{}/{}] {}: cached".format(len(results), len(tasks), result["path"]))
+            else:
+                logger.info("[{}/{}] {}: exported in {:.1f}s, checked in {:.1f}s".format(
+                    len(results), len(tasks), result["path"], result["export_time"], result["check_time"]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports PyTorch models to ONNX in parallel CPU worker processes, "
+                                                 "skipping exports whose model, weights, opset and axes didn't change.")
+    parser.add_argument("--spec", type=str, default=None, help="JSON file with a list of model specs, see normalize_spec().")
+    parser.add_argument("-m", "--models", nargs="+", default=[], help="torchvision model names to export, ex: alexnet resnet50.")
+    parser.add_argument("--input-shape", type=int, nargs="+", default=[1, 3, 224, 224],
+                        help="(--models only) Export input shape.")
+    parser.add_argument("--dynamic-batch", action="store_true", help="(--models only) Also export with a dynamic batch dimension.")
+    parser.add_argument("--opsets", type=int, nargs="+", default=[11], help="(--models only) ONNX opset versions to export.")
+    parser.add_argument("-o", "--output-dir", type=str, default="models", help="Directory to write the ONNX models to.")
+    parser.add_argument("-j", "--num-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Number of export processes.")
+    parser.add_argument("--threads-per-worker", type=int, default=2, help="torch intra-op threads in each export process.")
+    parser.add_argument("--force", action="store_true", help="Re-export models even if they are cached.")
+    args = parser.parse_args()
+
+    specs = []
+    if args.spec:
+        with open(args.spec, "r") as f:
+            specs.extend(json.load(f))
+    for name in args.models:
+        specs.append({"name": name, "inputs": {"input": args.input_shape}, "opsets": args.opsets,
+                      "dynamic_axes": {"input": {0: "batch_size"}, "output": {0: "batch_size"}} if args.dynamic_batch else None})
+    if not specs:
+        raise ValueError("ERROR: No models to export, use --spec and/or --models")
+    specs = [normalize_spec(spec) for spec in specs]
+
+    start = time.time()
+    results = export_models(specs, args.output_dir, args.num_workers, args.threads_per_worker, args.force)
+    statuses = [result["status"] for result in results]
+    logger.info("{} exported, {} cached, {} failed in {:.1f}s".format(
+        statuses.count("exported"), statuses.count("cached"), statuses.count("failed"), time.time() - start))
+    if "failed" in statuses:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+
+# Copyright 2020 NVIDIA Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+
+import os
+import json
+
+import pytest
+
+from export_models import cache_key, export_tasks, normalize_spec, sidecar_path
+
+MODELS_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "models.json")
+
+
+def key(spec, weights="abc", opset=11, variant="dynamic", torch_version="1.8.0"):
+    return cache_key(spec, weights, opset, spec["dynamic_axes"] if variant == "dynamic" else None, torch_version)
+
+
+@pytest.fixture
+def spec():
+    return normalize_spec({"name": "resnet50", "dynamic_axes": {"input": {"0": "batch_size"}}, "opsets": [11, 13]})
+
+
+def test_normalize_spec_defaults():
+    spec = normalize_spec({"name": "alexnet"})
+    assert spec == {
+        "name": "alexnet",
+        "model": "torchvision:alexnet",
+        "kwargs": {"pretrained": True},
+        "inputs": {"input": [1, 3, 224, 224]},
+        "outputs": ["output"],
+        "dynamic_axes": None,
+        "opsets": [11],
+        "fixed": True,
+    }
+    custom = normalize_spec({"name": "net", "model": "my_package.models:net", "kwargs": {"width": 2}},
+                            defaults={"opsets": [13]})
+    assert custom["kwargs"] == {"width": 2} and custom["opsets"] == [13]
+
+
+def test_normalize_spec_converts_axes_and_rejects_empty_exports(spec):
+    assert spec["dynamic_axes"] == {"input": {0: "batch_size"}}
+    with pytest.raises(ValueError):
+        normalize_spec({"name": "resnet50", "fixed": False})
+
+
+def test_models_json_specs_are_valid():
+    with open(MODELS_JSON) as f:
+        specs = [normalize_spec(spec) for spec in json.load(f)]
+    assert len({spec["name"] for spec in specs}) == len(specs)
+
+
+def test_export_tasks(spec, tmp_path):
+    fixed_only = normalize_spec({"name": "alexnet"})
+    tasks = export_tasks([spec, fixed_only], str(tmp_path))
+    assert [(task[0]["name"], task[1], task[2]) for task in tasks] == [
+        ("resnet50", 11, "fixed"), ("resnet50", 11, "dynamic"),
+        ("resnet50", 13, "fixed"), ("resnet50", 13, "dynamic"),
+        ("alexnet", 11, "fixed"),
+    ]
+    assert tasks[1][3] == os.path.join(str(tmp_path), "resnet50_opset11_dynamic.onnx")
+    assert sidecar_path(tasks[1][3]) == tasks[1][3] + ".export.json"
+
+
+def test_cache_key_is_stable(spec):
+    same = normalize_spec({"opsets": [11, 13], "dynamic_axes": {"input": {0: "batch_size"}}, "name": "resnet50"})
+    assert key(spec) == key(same)
+    # Only what affects the exported model matters, not which opsets are exported overall
+    assert key(spec) == key(dict(spec, opsets=[11]))
+    assert len(key(spec)) == 64
+
+
+@pytest.mark.parametrize("change", [
+    lambda spec: dict(spec, model="torchvision:resnet101"),
+    lambda spec: dict(spec, kwargs={"pretrained": False}),
+    lambda spec: dict(spec, inputs={"input": [8, 3, 224, 224]}),
+    lambda spec: dict(spec, outputs=["logits"]),
+    lambda spec: dict(spec, dynamic_axes={"input": {0: "N"}}),
+])
+def test_cache_key_changes_with_the_spec(spec, change):
+    assert key(change(spec)) != key(spec)
+
+
+def test_cache_key_changes_with_weights_opset_variant_and_torch(spec):
+    keys = {key(spec), key(spec, weights="def"), key(spec, opset=13), key(spec, variant="fixed"),
+            key(spec, torch_version="1.9.0")}
+    assert len(keys) == 5